@@ -8,3 +8,126 @@
 @Date       : 2024/5/30 17:05 
 @Description: 
 """
+import zlib
+
+import numpy as np
+from bson.binary import Binary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 数组文档 {NDArray: Binary, DType: '<f8', Shape: [...], Compression: 'zlib'}
+ARRAY_KEY = 'NDArray'
+COMPRESSIONS = (None, 'zlib', 'zstd')
+# 谱数据字段，float32模式下以单精度保存
+SPECTRA_FIELDS = frozenset({'TotalDos', 'PartialDOS', 'OpticalProperties', 'OtherOpticalProperties'})
+
+
+class ArrayCodec:
+    """
+    将文档中的数值数组(ndarray或嵌套的数值list)保存为带dtype和shape的BSON Binary，读取时用decode_document还原
+        codec = ArrayCodec('zlib', float32_fields=SPECTRA_FIELDS)
+        doc = codec.encode(cal_entry.to_bson())
+    """
+
+    def __init__(self, compression='zlib', level=None, min_size=256, float32_fields=()):
+        """
+        :param compression: None、'zlib'或'zstd'
+        :param level: 压缩级别，None时使用默认级别
+        :param min_size: 元素数少于该值的数组保留为list
+        :param float32_fields: 以单精度保存的字段名，该字段下的所有浮点数组都转为float32
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression}, expected one of {COMPRESSIONS}')
+        if compression == 'zstd' and zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        self.compression = compression
+        self.level = level
+        self.min_size = min_size
+        self.float32_fields = frozenset(float32_fields)
+
+    def compress(self, data):
+        if self.compression == 'zlib':
+            return zlib.compress(data, -1 if self.level is None else self.level)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compress(data)
+        return data
+
+    def encode_array(self, array, float32=False):
+        """
+        :param array: ndarray
+        :param float32: 浮点数组是否以单精度保存
+        :return: 数组文档
+        """
+        array = np.ascontiguousarray(array)
+        if float32 and array.dtype.kind == 'f':
+            array = array.astype(np.float32)
+        return {
+            ARRAY_KEY: Binary(self.compress(array.tobytes())),
+            'DType': array.dtype.str,
+            'Shape': list(array.shape),
+            'Compression': self.compression
+        }
+
+    def _asarray(self, value):
+        """
+        嵌套的数值list转为ndarray，不规则或含非数值元素时返回None
+        """
+        first = value
+        while isinstance(first, list) and first:
+            first = first[0]
+        if isinstance(first, list) or not isinstance(first, (int, float)):
+            return None
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            return None
+        return array if array.dtype.kind in 'biuf' else None
+
+    def encode(self, doc, float32=False):
+        """
+        返回新文档，其中元素数不少于min_size的数值数组替换为数组文档，不修改传入的文档
+        :param doc: 文档(dict)或其中的值
+        :param float32: 当前字段是否位于float32_fields之下
+        """
+        if isinstance(doc, dict):
+            return {key: self.encode(value, float32 or key in self.float32_fields) for key, value in doc.items()}
+        if isinstance(doc, np.ndarray):
+            return self.encode_array(doc, float32)
+        if isinstance(doc, list):
+            array = self._asarray(doc)
+            if array is None:
+                return [self.encode(value, float32) for value in doc]
+            if array.size >= self.min_size:
+                return self.encode_array(array, float32)
+        return doc
+
+
+def decode_array(doc):
+    """
+    数组文档还原为ndarray
+    """
+    data = bytes(doc[ARRAY_KEY])
+    compression = doc.get('Compression')
+    if compression == 'zlib':
+        data = zlib.decompress(data)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstd compression requires the zstandard package')
+        data = zstandard.ZstdDecompressor().decompress(data)
+    return np.frombuffer(data, dtype=np.dtype(doc['DType'])).reshape(doc['Shape'])
+
+
+def decode_document(doc):
+    """
+    将文档中所有的数组文档还原为ndarray
+    """
+    if isinstance(doc, dict):
+        if ARRAY_KEY in doc:
+            return decode_array(doc)
+        return {key: decode_document(value) for key, value in doc.items()}
+    if isinstance(doc, list):
+        return [decode_document(value) for value in doc]
+    return doc
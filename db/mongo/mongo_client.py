@@ -8,10 +8,23 @@
 @Date       : 2024/5/30 17:18 
 @Description: 
 """
+import time
+
 from gridfs import GridFS
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient, ReplaceOne
+from pymongo.errors import BulkWriteError
 import bson
 
+from db.mongo.bson import decode_document
+from db.mongo.storage import GRIDFS_FILES_KEY, MAX_DOCUMENT_SIZE, SIZE_MARGIN, decode_blob, encode_blob, \
+    join_document, split_document
+
+# 查询常用的字段，ensure_indexes为其建立索引
+INDEX_FIELDS = ('InputStructure.HashValue', 'InputStructure.Formula', 'InputStructure.SpaceGroup.spacegroupNumber',
+                'CalculationType')
+# upsert模式下用于去重的字段
+UPSERT_KEYS = ('SourcePath', 'InputStructure.HashValue', 'CalculationType')
+
 
 class Mongo:
     def __init__(self, host, port):
@@ -36,5 +49,207 @@ class Mongo:
         object_id = fs.put(bson_data)
         return object_id
 
+    def ensure_indexes(self, db, collections):
+        """
+        为各集合建立查询字段的索引及upsert去重用的复合索引，索引已存在时不做任何操作
+        :param db: 数据库名
+        :param collections: 集合名列表
+        """
+        for collection in collections:
+            conn = self.client[db][collection]
+            for field in INDEX_FIELDS:
+                conn.create_index([(field, ASCENDING)])
+            conn.create_index([(key, ASCENDING) for key in UPSERT_KEYS])
+
+    def save_split(self, data, db, limit=MAX_DOCUMENT_SIZE - SIZE_MARGIN):
+        """
+        文档超过limit时，将最大的数组字段逐个存入GridFS并替换为引用，标量字段保留在文档中
+        :param data: 文档
+        :param db: 数据库名
+        :param limit: 文档大小上限
+        :return: 可直接写入集合的文档
+        """
+        fs = GridFS(self.client[db])
+        file_ids = []
+
+        def put(value, path):
+            file_ids.append(fs.put(encode_blob(value), filename=path))
+            return file_ids[-1]
+
+        doc = split_document(data, put, limit)
+        if file_ids:
+            doc[GRIDFS_FILES_KEY] = file_ids
+        return doc
+
+    def load_split(self, data, db):
+        """
+        读取save_split拆分的文档，从GridFS中取回被拆分的字段，并将ArrayCodec保存的数组还原为ndarray
+        """
+        fs = GridFS(self.client[db])
+        data = {key: value for key, value in data.items() if key != GRIDFS_FILES_KEY}
+        return decode_document(join_document(data, lambda file_id: decode_blob(fs.get(file_id).read())))
+
+    def delete_files(self, db, file_ids):
+        """
+        删除save_split写入的GridFS文件
+        """
+        fs = GridFS(self.client[db])
+        for file_id in file_ids:
+            fs.delete(file_id)
+
+    def buffered(self, db, batch_size=100, flush_interval=10.0, on_error=None, upsert=False):
+        """
+        创建按集合缓存文档、批量写入的BufferedWriter
+        :param db: 数据库名
+        :param batch_size: 单个集合缓存的文档数达到该值时写入
+        :param flush_interval: 距上次写入超过该秒数时写入全部缓存
+        :param on_error: 写入失败的回调 on_error(key, error)，key为add时传入的标识
+        :param upsert: 为True时按UPSERT_KEYS替换已有文档，重复入库不产生重复文档
+        :return: BufferedWriter
+        """
+        return BufferedWriter(self, db, batch_size=batch_size, flush_interval=flush_interval, on_error=on_error,
+                              upsert=upsert)
+
     def close(self):
         self.client.close()
+
+
+class BufferedWriter:
+    """
+    按集合(计算类型)缓存文档，以无序insert_many批量写入；upsert模式下以无序的ReplaceOne(upsert=True)批量写入
+    可作为上下文管理器使用，退出时写入剩余的文档:
+        with mongo.buffered('VaspData') as writer:
+            writer.add(doc, 'StaticCalculation', key=path)
+    """
+
+    def __init__(self, mongo: Mongo, db, batch_size=100, flush_interval=10.0, on_error=None, upsert=False):
+        self.mongo = mongo
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.upsert = upsert
+        self.inserted = 0
+        # upsert模式下替换的已有文档数
+        self.replaced = 0
+        self.failed = 0
+        self._buffers = {}
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+        return False
+
+    def add(self, data, collection, key=None):
+        """
+        缓存一个文档，达到batch_size或flush_interval时写入
+        :param data: 文档
+        :param collection: 集合名
+        :param key: 文档标识(如计算目录)，写入失败时传给on_error
+        :return: 本次触发写入中失败的[(key, error)]
+        """
+        buffer = self._buffers.setdefault(collection, [])
+        buffer.append((key, data))
+        failures = []
+        if len(buffer) >= self.batch_size:
+            failures += self._flush_collection(collection)
+        return failures + self.flush_due()
+
+    def flush_due(self):
+        """
+        距上次写入超过flush_interval时写入全部缓存，长时间没有新文档时由调用方定期调用
+        :return: 失败的[(key, error)]
+        """
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            return self.flush()
+        return []
+
+    def flush(self):
+        """
+        写入所有集合中缓存的文档
+        :return: 失败的[(key, error)]
+        """
+        failures = []
+        for collection in list(self._buffers):
+            failures += self._flush_collection(collection)
+        self._last_flush = time.monotonic()
+        return failures
+
+    def _flush_collection(self, collection):
+        buffer = self._buffers.pop(collection, [])
+        if not buffer:
+            return []
+        keys = [key for key, _ in buffer]
+        docs = [data for _, data in buffer]
+        # 失败的文档序号 -> 错误信息
+        errors = {}
+        conn = self.mongo.client[self.db][collection]
+        try:
+            if self.upsert:
+                # 被替换的文档所引用的GridFS文件，替换成功后删除
+                old_files = self._stored_files(conn, docs)
+                result = conn.bulk_write([ReplaceOne(upsert_filter(doc), doc, upsert=True) for doc in docs],
+                                         ordered=False)
+                self.inserted += result.upserted_count
+                self.replaced += result.matched_count
+            else:
+                result = conn.insert_many(docs, ordered=False)
+                self.inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            # 无序写入时其余文档仍会写入，只有writeErrors中的文档失败
+            write_errors = e.details.get('writeErrors', [])
+            for error in write_errors:
+                errors[error['index']] = error.get('errmsg', str(error))
+            if self.upsert:
+                self.inserted += e.details.get('nUpserted', 0)
+                self.replaced += e.details.get('nMatched', 0)
+            else:
+                self.inserted += e.details.get('nInserted', len(docs) - len(write_errors))
+        except Exception as e:
+            errors = {index: f'{type(e).__name__}: {e}' for index in range(len(docs))}
+        # 写入失败的文档不再引用本次写入的GridFS文件；替换成功的文档不再引用原文档的GridFS文件
+        unused = [file_id for index in errors for file_id in docs[index].get(GRIDFS_FILES_KEY, ())]
+        if self.upsert and len(errors) < len(docs):
+            unused += [file_id for index, doc in enumerate(docs) if index not in errors
+                       for file_id in old_files.get(upsert_key(doc), ())]
+        if unused:
+            self.mongo.delete_files(self.db, unused)
+        failures = [(keys[index], error) for index, error in errors.items()]
+        self.failed += len(failures)
+        if self.on_error is not None:
+            for key, error in failures:
+                self.on_error(key, error)
+        return failures
+
+    @staticmethod
+    def _stored_files(conn, docs):
+        """
+        查询与docs具有相同upsert键的已有文档所引用的GridFS文件
+        :return: {upsert_key: [file_id]}
+        """
+        projection = {GRIDFS_FILES_KEY: 1, **{key: 1 for key in UPSERT_KEYS}}
+        query = {'$or': [upsert_filter(doc) for doc in docs], GRIDFS_FILES_KEY: {'$exists': True}}
+        return {upsert_key(stored): stored[GRIDFS_FILES_KEY] for stored in conn.find(query, projection)}
+
+
+def upsert_key(doc):
+    """
+    upsert_filter的值组成的元组，用于匹配查询到的已有文档
+    """
+    return tuple(upsert_filter(doc).values())
+
+
+def upsert_filter(doc):
+    """
+    upsert去重的查询条件，由文档中UPSERT_KEYS各字段的值组成，缺失的字段为None
+    """
+    query = {}
+    for key in UPSERT_KEYS:
+        value = doc
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        query[key] = value
+    return query
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project    : CalculationExtract
+@File       : storage.py
+@Description: 文档的BSON大小计算及超大字段拆分到GridFS
+"""
+from itertools import chain
+
+import bson
+
+# MongoDB单个文档的大小上限
+MAX_DOCUMENT_SIZE = 16 * 1024 * 1024
+# 为写入时添加的_id等字段预留的空间
+SIZE_MARGIN = 16 * 1024
+# 替换被拆分字段的引用中的键名
+GRIDFS_KEY = 'GridFS'
+# 拆分后的文档中记录全部GridFS文件id的字段，替换或写入失败时据此删除不再被引用的文件
+GRIDFS_FILES_KEY = 'GridFSFiles'
+
+
+def value_size(value):
+    """
+    value作为BSON元素值时编码后的字节数，与bson.encode的结果完全一致
+    标量按类型直接计算，字典逐个元素累加，其余值单独编码
+    """
+    if isinstance(value, bool) or value is None:
+        return 1 if isinstance(value, bool) else 0
+    if isinstance(value, float):
+        return 8
+    if type(value) is int:
+        return 4 if -2 ** 31 <= value < 2 ** 31 else 8
+    if isinstance(value, str):
+        return len(value.encode('utf8')) + 5
+    if isinstance(value, dict):
+        return document_size(value)
+    if isinstance(value, bytes):
+        # 长度4字节 + 子类型1字节 + 数据
+        return len(value) + 5
+    if isinstance(value, (list, tuple)):
+        return list_size(value)
+    # 文档长度4字节 + 类型1字节 + 空键名1字节 + 结尾1字节
+    return len(bson.encode({'': value})) - 7
+
+
+def index_keys_size(n):
+    """
+    BSON数组的键名'0'..'n-1'的总字节数(不含结尾的\\0)
+    """
+    total = 0
+    digits = 1
+    start = 0
+    while start < n:
+        stop = min(n, 10 ** digits)
+        total += (stop - start) * digits
+        start = stop
+        digits += 1
+    return total
+
+
+def list_size(values):
+    """
+    list编码为BSON数组的字节数，按元素直接计算，不做编码
+    数组文档长度4字节 + 结尾1字节，每个元素类型1字节 + 键名及结尾\\0 + 值
+    等长的嵌套list逐层展开，全为float时按每个8字节计算，其余情况逐个元素计算
+    """
+    size = 0
+    arrays = 1
+    items = values
+    types = set(map(type, items))
+    while True:
+        # 当前层共arrays个数组，每个数组len(items) // arrays个元素
+        size += 5 * arrays + 2 * len(items) + arrays * index_keys_size(len(items) // arrays)
+        if not items:
+            return size
+        if types == {float}:
+            return size + 8 * len(items)
+        if not types <= {list, tuple} or len(set(map(len, items))) != 1:
+            return size + sum(map(value_size, items))
+        # 先检查下一层的类型，全为float时不必展开
+        types = set(map(type, chain.from_iterable(items)))
+        if types == {float}:
+            count = len(items[0])
+            return size + len(items) * (5 + 10 * count + index_keys_size(count))
+        arrays = len(items)
+        items = list(chain.from_iterable(items))
+
+
+def element_size(key, value):
+    """
+    键值对作为BSON元素的字节数: 类型1字节 + 键名(以\\0结尾) + 值
+    """
+    return len(key.encode('utf8')) + 2 + value_size(value)
+
+
+def document_size(doc):
+    """
+    字典编码为BSON文档后的字节数
+    """
+    return 5 + sum(element_size(key, value) for key, value in doc.items())
+
+
+def field_sizes(doc, prefix=''):
+    """
+    计算文档大小，同时记录可以拆分到GridFS的字段(数组和二进制)
+    :return: (文档字节数, [(字段路径, 元素字节数)])
+    """
+    fields = []
+    size = 5
+    for key, value in doc.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            sub_size, sub_fields = field_sizes(value, path)
+            fields += sub_fields
+            size += len(key.encode('utf8')) + 2 + sub_size
+            continue
+        item_size = element_size(key, value)
+        if isinstance(value, (list, tuple, bytes)):
+            fields.append((path, item_size))
+        size += item_size
+    return size, fields
+
+
+def plan_split(doc, limit=MAX_DOCUMENT_SIZE - SIZE_MARGIN):
+    """
+    按字段从大到小选择需要拆分的字段，直到剩余文档不超过limit
+    标量字段(能隙、能量等)始终保留在文档中
+    :return: 需要拆分的字段路径，文档本身不超过limit时为空
+    """
+    size, fields = field_sizes(doc)
+    paths = []
+    for path, item_size in sorted(fields, key=lambda field: field[1], reverse=True):
+        if size <= limit:
+            break
+        key = path.rsplit('.', 1)[-1]
+        # 引用 {GridFS: ObjectId}
+        size -= item_size - (len(key.encode('utf8')) + 2 + document_size({GRIDFS_KEY: bson.ObjectId()}))
+        paths.append(path)
+    if size > limit:
+        raise ValueError(f'Document is still {size} bytes after moving all arrays to GridFS')
+    return paths
+
+
+def split_document(doc, put, limit=MAX_DOCUMENT_SIZE - SIZE_MARGIN):
+    """
+    将超大字段替换为 {GridFS: file_id}，不修改传入的文档
+    :param doc: 文档
+    :param put: put(value, path) 保存字段值并返回file_id
+    :param limit: 文档大小上限
+    :return: 拆分后的文档
+    """
+    paths = plan_split(doc, limit)
+    if not paths:
+        return doc
+    doc = dict(doc)
+    for path in paths:
+        keys = path.split('.')
+        parent = doc
+        for key in keys[:-1]:
+            # 沿路径复制字典
+            parent[key] = dict(parent[key])
+            parent = parent[key]
+        parent[keys[-1]] = {GRIDFS_KEY: put(parent[keys[-1]], path)}
+    return doc
+
+
+def join_document(doc, get):
+    """
+    split_document的逆过程，将引用替换为GridFS中保存的值
+    :param get: get(file_id) 返回保存的字段值
+    """
+    if not isinstance(doc, dict):
+        return doc
+    if len(doc) == 1 and isinstance(doc.get(GRIDFS_KEY), bson.ObjectId):
+        return get(doc[GRIDFS_KEY])
+    return {key: join_document(value, get) for key, value in doc.items()}
+
+
+def encode_blob(value):
+    return bson.encode({'Data': value})
+
+
+def decode_blob(data):
+    return bson.decode(data)['Data']
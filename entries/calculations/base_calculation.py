@@ -10,7 +10,7 @@
 """
 from abc import ABC, abstractmethod
 
-from public.tools.periodic_table import PTable
+from public.tools.periodic_table import getPTable
 
 
 class BaseCalculation(ABC):
@@ -18,38 +18,41 @@ class BaseCalculation(ABC):
         self.structure = None
         self.file_parser = file_parsers
         self.parm = None
+        # 谱数据等大数组保留为ndarray，由ArrayCodec直接编码
+        self.asarray = False
         self.vasprunParser = None
         if 'outcar' in file_parsers:
             self.outcarParser = file_parsers['outcar']
         else:
             self.outcarParser = None
         self.parm = {}
+        self._input_structure = None
+        # vasprun.xml的基本信息通过可缓存的方法读取，全部缓存命中时不解析vasprun.xml
+        header = file_parsers['vasprun'].getHeader() if 'vasprun' in file_parsers else None
         if 'vasprun' in file_parsers and 'incar' in file_parsers:
-            self.parm = file_parsers['vasprun'].parameters
+            self.parm = header['Parameters']
             self.parm= file_parsers['incar'].fill_parameters(self.parm)
         elif 'vasprun' in file_parsers:
-            self.parm = file_parsers['vasprun'].parameters
+            self.parm = header['Parameters']
         elif 'incar' in file_parsers:
             self.parm = file_parsers['incar'].fill_parameters(self.parm)
         if 'kpoints' in file_parsers and 'Kpoints' not in self.parm:
             self.parm['kpoints'] = file_parsers['kpoints'].getKpoints()
         if 'vasprun' in file_parsers:
             self.vasprunParser = file_parsers['vasprun']
-            self.vasprunParser.setup()
-            self.input_structure = self.vasprunParser.input_structure
-            self.output_structure = self.vasprunParser.output_structure
+            structures = self.vasprunParser.getStructureDocs()
 
             self.basicDoc = {
-                'InputStructure': self.input_structure.to_bson(),
-                'OutputStructure': self.output_structure.to_bson(),
+                'InputStructure': structures['InputStructure'],
+                'OutputStructure': structures['OutputStructure'],
                 'Parameters': self.parm,
-                'Software': self.vasprunParser.software,
-                'StartTime': self.vasprunParser.startTime,
+                'Software': header['Software'],
+                'StartTime': header['StartTime'],
                 'ResourceUsage': self.outcarParser.getResourceUsage() if self.outcarParser else {},
                 'ProcessData': {},
                 'Properties': {},
                 'Files': [],
-                'CalculationType': self.vasprunParser.calculationType,
+                'CalculationType': header['CalculationType'],
             }
         elif 'poscar' in file_parsers and 'incar' in file_parsers:
             self.poscarParser = file_parsers['poscar']
@@ -73,6 +76,28 @@ class BaseCalculation(ABC):
         else:
             self.oszicarParser = None
 
+    @property
+    def input_structure(self):
+        """
+        初始结构，只有vasprun.xml时按需解析
+        """
+        if self._input_structure is None and self.vasprunParser is not None:
+            self.vasprunParser.setup()
+            return self.vasprunParser.input_structure
+        return self._input_structure
+
+    @input_structure.setter
+    def input_structure(self, structure):
+        self._input_structure = structure
+
+    def getFiles(self):
+        """
+        参与解析的文件路径，惰性注册表只返回文件名而不创建解析器
+        """
+        if hasattr(self.file_parser, 'filenames'):
+            return self.file_parser.filenames()
+        return [parser.filename for parser in self.file_parser.values()]
+
     def getElectronicSteps(self):
         ele_vasprun = None
         para = self.parm['EDIFF']
@@ -103,15 +128,13 @@ class BaseCalculation(ABC):
             }
             return doc
         fermienergy = 0
-        child = self.vasprunParser.root.find("./calculation[last()]/energy/i[@name='e_fr_energy']")
-        if child is None:
-            child = self.vasprunParser.root.find("./energy/i[@name='e_fr_energy']")
-        totalenergy = float(child.text)
-        numberofatoms = int(self.vasprunParser.root.find("./atominfo/atoms").text)
+        energy = self.vasprunParser.getFinalEnergy()
+        totalenergy = energy['TotalEnergy']
+        numberofatoms = energy['NumberOfAtoms']
         if self.vasprunParser is not None:
-            child = self.vasprunParser.root.find("./calculation[last()]/dos/i[@name='efermi']")
-            if child is not None:
-                fermienergy = float(child.text)
+            efermi = energy['Efermi']
+            if efermi is not None:
+                fermienergy = efermi
             elif 'outcar' in self.file_parser:
                 fermienergy = self.file_parser['outcar'].getEfermi()
         if fermienergy == 0:
@@ -123,16 +146,17 @@ class BaseCalculation(ABC):
             }
         energyPerAtom = totalenergy / numberofatoms
         formation_energy = 0.0
-        composition = self.vasprunParser.composition
+        composition = energy['Composition']
         energy_atoms = 0.
-        for comp in composition:
-            if comp.atomic_symbol in PTable().atom_energy:
-                energy_atoms += PTable().atom_energy[comp.atomic_symbol] * comp.amount
+        atom_energy = getPTable().atom_energy
+        for symbol, amount in composition.items():
+            if symbol in atom_energy:
+                energy_atoms += atom_energy[symbol] * amount
             else:
                 energy_atoms = 0.
                 break
         if energy_atoms != 0.:
-            formation_energy = (totalenergy - energy_atoms) / self.vasprunParser.numberOfSites
+            formation_energy = (totalenergy - energy_atoms) / numberofatoms
 
         doc = {
             'TotalEnergy': totalenergy,
@@ -9,7 +9,9 @@
 @Description: 
 """
 from public.lattice import Lattice
+from public.sites import Site
 from public.structure import Structure
+from public.tools.gap import gapDoc
 from .base_calculation import BaseCalculation
 import numpy as np
 
@@ -25,14 +27,20 @@ class GeometryOptimization(BaseCalculation):
         ionic_steps_vasprun = None
         ionic_steps_oszicar = None
         if self.vasprunParser is not None:
-            ionic_steps_vasprun =  self.vasprunParser.getIonicSteps()
+            try:
+                ionic_steps_vasprun = self.vasprunParser.getIonicSteps()
+            except (IndexError, KeyError, ValueError, AttributeError):
+                # vasprun.xml被截断，离子步不完整
+                ionic_steps_vasprun = None
+        if ionic_steps_vasprun is None and self.outcarParser is not None:
+            ionic_steps_vasprun = self.getIonicStepsFromOutcar()
         if 'oszicar' in self.file_parser:
             ionic_steps_oszicar = self.file_parser['oszicar'].getIonicSteps()
         if ionic_steps_vasprun is not None and ionic_steps_oszicar is not None:
             if not self.compare_with_tolerance(ionic_steps_vasprun, ionic_steps_oszicar):
                 # Handle the case where the results do not match within tolerance
                 print("Warning: Mismatch between vasprun and oszicar ionic steps beyond tolerance.")
-                print(self.vasprunParser.filename)
+                print(self.vasprunParser.filename if self.vasprunParser else self.outcarParser.filename)
                 return {
                     "vasprun": ionic_steps_vasprun,
                     "oszicar": ionic_steps_oszicar
@@ -40,157 +48,73 @@ class GeometryOptimization(BaseCalculation):
         return ionic_steps_vasprun if ionic_steps_vasprun is not None else (
             ionic_steps_oszicar if ionic_steps_oszicar is not None else {})
 
-    def getGapFromBand(self):
+    def getIonicStepsFromOutcar(self):
         """
-                    能带能隙
-                    :return
-                """
-        if self.vasprunParser is not None:
-            eigenval = self.vasprunParser.getEigenValues()
-        elif 'eigenval' in self.file_parser:
-            eigenval = self.file_parser['eigenval'].getEigenValues()
+        vasprun.xml缺失或被截断时，从OUTCAR流式读取离子步，格式与Vasprun.getIonicSteps相同
+        :return: dict，OUTCAR中没有完整离子步时返回None
+        """
+        sites = self.input_structure.sites
+        composition = self.input_structure.composition
+        energys = []
+        structures = []
+        all_forces = []
+        stresses = []
+        for step in self.outcarParser.iterIonicSteps():
+            if step['Lattice'] is None or step['Positions'] is None:
+                continue
+            energys.append(step['FreeEnergy'])
+            fractional = step['Positions'] @ np.linalg.inv(step['Lattice'])
+            sites_new = [Site(coords.tolist(), site.atom) for coords, site in zip(fractional, sites)]
+            structure = Structure(lattice=Lattice(step['Lattice']), composition=composition, sites=sites_new)
+            structure.setup()
+            structures.append(structure.to_bson())
+            all_forces.append([{'Force': force.tolist(),
+                                'Atom': {
+                                    'AtomicSymbol': site.atom.atomicsymbol,
+                                    'AtomicNumber': site.atom.atomicnumber,
+                                    'AtomicMass': site.atom.atomicmass
+                                }} for force, site in zip(step['Forces'], sites)])
+            if step['Stress'] is not None:
+                stresses.append(step['Stress'].tolist())
+        if not energys:
+            return None
+        totalenergydiffs = np.diff(energys, prepend=0.0).tolist()
+        ionicsteps = {
+            'TotalEnergy': energys,
+            'StepStructure': structures,
+            'StepForces': all_forces,
+            'StepStress': stresses,
+            'TotalEnergyDiff': totalenergydiffs
+        }
+        para = self.parm.get('EDIFFG', 10 * self.parm.get('EDIFF', 1e-4))
+        if para >= 0:
+            ionicsteps['IonConvergency'] = totalenergydiffs[-1] <= para
         else:
-            return {}
-        if not eigenval:
-            return {}
-        isSpin = eigenval["IsSpinPolarized"]
-        number = eigenval["NumberOfGeneratedKPoints"]
-        BandsNum = eigenval["NumberOfBand"]
-        Energies = eigenval["EigenvalData"]
-        Kpoints = eigenval["KPoints"]
+            ionicsteps['IonConvergency'] = all(abs(ele) <= abs(para) for line in all_forces[-1] for ele in line['Force'])
+        return ionicsteps
+
+    def getGapFromBand(self):
+        """
+        能带能隙
+        :return
+        """
         if self.vasprunParser is not None:
-            efermi = eigenval["FermiEnergy"]
-        elif 'outcar' in self.file_parser:
+            arrays = self.vasprunParser.getEigenValueArrays()
+            if arrays is None:
+                return {}
+            eigenvalues = arrays[0]
+            efermi = self.vasprunParser.getEfermi()
+        elif 'eigenval' in self.file_parser and 'outcar' in self.file_parser:
+            eigenval = self.file_parser['eigenval']
+            if len(eigenval.lines) < 7:
+                return {}
+            eigenvalues = eigenval.getArrays()['eigenvalues']
             efermi = self.file_parser['outcar'].getEfermi()
         else:
             return {}
-        energies = []
-        kpoints = []
-        if "N/A" in Energies:
+        if efermi is None:
             return {}
-        for t in Energies.values():
-            energies.append(t)
-            kpoints.append(Kpoints)  # 存储两份kpoints，用于自旋情况计算能隙标记
-        energies = np.array(energies)
-        # print(energies)
-        energies = energies - efermi
-        # print(kpoints)
-
-        if isSpin:
-            index00 = []
-            index10 = []
-            index01 = []
-            index11 = []
-            vbmE0 = []  # cbm data
-            cbmE0 = []  # vbm data
-            vbmE1 = []  # cbm data
-            cbmE1 = []  # vbm data
-            kindex0 = -1
-            kindex1 = -1
-            for i in range(BandsNum):
-                if min(energies[0][i]) * max(energies[0][i]) < 0:
-                    return {"GapFromBand": "Metal"}
-                else:
-                    if min(energies[0][i]) < 0.0 or min(energies[0][i]) == 0.0:  # below fermi
-                        for j in range(number):
-                            if energies[0][i][j] == max(energies[0][i]):
-                                index00.append(j)
-                                vbmE0.append(energies[0][i][j])
-                                # print("the vbm band number is :", i, "kpints is :", kpoints[0][j], "energy is :",
-                                #       energies[0][i][j])
-                    else:  # above fermi
-                        for j in range(number):
-                            if energies[0][i][j] == min(energies[0][i]):
-                                index01.append(j)
-                                cbmE0.append(energies[0][i][j])
-                                # print("the cbm band number is :", i, "kpints is :", kpoints[0][j], "energy is :",
-                                #       energies[0][i][j])
-                    # print(index00, index01)
-
-                if min(energies[1][i]) * max(energies[1][i]) < 0:
-                    return {"GapFromBand": "Metal"}
-                else:
-                    if min(energies[1][i]) < 0.0 or min(energies[1][i]) == 0.0:  # below fermi
-                        for j in range(number):
-                            if energies[1][i][j] == max(energies[1][i]):
-                                index10.append(j)
-                                vbmE1.append(energies[1][i][j])
-                                # print("the vbm band number is :", i, "kpints is :", kpoints[1][j], "energy is :",
-                                #       energies[1][i][j])
-                    else:  # above fermi
-                        for j in range(number):
-                            if energies[1][i][j] == min(energies[1][i]):
-                                index11.append(j)
-                                cbmE1.append(energies[1][i][j])
-                                # print("the cbm band number is :", i, "kpints is :", kpoints[1][j], "energy is :",
-                                #       energies[1][i][j])
-
-            if min(cbmE0) < min(cbmE1):
-                cbmEnergy = min(cbmE0)
-                kindex1 = cbmE0.index(cbmEnergy)
-            else:
-                cbmEnergy = min(cbmE1)
-                kindex1 = cbmE1.index(cbmEnergy)
-            if max(vbmE0) < max(vbmE1):
-                vbmEnergy = max(vbmE1)
-                kindex0 = vbmE1.index(vbmEnergy)
-            else:
-                vbmEnergy = max(vbmE0)
-                kindex0 = vbmE0.index(vbmEnergy)
-
-            gapValue = cbmEnergy - vbmEnergy
-            if kindex0 == kindex1:
-                gaptype = "direct gap"
-            else:
-                gaptype = "indirect gap"
-            return {
-                "GapFromBand": gapValue,
-                "GapType": gaptype,
-                "VBMFromBand": vbmEnergy,
-                "CBMFromBand": cbmEnergy
-            }
-        else:
-            index00 = []
-            index01 = []
-            vbmE0 = []  # cbm data
-            cbmE0 = []  # vbm data
-            kindex0 = -1
-            kindex1 = -1
-            for i in range(BandsNum):
-                if min(energies[0][i]) * max(energies[0][i]) < 0:
-                    return {"GapFromBand": "Metal"}
-                else:
-                    if min(energies[0][i]) < 0.0 or min(energies[0][i]) == 0.0:  # below fermi
-                        for j in range(number):
-                            if energies[0][i][j] == max(energies[0][i]):
-                                index00.append(j)
-                                vbmE0.append(energies[0][i][j])
-                                # print("the vbm band number is :", i, "kpints is :", kpoints[0][j], "energy is :",
-                                #       energies[0][i][j])
-                    else:  # above fermi
-                        for j in range(number):
-                            if energies[0][i][j] == min(energies[0][i]):
-                                index01.append(j)
-                                cbmE0.append(energies[0][i][j])
-                                # print("the cbm band number is :", i, "kpints is :", kpoints[0][j], "energy is :",
-                                #       energies[0][i][j])
-                    # print(index00, index01)
-
-            cbmEnergy = min(cbmE0)
-            kindex1 = cbmE0.index(cbmEnergy)
-            vbmEnergy = max(vbmE0)
-            kindex0 = vbmE0.index(vbmEnergy)
-            gapValue = cbmEnergy - vbmEnergy
-            if kindex0 == kindex1:
-                gaptype = "direct gap"
-            else:
-                gaptype = "indirect gap"
-            return {
-                "GapFromBand": gapValue,
-                "GapType": gaptype,
-                "VBMFromBand": vbmEnergy,
-                "CBMFromBand": cbmEnergy
-            }
+        return gapDoc(eigenvalues, efermi)
 
 
     def to_bson(self):
@@ -202,6 +126,6 @@ class GeometryOptimization(BaseCalculation):
         doc['Properties'] = {
             'GapFromGeo': self.getGapFromBand()  # TODO: gapFromGeo的计算方法和gapFromBand一样？
         }
-        doc['Files'] = [parser.filename for parser in self.file_parser.values()]
+        doc['Files'] = self.getFiles()
 
         return doc
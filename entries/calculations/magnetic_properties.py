@@ -39,6 +39,6 @@ class MagneticProperties(BaseCalculation):
                 'LinearMagneticMoment': self.linearMagneticMoment,
             },
         }
-        doc['Files'] = [parser.filename for parser in self.file_parser.values()]
+        doc['Files'] = self.getFiles()
 
         return doc
\ No newline at end of file
@@ -47,6 +47,6 @@ class StaticCalculation(BaseCalculation):
             },
             'ChgcarInfo': self.getChgcarInfo()
         }
-        doc['Files'] = [parser.filename for parser in self.file_parser.values()]
+        doc['Files'] = self.getFiles()
 
         return doc
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project    : CalculationExtract
+@File       : cache.py
+@Description: 以源文件指纹为键的解析结果磁盘缓存
+"""
+import hashlib
+import json
+import os
+import threading
+import warnings
+
+import numpy as np
+
+from i_o.manifest import fileHash
+
+# 元素数不少于该值的数值list以数组保存
+MIN_ARRAY_SIZE = 64
+
+
+class ParseCache:
+    """
+    解析器方法的返回值(数组与标量元数据)保存为npz文件，源文件大小与修改时间(可选内容md5)不变时直接载入
+    缓存总大小超过max_bytes时按最近使用时间淘汰，命中时更新文件修改时间作为使用时间
+    """
+
+    def __init__(self, directory, max_bytes=10 * 1024 ** 3, use_hash=False):
+        """
+        :param directory: 缓存目录
+        :param max_bytes: 缓存总大小上限(字节)
+        :param use_hash: 源文件大小相同但修改时间变化时，再比较内容md5
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+        self._hashes = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """
+        :return: [(修改时间, 大小, 路径)]
+        """
+        entries = []
+        with os.scandir(self.directory) as it:
+            for sub in it:
+                if not sub.is_dir():
+                    continue
+                with os.scandir(sub.path) as files:
+                    for entry in files:
+                        if entry.name.endswith('.npz'):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def cacheFile(self, path, method, args=()):
+        key = hashlib.md5(f'{os.path.abspath(path)}|{method}|{args!r}'.encode('utf8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def _contentHash(self, path):
+        if path not in self._hashes:
+            self._hashes[path] = fileHash(path)
+        return self._hashes[path]
+
+    def get(self, path, method, args=()):
+        """
+        :return: (是否命中, 返回值)
+        """
+        cache_file = self.cacheFile(path, method, args)
+        if not os.path.exists(cache_file):
+            self.misses += 1
+            return False, None
+        stat = os.stat(path)
+        try:
+            with np.load(cache_file) as cached:
+                meta = json.loads(str(cached['meta']))
+                fresh = meta['size'] == stat.st_size and (
+                        meta['mtime'] == stat.st_mtime_ns or
+                        self.use_hash and meta['hash'] is not None and meta['hash'] == self._contentHash(path))
+                value = unpackValue(meta['value'], cached) if fresh else None
+        except (OSError, ValueError, KeyError):
+            fresh = False
+        if not fresh:
+            self.misses += 1
+            return False, None
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
+        self.hits += 1
+        return True, value
+
+    def put(self, path, method, args, value):
+        """
+        保存返回值，值中含有无法保存的对象(非字符串键、自定义类等)时不缓存
+        :return: 是否保存
+        """
+        arrays = {}
+        try:
+            packed = packValue(value, arrays)
+        except TypeError:
+            return False
+        stat = os.stat(path)
+        meta = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'hash': self._contentHash(path) if self.use_hash else None, 'value': packed}
+        cache_file = self.cacheFile(path, method, args)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp.npz'
+        try:
+            np.savez(tmp_file, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            warnings.warn(f"Cannot write parse cache {cache_file}: {e}")
+            return False
+        with self._lock:
+            self._size += os.path.getsize(cache_file)
+            if self._size > self.max_bytes:
+                self.evict()
+        return True
+
+    def evict(self, target=None):
+        """
+        按使用时间从旧到新删除缓存文件，直到总大小不超过target(默认max_bytes的90%)
+        """
+        target = int(self.max_bytes * 0.9) if target is None else target
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+
+def _asarray(value):
+    """
+    嵌套的数值list转为ndarray，不规则或含非数值元素时返回None
+    """
+    first = value
+    while isinstance(first, list) and first:
+        first = first[0]
+    if isinstance(first, list) or not isinstance(first, (int, float)):
+        return None
+    try:
+        array = np.asarray(value)
+    except ValueError:
+        return None
+    return array if array.dtype.kind in 'biuf' else None
+
+
+def packValue(value, arrays):
+    """
+    返回值转为可json序列化的结构，数组存入arrays并以{'__array__': 名称}代替
+    :raise TypeError: 含有无法保存的对象
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind not in 'biufcU':
+            raise TypeError(f'cannot cache array of dtype {value.dtype}')
+        name = f'a{len(arrays)}'
+        arrays[name] = value
+        return {'__array__': name}
+    if isinstance(value, list):
+        array = _asarray(value) if len(value) else None
+        if array is not None and array.size >= MIN_ARRAY_SIZE:
+            packed = packValue(array, arrays)
+            packed['list'] = True
+            return packed
+        return [packValue(item, arrays) for item in value]
+    if isinstance(value, tuple):
+        return {'__tuple__': [packValue(item, arrays) for item in value]}
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value) or '__array__' in value or '__tuple__' in value:
+            raise TypeError('cannot cache dict with non-string or reserved keys')
+        return {key: packValue(item, arrays) for key, item in value.items()}
+    raise TypeError(f'cannot cache {type(value).__name__}')
+
+
+def unpackValue(packed, arrays):
+    if isinstance(packed, list):
+        return [unpackValue(item, arrays) for item in packed]
+    if isinstance(packed, dict):
+        if '__array__' in packed:
+            array = arrays[packed['__array__']]
+            return array.tolist() if packed.get('list') else array
+        if '__tuple__' in packed:
+            return tuple(unpackValue(item, arrays) for item in packed['__tuple__'])
+        return {key: unpackValue(item, arrays) for key, item in packed.items()}
+    return packed
+
+
+class CachedParser:
+    """
+    解析器代理，methods中的方法先查询ParseCache，全部命中时不创建解析器(不读取文件)
+    其他属性访问时才创建解析器，只对参数均为数值的位置参数调用做缓存
+    """
+
+    def __init__(self, factory, path, cache: ParseCache, methods):
+        """
+        :param factory: 创建解析器的函数(path)
+        :param path: 文件路径
+        :param cache: ParseCache
+        :param methods: 缓存的方法名，方法需无副作用，返回值只由文件内容决定
+        """
+        self.filename = path
+        self._factory = factory
+        self._cache = cache
+        self._methods = frozenset(methods)
+        self._parser = None
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            self._parser = self._factory(self.filename)
+        return self._parser
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._methods:
+            return getattr(self.parser, name)
+
+        def cached(*args, **kwargs):
+            # 关键字参数及非数值参数不缓存，直接调用解析器
+            if kwargs or not all(arg is None or isinstance(arg, (bool, int, float)) for arg in args):
+                return getattr(self.parser, name)(*args, **kwargs)
+            hit, value = self._cache.get(self.filename, name, args)
+            if hit:
+                return value
+            value = getattr(self.parser, name)(*args)
+            self._cache.put(self.filename, name, args, value)
+            return value
+
+        return cached
+
+
+parseCache = None
+
+
+def setParseCache(cache: ParseCache):
+    """
+    设置进程内共享的解析结果缓存，为None时不缓存
+    """
+    global parseCache
+    parseCache = cache
+
+
+def getParseCache() -> ParseCache:
+    return parseCache
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project    : CalculationExtract
+@File       : discovery.py
+@Description: 基于os.scandir的并行计算目录发现
+"""
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Set
+
+
+def _scanDirectory(path, markers):
+    """
+    扫描单个目录，DirEntry自带文件类型，无需对每一项再调用stat
+    :return: (是否为计算目录, 子目录列表)
+    """
+    is_calculation = False
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name in markers:
+                    is_calculation = True
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                except OSError:
+                    continue
+    except (PermissionError, FileNotFoundError, NotADirectoryError):
+        pass
+    return is_calculation, subdirs
+
+
+def discoverPaths(rootPath: str, markers: Set[str], workers: int = 8) -> Iterator[str]:
+    """
+    多线程遍历目录树，边发现边返回包含markers中任一文件的计算目录
+    与findPaths相同，计算目录的子目录也会继续遍历；返回顺序与完成顺序有关
+    :param rootPath: 根目录
+    :param markers: 计算目录的标志文件名
+    :param workers: 扫描线程数
+    :return: 计算目录的生成器
+    """
+    # 完成的扫描任务由回调放入队列，每次只取一个结果，不必反复等待全部未完成的任务
+    results = queue.Queue()
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(path):
+        future = executor.submit(_scanDirectory, path, markers)
+        future.add_done_callback(lambda f: results.put((path, f)))
+
+    try:
+        submit(rootPath)
+        outstanding = 1
+        while outstanding:
+            path, future = results.get()
+            outstanding -= 1
+            is_calculation, subdirs = future.result()
+            for subdir in subdirs:
+                submit(subdir)
+            outstanding += len(subdirs)
+            if is_calculation:
+                yield path
+    finally:
+        # 生成器被提前关闭时取消剩余的扫描任务，不等待其完成
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def cachedDiscoverPaths(rootPath: str, markers: Set[str], cacheFile: str, workers: int = 8) -> Iterator[str]:
+    """
+    带缓存的目录发现，缓存为每行一个路径的文本文件
+    发现过程中边返回边追加写入cacheFile.partial，完整遍历后再重命名为cacheFile；
+    cacheFile已存在时直接逐行读取
+    :param rootPath: 根目录
+    :param markers: 计算目录的标志文件名
+    :param cacheFile: 缓存文件路径
+    :param workers: 扫描线程数
+    :return: 计算目录的生成器
+    """
+    if os.path.exists(cacheFile):
+        with open(cacheFile, 'r', encoding='utf8') as f:
+            for line in f:
+                path = line.rstrip('\n')
+                if path:
+                    yield path
+        return
+    partial_file = cacheFile + '.partial'
+    with open(partial_file, 'w', encoding='utf8') as f:
+        for path in discoverPaths(rootPath, markers, workers):
+            f.write(path + '\n')
+            yield path
+    os.replace(partial_file, cacheFile)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project    : CalculationExtract
+@File       : manifest.py
+@Description: 增量提取使用的文件指纹清单
+"""
+import hashlib
+import json
+import os
+
+
+class Manifest:
+    """
+    记录每个计算目录已入库时的文件指纹(文件名、大小、修改时间，可选内容md5)及提取的集合，
+    再次运行时跳过指纹未变化的目录
+    """
+
+    def __init__(self, path, file_names, use_hash=False):
+        """
+        :param path: 清单json文件路径
+        :param file_names: 参与指纹计算的文件名(大写)，如user_view.parser_files
+        :param use_hash: 大小相同但修改时间变化时，再比较内容md5
+        """
+        self.path = path
+        self.file_names = file_names
+        self.use_hash = use_hash
+        self.entries = {}
+        self.skipped = 0
+        self._pending = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf8') as f:
+                self.entries = json.load(f)
+
+    def fingerprint(self, directory):
+        """
+        :return: {文件名: [大小, 修改时间(ns)]}
+        """
+        files = {}
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.upper() in self.file_names and entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = [stat.st_size, stat.st_mtime_ns]
+        return files
+
+    def changed(self, directory, collections):
+        """
+        判断目录自上次入库后是否变化，变化的目录记为待确认，入库后调用done
+        :param directory: 计算目录
+        :param collections: 本次提取的集合，与上次不同时视为变化
+        :return: bool
+        """
+        files = self.fingerprint(directory)
+        collections = sorted(collections)
+        old = self.entries.get(directory)
+        unchanged = (old is not None and old['collections'] == collections and
+                     self._sameFiles(directory, old['files'], files))
+        if unchanged:
+            self.skipped += 1
+            return False
+        self._pending[directory] = {'files': files, 'collections': collections}
+        return True
+
+    def _sameFiles(self, directory, old, new):
+        if old.keys() != new.keys():
+            return False
+        for name, (size, mtime) in new.items():
+            old_size, old_mtime = old[name][:2]
+            if size != old_size:
+                return False
+            if mtime == old_mtime:
+                continue
+            if not self.use_hash or len(old[name]) < 3 or fileHash(os.path.join(directory, name)) != old[name][2]:
+                return False
+            # 内容未变，只更新修改时间
+            old[name][1] = mtime
+        return True
+
+    def hashFiles(self, directory):
+        """
+        use_hash时待确认目录中需要计算md5的文件名，交给解析该目录的子进程计算
+        :return: list，不需要计算时为None
+        """
+        entry = self._pending.get(directory)
+        if entry is None or not self.use_hash:
+            return None
+        return list(entry['files'])
+
+    def done(self, directory, hashes=None):
+        """
+        目录已提取(或确认无法提取)，将待确认的指纹写入清单
+        :param hashes: {文件名: md5}，子进程已用fileHashes计算时传入，缺少的文件在此计算
+        """
+        entry = self._pending.pop(directory, None)
+        if entry is None:
+            return
+        if self.use_hash:
+            hashes = hashes or {}
+            for name, fp in entry['files'].items():
+                fp.append(hashes[name] if name in hashes else fileHash(os.path.join(directory, name)))
+        self.entries[directory] = entry
+
+    def discard(self, directory):
+        """
+        入库失败，移除该目录的指纹以便下次重新提取
+        """
+        self._pending.pop(directory, None)
+        self.entries.pop(directory, None)
+
+    def save(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def fileHashes(directory, names):
+    """
+    :return: {文件名: md5}
+    """
+    return {name: fileHash(os.path.join(directory, name)) for name in names}
+
+
+def fileHash(path, chunk_size=1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
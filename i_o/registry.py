@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project    : CalculationExtract
+@File       : registry.py
+@Description: 计算目录的惰性解析器注册表
+"""
+import os
+import warnings
+from collections.abc import Mapping
+
+from i_o.cache import CachedParser, ParseCache
+
+
+class ParserRegistry(Mapping):
+    """
+    只列出一次目录，解析器在第一次被访问时才创建(读取文件)
+    用法与原先的file_parsers字典相同: 'outcar' in parsers / parsers['outcar']
+    注意values()/items()会创建全部解析器，只需文件名时使用filenames()
+    """
+
+    def __init__(self, directory, factories: dict, first=(), cache: ParseCache = None, cached_methods: dict = None,
+                 checks: dict = None):
+        """
+        :param directory: 计算目录
+        :param factories: {大写文件名: (键名, 创建解析器的函数(path))}
+        :param first: 优先排列的键名，保持与原先file_parsers相同的顺序
+        :param cache: ParseCache，不为None时cached_methods中的方法返回值从缓存读取
+        :param cached_methods: {键名: 缓存的方法名}
+        :param checks: {键名: 检查函数(path)}，返回False的文件(如被截断的vasprun.xml)不注册，由其他文件代替
+        """
+        self.directory = directory
+        self.cache = cache
+        self.cached_methods = cached_methods or {}
+        self._paths = {}
+        self._factories = {}
+        self._parsers = {}
+        found = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                name = entry.name.upper()
+                if name in factories:
+                    key, factory = factories[name]
+                    found.append((key not in first, key, entry.path, factory))
+        # 同一优先级内保持目录顺序
+        found.sort(key=lambda item: item[0])
+        checks = checks or {}
+        for _, key, path, factory in found:
+            if key in checks and not checks[key](path):
+                warnings.warn(f"File {path} is incomplete, skipped.")
+                continue
+            self._paths[key] = path
+            self._factories[key] = factory
+
+    def __getitem__(self, key):
+        if key not in self._parsers:
+            if key not in self._factories:
+                raise KeyError(key)
+            if self.cache is not None and key in self.cached_methods:
+                self._parsers[key] = CachedParser(self._factories[key], self._paths[key], self.cache,
+                                                  self.cached_methods[key])
+            else:
+                self._parsers[key] = self._factories[key](self._paths[key])
+        return self._parsers[key]
+
+    def __contains__(self, key):
+        return key in self._paths
+
+    def __iter__(self):
+        return iter(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def path(self, key):
+        return self._paths[key]
+
+    def filenames(self):
+        """
+        所有已注册文件的路径，不创建解析器
+        """
+        return list(self._paths.values())
+
+    def sizes(self):
+        """
+        已注册文件的总大小(字节)
+        """
+        return sum(os.path.getsize(path) for path in self._paths.values())
+
+    def loaded(self):
+        """
+        已创建的解析器键名
+        """
+        return list(self._parsers)
@@ -8,11 +8,14 @@
 @Date       : 2024/5/30 16:22 
 @Description: 
 """
+import math
 import re
 import warnings
 
 import numpy as np
 
+from public.tools.helper import parseNumbers
+
 
 class Chgcar:
     def __init__(self, filename):
@@ -24,43 +27,108 @@ class Chgcar:
         self.NGY = 0
         self.NGZ = 0
         self.GRID = np.zeros((0, 0, 0))
+        # ISPIN=2时为磁化密度，非共线时为(mx, my, mz)三个网格
+        self.MAGNETIZATION = []
+        # 每个体数据块的augmentation occupancies: [{离子序号: ndarray}]
+        self.AUGMENTATION = []
 
-    def getChgcarInfo(self):
-        if len(self.lines) < 5:
-            warnings.warn(f"File {self.filename} is too short to be a valid CHGCAR file.")
-            return {}
+    def getGridStart(self):
+        """
+        网格尺寸所在行号
+        """
         site_line = self.lines[6].strip()
         site_numbers = list(map(int, re.split(r'\s+', site_line)))
         site_length = sum(site_numbers)
         start_line = 8 + site_length + 1
+        if self.lines[7].strip()[:1] in ('s', 'S'):
+            # Selective dynamics多一行
+            start_line += 1
+        return start_line
+
+    def readGrids(self):
+        """
+        一次性解析全部体数据块，网格按VASP的写出顺序(x最快)以Fortran顺序重排为(ngx, ngy, ngz)
+        :return: [ndarray]，第一个为总电荷密度，其余为磁化密度
+        """
+        start_line = self.getGridStart()
         if start_line >= len(self.lines):
             raise ValueError(f"File {self.filename} does not contain enough lines for the grid information.")
-        grid_line = self.lines[start_line].strip()
-        ngx, ngy, ngz = map(int, re.split(r'\s+', grid_line)[0:3])
-        self.NGX = ngx
-        self.NGY = ngy
-        self.NGZ = ngz
-        self.GRID = np.zeros((ngx, ngy, ngz))
-
-        data_lines = self.lines[start_line + 1:]
+        dims_line = self.lines[start_line].split()
+        dims = tuple(map(int, dims_line[0:3]))
+        count = dims[0] * dims[1] * dims[2]
+        grids = []
+        self.AUGMENTATION = []
+        i = start_line
+        while i < len(self.lines):
+            per_line = len(self.lines[i + 1].split()) if i + 1 < len(self.lines) else 0
+            if per_line == 0:
+                break
+            end = i + 1 + math.ceil(count / per_line)
+            data = parseNumbers(''.join(self.lines[i + 1:end]))
+            if data.size < count:
+                raise ValueError(f"File {self.filename} does not contain enough values for the grid.")
+            grids.append(data[:count].reshape(dims, order='F'))
+            augmentation, i = self._readAugmentation(end, dims_line)
+            self.AUGMENTATION.append(augmentation)
+        return grids
 
-        flat_data = []
-        for line in data_lines:
-            if 'augmentation' in line:
+    def _readAugmentation(self, i, dims_line):
+        """
+        读取网格之后的augmentation occupancies，直到下一个网格尺寸行
+        :return: ({离子序号: ndarray}, 下一个网格尺寸行号)
+        """
+        augmentation = {}
+        while i < len(self.lines):
+            line = self.lines[i]
+            if line.startswith('augmentation'):
+                parts = line.split()
+                ion, count = int(parts[-2]), int(parts[-1])
+                values = []
+                i += 1
+                while len(values) < count and i < len(self.lines):
+                    values.extend(self.lines[i].split())
+                    i += 1
+                augmentation[ion] = parseNumbers(' '.join(values[:count]))
+                continue
+            if line.split() == dims_line:
                 break
-            flat_data.extend(map(float, re.split(r'\s+', line.strip())))
+            i += 1
+        return augmentation, i
 
-        index = 0
-        for i in range(ngx):
-            for j in range(ngy):
-                for k in range(ngz):
-                    self.GRID[i, j, k] = flat_data[index]
-                    index += 1
+    def saveGrid(self, path, grid=None):
+        """
+        将网格保存为.npy，之后可用np.load(path, mmap_mode='r')按需映射读取
+        :param path: .npy文件路径
+        :param grid: 默认为总电荷密度网格
+        :return: path
+        """
+        grid = self.GRID if grid is None else grid
+        np.save(path, np.asfortranarray(grid))
+        return path
+
+    def getChgcarInfo(self, spillPath=None):
+        """
+        :param spillPath: 指定时网格保存为.npy文件(磁化密度为*_mag<n>.npy)，文档中只记录文件路径，
+                          否则GRID为嵌套list
+        :return: doc
+        """
+        if len(self.lines) < 5:
+            warnings.warn(f"File {self.filename} is too short to be a valid CHGCAR file.")
+            return {}
+        grids = self.readGrids()
+        self.GRID = grids[0]
+        self.NGX, self.NGY, self.NGZ = self.GRID.shape
+        self.MAGNETIZATION = grids[1:]
         doc = {}
         doc["NGX"] = self.NGX
         doc["NGY"] = self.NGY
         doc["NGZ"] = self.NGZ
-        doc["GRID"] = self.GRID.tolist()
+        if spillPath is None:
+            doc["GRID"] = self.GRID.tolist()
+            return doc
+        base = spillPath[:-4] if spillPath.endswith('.npy') else spillPath
+        doc["GRID"] = self.saveGrid(base + '.npy')
+        if self.MAGNETIZATION:
+            doc["MagnetizationGRID"] = [self.saveGrid(f'{base}_mag{n}.npy', grid)
+                                        for n, grid in enumerate(self.MAGNETIZATION)]
         return doc
-
-
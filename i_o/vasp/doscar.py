@@ -2,6 +2,25 @@ import warnings
 
 import numpy as np
 
+from public.tools.helper import parseTable, toList
+
+# 分波态密度列数 -> (IsSpinPolarized, IsLmProjected, orbitals)
+_spd = ['s', 'p', 'd']
+_spdf = ['s', 'p', 'd', 'f']
+_lm_spd = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'dx2-y2']
+_lm_spdf = _lm_spd + ['fy(3x2-y2)', 'fxyz', 'fyz2', 'fz3', 'fxz2', 'fz(x2-y2)', 'fx(x2-3y2)']
+PARTIAL_LAYOUTS = {
+    4: (False, False, _spd),
+    5: (False, False, _spdf),
+    7: (True, False, _spd),
+    9: (True, False, _spdf),
+    10: (False, True, _lm_spd),
+    17: (False, True, _lm_spdf),
+    19: (True, True, _lm_spd),
+}
+# 其余列数按自旋极化的lm分解spdf处理
+DEFAULT_LAYOUT = (True, True, _lm_spdf)
+
 
 class Doscar:
     def __init__(self, filename):
@@ -13,124 +32,77 @@ class Doscar:
         self.energies = None
         self.total = None
         self.projected = None
+        # (nedos, ncol): energy, dos..., integrated dos...
+        self.totalArray = None
+        # (nion, nedos, ncol)，各离子列数不同时为每个离子(nedos, ncol)数组的list
+        self.partialArray = None
+
+    def read(self):
+        """
+        整体解析total块及所有离子块
+        """
+        self.NIon = int(self.lines[0].split()[0])
+        self.N = N = int(self.lines[5].split()[2])
+        total_lines = self.lines[6:6 + N]
+        self.totalArray = parseTable(total_lines, len(total_lines[0].split()))
+        self.energies = self.totalArray[:, 0]
+        # 每个离子块为一行表头加N行数据，未设置LORBIT时文件中没有离子块
+        nblocks = min(self.NIon, max(len(self.lines) - 6 - N, 0) // (N + 1))
+        starts = [6 + N + i * (N + 1) + 1 for i in range(nblocks)]
+        if not starts:
+            self.partialArray = np.zeros((0, N, 0))
+            return
+        rows = [line for start in starts for line in self.lines[start:start + N]]
+        try:
+            self.partialArray = parseTable(rows, len(rows[0].split())).reshape(self.NIon, N, -1)
+        except ValueError:
+            self.partialArray = [parseTable(self.lines[start:start + N], len(self.lines[start].split()))
+                                 for start in starts]
 
-    def getTotalDos(self):
+    def getTotalDos(self, asarray=False):
+        """
+        :param asarray: 能量和态密度保留为ndarray
+        """
         if len(self.lines) <= 5:
             warnings.warn(f"File {self.filename} is too short to be a valid DOSCAR file.")
             return {}
-        self.NIon = int(self.lines[0].split()[0])
-        self.N = int(self.lines[5].split()[2])
-        IsSpinPolarized = False
-        self.energies = np.zeros(self.N)
-        self.total = {}
-        data1 = []
-        data2 = []
-        for i in range(self.N):
-            fields = np.array(self.lines[6 + i].split(), dtype=float)
-            if i == 0:
-                if len(fields) == 3:  # energy, total
-                    IsSpinPolarized = False
-                    data1=[]
-                    data2=[]
-                else:  # energy, spin-up, spin-down
-                    IsSpinPolarized = True
-                    data1 = []
-            self.energies[i] = fields[0]
-            if IsSpinPolarized:
-                data1.append(fields[1])
-                data2.append(fields[2])
-            else:
-                data1.append(fields[1])
-        self.total['0']=list(data1)
+        if self.totalArray is None:
+            self.read()
+        # energy, total, integrated 或 energy, up, down, integrated up, integrated down
+        IsSpinPolarized = self.totalArray.shape[1] != 3
+        self.total = {'0': toList(self.totalArray[:, 1], asarray)}
         if IsSpinPolarized:
-            self.total['1']=list(data2)
+            self.total['1'] = toList(self.totalArray[:, 2], asarray)
         return {
             "IsSpinPolarized": IsSpinPolarized,
             "NumberOfGridPoints": self.N,
-            "Energies": self.energies.tolist(),
+            "Energies": toList(self.energies, asarray),
             "TdosData": self.total
         }
 
-    def getPartialDos(self):
-        if len(self.lines) < 5:
-            warnings.warn(f"File {self.filename} is too short to be a valid EIGENVAL file.")
+    def getPartialDos(self, asarray=False):
+        """
+        :param asarray: 能量和态密度保留为ndarray
+        """
+        if len(self.lines) <= 5:
+            warnings.warn(f"File {self.filename} is too short to be a valid DOSCAR file.")
             return {}
-        self.NIon = int(self.lines[0].split()[0])
-        self.N = int(self.lines[5].split()[2])
-        projected = None
+        if self.partialArray is None:
+            self.read()
         IsSpinPolarized = False
         IsLmProjected = False
-        line_index = 6 + self.N
         DecomposedLength = 0
-        orbitals = []
         PartialDosData = []
-        for i in range(self.NIon):
-            line_index += 1
-            fields = np.array(self.lines[line_index].split(), dtype=float)
-            if len(fields) == 4:  # spd
-                IsSpinPolarized = False
-                IsLmProjected = False
-                orbitals = ['s', 'p', 'd']
-                projected = {orb: [] for orb in orbitals}
-            elif len(fields) == 5:  # spdf
-                IsSpinPolarized = False
-                IsLmProjected = False
-                orbitals = ['s', 'p', 'd', 'f']
-                projected = {orb: [] for orb in orbitals}
-            elif len(fields) == 7:  # spd with spin polarization
-                IsSpinPolarized = True
-                IsLmProjected = False
-                orbitals = ['s', 'p', 'd']
-                projected = {orb: {'up': [], 'down': []} for orb in orbitals}
-            elif len(fields) == 9:  # spdf with spin polarization
-                IsSpinPolarized = True
-                IsLmProjected = False
-                orbitals = ['s', 'p', 'd', 'f']
-                projected = {orb: {'up': [], 'down': []} for orb in orbitals}
-            elif len(fields) == 10:  # partial orbital of spd without spin
-                IsSpinPolarized = False
-                IsLmProjected = True
-                orbitals = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'dx2-y2']
-                projected = {orb: [] for orb in orbitals}
-            elif len(fields) == 17:  # partial orbitals of spdf without spin
-                IsSpinPolarized = False
-                IsLmProjected = True
-                orbitals = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'dx2-y2', 'fy(3x2-y2)', 'fxyz',
-                            'fyz2', 'fz3', 'fxz2', 'fz(x2-y2)', 'fx(x2-3y2)']
-                projected = {orb: [] for orb in orbitals}
-            elif len(fields) == 19:  # partial orbital of spd with spin
-                IsSpinPolarized = True
-                IsLmProjected = True
-                orbitals = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'dx2-y2']
-                projected = {orb: {'up': [], 'down': []} for orb in orbitals}
-            else:  # partial orbitals of spdf with spin
-                IsSpinPolarized = True
-                IsLmProjected = True
-                orbitals = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'dx2-y2', 'fy(3x2-y2)', 'fxyz',
-                            'fyz2', 'fz3', 'fxz2', 'fz(x2-y2)', 'fx(x2-3y2)']
-                projected = {orb: {'up': [], 'down': []} for orb in orbitals}
-            for j in range(self.N):
-                fields = np.array(self.lines[line_index].split(), dtype=float)
-                line_index += 1
-                DecomposedLength = len(fields) - 1
-                if IsLmProjected:
-                    if IsSpinPolarized:
-                        DecomposedLength = DecomposedLength / 2
-                        for k, orb in enumerate(orbitals):
-                            projected[orb]['up'].append(fields[1 + k * 2])
-                            projected[orb]['down'].append(fields[2 + k * 2])
-                    else:
-                        for k, orb in enumerate(orbitals):
-                            projected[orb].append(fields[1 + k])
-                else:
-                    if IsSpinPolarized:
-                        DecomposedLength = DecomposedLength / 2
-                        for k, orb in enumerate(orbitals):
-                            projected[orb]['up'].append(fields[1 + k * 2])
-                            projected[orb]['down'].append(fields[2 + k * 2])
-                    else:
-                        for k, orb in enumerate(orbitals):
-                            projected[orb].append(fields[1 + k])
+        for ion in self.partialArray:
+            ncol = ion.shape[1]
+            IsSpinPolarized, IsLmProjected, orbitals = PARTIAL_LAYOUTS.get(ncol, DEFAULT_LAYOUT)
+            DecomposedLength = ncol - 1
+            if IsSpinPolarized:
+                DecomposedLength = DecomposedLength / 2
+                projected = {orb: {'up': toList(ion[:, 1 + k * 2], asarray), 'down': toList(ion[:, 2 + k * 2], asarray)}
+                             for k, orb in enumerate(orbitals)}
+            else:
+                projected = {orb: toList(ion[:, 1 + k], asarray) for k, orb in enumerate(orbitals)}
             PartialDosData.append(projected)
 
         return {
@@ -139,6 +111,6 @@ class Doscar:
             "NumberOfIons": self.NIon,
             "DecomposedLength": DecomposedLength,
             "IsLmDecomposed": IsLmProjected,
-            "Energies": self.energies.tolist(),
+            "Energies": toList(self.energies, asarray),
             "PartialDosData": PartialDosData
         }
@@ -4,6 +4,8 @@ import numpy as np
 import warnings
 import re
 
+from public.tools.helper import parseTable
+
 class KPoint:
     def __init__(self, name, coords):
         self.name = name
@@ -20,6 +22,46 @@ class Eigenval:
         with open(self.filename, 'r') as f:
             self.lines = f.readlines()
 
+    def getArrays(self):
+        """
+        按固定的块结构一次性解析所有k点
+        每个k点块为: 空行, k点坐标与权重, nBands行本征值
+        :return: {'kpoints': (nkpt, 3), 'weights': (nkpt,), 'eigenvalues': (nspin, nkpt, nband),
+                  'occupancies': (nspin, nkpt, nband)}
+        """
+        self.isSpin = int(self.lines[0].split()[3])
+        header_fields = self.lines[5].split()
+        self.n = n = int(header_fields[1])
+        self.nBands = nBands = int(header_fields[2])
+        headers = [7 + i * (nBands + 2) for i in range(n)]
+        coords = np.zeros((n, 3))
+        weights = np.full(n, np.nan)
+        for i, index in enumerate(headers):
+            line = self.lines[index].strip()
+            parts = line.split()
+            if re.match(r'^[0-9]+\.\s+kpoint:', line):
+                coords[i] = list(map(float, parts[2:5]))
+                if len(parts) > 5:
+                    weights[i] = float(parts[5])
+            else:
+                coords[i] = list(map(float, parts[:3]))
+                if len(parts) > 3:
+                    weights[i] = float(parts[3])
+        # 非自旋极化: index, energy, occ; 自旋极化: index, up, down, occ up, occ down
+        nspin = 1 if self.isSpin == 1 else 2
+        rows = [line for index in headers for line in self.lines[index + 1:index + 1 + nBands]]
+        table = parseTable(rows, 1 + 2 * nspin).reshape(n, nBands, 1 + 2 * nspin)
+        self.kpointCoords = coords
+        self.kpointWeights = weights
+        self.eigenvalues = np.moveaxis(table[:, :, 1:1 + nspin], 2, 0)
+        self.occupancies = np.moveaxis(table[:, :, 1 + nspin:1 + 2 * nspin], 2, 0)
+        return {
+            'kpoints': self.kpointCoords,
+            'weights': self.kpointWeights,
+            'eigenvalues': self.eigenvalues,
+            'occupancies': self.occupancies
+        }
+
     def getEigenValues(self):
         """
         Extract eigenvalue data
@@ -30,19 +72,8 @@ class Eigenval:
             warnings.warn(f"File {self.filename} is too short to be a valid EIGENVAL file.")
             return {}
         self.isSpin = int(self.lines[0].split()[3])
-
-        # Get the number of k-points and bands
-        header_fields = self.lines[5].split()
-        self.n = int(header_fields[1])
-        self.nBands = int(header_fields[2])
-
-        # Initialize kpoints and eigenvalues
-        self.kpoints = [None] * self.n
-        self.eigenvalues = None
-        self.occupancies = None
-        NumberOfBand = self.nBands
+        NumberOfBand = int(self.lines[5].split()[2])
         IsSpinPolarized = (self.isSpin != 1)
-        line_index = 6  # Start reading from the 7th line (index 6)
         if len(self.lines) < 7:
             return {
                 "NumberOfGeneratedKPoints": "N/A",
@@ -52,49 +83,12 @@ class Eigenval:
                 "EigenvalData": "N/A",
                 "EigenvalOcc": "N/A"
             }
-
-        if self.isSpin == 1:
-            for i in range(self.n):
-                line_index += 1  # Skip a line for k-point header
-                line = self.lines[line_index].strip()
-                if re.match(r'^[0-9]+\.\s+kpoint:', line):
-                    kpoint_coords = list(map(float, line.split()[2:5]))
-                else:
-                    kpoint_coords = list(map(float, line.split()[:3]))
-                self.kpoints[i] = KPoint(str(i), kpoint_coords)
-                line_index += 1
-                if self.eigenvalues is None:
-                    self.eigenvalues = np.zeros((1, self.n, self.nBands))
-                    self.occupancies = np.zeros((1, self.n, self.nBands))
-                for j in range(self.nBands):
-                    fields = self.lines[line_index].split()
-                    self.eigenvalues[0, i, j] = float(fields[1])
-                    self.occupancies[0, i, j] = float(fields[2])
-                    line_index += 1
-        else:
-            for i in range(self.n):
-                line_index += 1  # Skip a line for k-point header
-                kpoint_coords = list(map(float, self.lines[line_index].split()[:3]))
-                self.kpoints[i] = KPoint(str(i), kpoint_coords)
-                line_index += 1
-                if self.eigenvalues is None:
-                    self.eigenvalues = np.zeros((2, self.n, self.nBands))
-                    self.occupancies = np.zeros((2, self.n, self.nBands))
-                for j in range(self.nBands):
-                    fields = self.lines[line_index].split()
-                    self.eigenvalues[0, i, j] = float(fields[1])
-                    self.eigenvalues[1, i, j] = float(fields[2])
-                    self.occupancies[0, i, j] = float(fields[3])
-                    self.occupancies[1, i, j] = float(fields[4])
-                    line_index += 1
-
+        self.getArrays()
+        self.kpoints = [KPoint(str(i), coords) for i, coords in enumerate(self.kpointCoords)]
         self.EigenValues = EigenValues(self.kpoints, self.eigenvalues)
-        NumberOfGeneratedKPoints = len(self.kpoints)
 
-        KPoints = self.kpoints
         EigenvalData = {}
         EigenvalOcc = {}
-
         if IsSpinPolarized:
             EigenvalData['spin 1'] = self.eigenvalues[0].tolist()
             EigenvalData['spin 2'] = self.eigenvalues[1].tolist()
@@ -105,13 +99,10 @@ class Eigenval:
             EigenvalOcc['spin 1'] = self.occupancies[0].tolist()
 
         return {
-            "NumberOfGeneratedKPoints": NumberOfGeneratedKPoints,
+            "NumberOfGeneratedKPoints": self.n,
             "NumberOfBand": NumberOfBand,
             "IsSpinPolarized": IsSpinPolarized,
-            "KPoints": [kpoint.coords.tolist() for kpoint in KPoints],
+            "KPoints": self.kpointCoords.tolist(),
             "EigenvalData": EigenvalData,
             "EigenvalOcc": EigenvalOcc
         }
-
-
-
@@ -8,108 +8,248 @@
 @Date       : 2023/9/5 9:12
 @Description: Parser OUTCAR file
 """
+import mmap
 import re
 import warnings
 
 import numpy as np
 
+from public.tools.helper import parseNumbers
+
+# 资源统计位于文件末尾，只在最后TAIL_SIZE字节内向前查找
+TAIL_SIZE = 1024 * 1024
+RESOURCE_MARKERS = (
+    (b'Total CPU time used (sec):', 'TotalCpuTime'),
+    (b'User time (sec):', 'UserTime'),
+    (b'System time (sec):', 'SystemTime'),
+    (b'Elapsed time (sec):', 'ElapsedTime'),
+    (b'Maximum memory used (kb):', 'MaxMemory'),
+    (b'Average memory used (kb):', 'AverageMemory'),
+)
+ION_ROW = re.compile(r"\s*(\d+)\s+(([\d\.\-]+)\s+)+")
+# 每个离子步中的数据块: 晶格、应力(kB)、位置与受力、离子步结束时的自由能
+STEP_MARKERS = re.compile(rb'(?P<lattice>direct lattice vectors)|(?P<stress>in kB)|'
+                          rb'(?P<positions>POSITION\s+TOTAL-FORCE)|(?P<energy>free  energy\s+TOTEN)')
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def lineBounds(buffer, pos):
+    """
+    :return: pos所在行的(行首, 行尾)偏移，行尾不含换行符
+    """
+    start = buffer.rfind(b'\n', 0, pos) + 1
+    stop = buffer.find(b'\n', pos)
+    if stop == -1:
+        stop = len(buffer)
+    return start, stop
+
+
+def lineAt(buffer, pos):
+    start, stop = lineBounds(buffer, pos)
+    return buffer[start:stop].decode('utf8', errors='replace')
+
+
+def iterLines(buffer, pos):
+    """
+    从pos所在行开始逐行返回(str，不含换行符)
+    """
+    pos, stop = lineBounds(buffer, pos)
+    size = len(buffer)
+    while pos < size:
+        yield buffer[pos:stop].decode('utf8', errors='replace')
+        pos = stop + 1
+        stop = buffer.find(b'\n', pos)
+        if stop == -1:
+            stop = size
+
+
+def rfindLine(buffer, text: bytes, start=0, end=None):
+    """
+    从end向前查找去除首尾空白后恰为text的行
+    :return: 行首偏移，未找到返回-1
+    """
+    end = len(buffer) if end is None else end
+    while True:
+        pos = buffer.rfind(text, start, end)
+        if pos < 0:
+            return -1
+        line_start, line_stop = lineBounds(buffer, pos)
+        if buffer[line_start:line_stop].strip() == text:
+            return line_start
+        end = pos
+
+
+class OutcarScanner:
+    """
+    OUTCAR单遍扫描引擎
+    提取器通过register注册触发模式，scan时所有模式合并为一个正则，只遍历一次文件；
+    只关心第一次出现的触发器全部命中后提前结束
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._triggers = {}
+
+    def register(self, name, pattern: bytes, handler, first=False):
+        """
+        :param name: 触发器名称，需为合法的正则组名
+        :param pattern: bytes正则，不能包含命名组
+        :param handler: handler(buffer, match)，返回值收集到scan的结果中
+        :param first: 只处理第一次出现
+        """
+        self._triggers[name] = (pattern, handler, first)
+
+    def scan(self, start=0):
+        """
+        :return: {触发器名称: [handler返回值, ...]}
+        """
+        results = {name: [] for name in self._triggers}
+        if not self._triggers:
+            return results
+        combined = re.compile(b'|'.join(b'(?P<%s>%s)' % (name.encode(), pattern)
+                                        for name, (pattern, _, _) in self._triggers.items()))
+        waiting = {name for name, (_, _, first) in self._triggers.items() if first}
+        exhaustive = len(waiting) < len(self._triggers)
+        for match in combined.finditer(self.buffer, start):
+            name = match.lastgroup
+            _, handler, first = self._triggers[name]
+            if first:
+                if name not in waiting:
+                    continue
+                waiting.discard(name)
+            results[name].append(handler(self.buffer, match))
+            if not exhaustive and not waiting:
+                break
+        return results
+
 
 class Outcar:
     """
     parser outcar
+    文件以内存映射方式打开，开头部分的信息由OutcarScanner一次扫描得到，
+    末尾的资源统计、原子电荷/磁矩和弹性模量从文件末尾向前查找
     """
 
     def __init__(self, filename):
         self.filename = filename
-        with open(self.filename, 'r') as f:
-            self.lines = f.readlines()
-            f.close()
+        self.buffer = self._mapFile()
+        self._lines = None
+        self._scanned = None
+
+    def _mapFile(self):
+        with open(self.filename, 'rb') as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, TypeError, OSError):
+                # 空文件无法映射，或不是真实文件时退回readlines
+                lines = f.readlines()
+        return b''.join(self._toBytes(line) for line in lines)
+
+    @staticmethod
+    def _toBytes(line):
+        if isinstance(line, str):
+            line = line.encode('utf8')
+        return line if line.endswith(b'\n') else line + b'\n'
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.buffer[:].decode('utf8', errors='replace').splitlines(keepends=True)
+        return self._lines
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def scanner(self):
+        """
+        注册了文件开头部分提取器的扫描引擎
+        """
+        scanner = OutcarScanner(self.buffer)
+        scanner.register('cores', rb'running on', self._readCores, first=True)
+        scanner.register('efermi', rb'E-fermi', self._readEfermi, first=True)
+        return scanner
+
+    def _scan(self):
+        if self._scanned is None:
+            self._scanned = self.scanner().scan()
+        return self._scanned
+
+    @staticmethod
+    def _readCores(buffer, match):
+        line2 = lineAt(buffer, match.start()).split()
+        if "N/A" not in line2:
+            return int(line2[2])
+        return None
+
+    @staticmethod
+    def _readEfermi(buffer, match):
+        parts = lineAt(buffer, match.start()).split()
+        efermi_index = parts.index('E-fermi') + 2
+        return float(parts[efermi_index])
+
+    def _isTooShort(self):
+        return len(self.buffer[:65536].splitlines()) < 5
 
     def getResourceUsage(self):
         """
         Get ResourceUsage
         :return:
         """
-        if len(self.lines) < 5:
+        if self._isTooShort():
             warnings.warn(f"File {self.filename} is too short to be a valid OUTCAR file.")
         resourceUsage = {}
-        for line in self.lines:
-            line = line.strip('\n').strip(' ')
-            if line.find('running on') != -1:
-                line2 = line.split()
-                if "N/A" not in line2:
-                    resourceUsage['TotalCores'] = int(line2[2])
-            if line.find('Total CPU time used (sec):') != -1:
-                line2 = line.split(':')
-                if "N/A" not in line2:
-                    resourceUsage['TotalCpuTime'] = float(line2[1])
-            elif line.find('User time (sec):') != -1:
-                line2 = line.split(':')
-                if "N/A" not in line2:
-                    resourceUsage['UserTime'] = float(line2[1])
-            elif line.find('System time (sec):') != -1:
-                line2 = line.split(':')
-                if "N/A" not in line2:
-                    resourceUsage['SystemTime'] = float(line2[1])
-            elif line.find('Elapsed time (sec):') != -1:
-                line2 = line.split(':')
-                if "N/A" not in line2:
-                    resourceUsage['ElapsedTime'] = float(line2[1])
-            elif line.find('Maximum memory used (kb):') != -1:
-                line2 = line.split(':')
-                if line2[1].strip() != 'N/A':
-                    resourceUsage['MaxMemory'] = float(line2[1])
-            elif line.find('Average memory used (kb):') != -1:
-                line2 = line.split(':')
-                if line2[1].strip() != 'N/A':
-                    resourceUsage['AverageMemory'] = float(line2[1])
+        cores = self._scan()['cores']
+        if cores and cores[0] is not None:
+            resourceUsage['TotalCores'] = cores[0]
+        tail = max(0, len(self.buffer) - TAIL_SIZE)
+        for marker, key in RESOURCE_MARKERS:
+            pos = self.buffer.rfind(marker, tail)
+            if pos == -1:
+                continue
+            line2 = lineAt(self.buffer, pos).split(':')
+            if line2[1].strip() != 'N/A':
+                resourceUsage[key] = float(line2[1])
         return resourceUsage
 
-    def getAtomicChargeAndAtomicMagnetization(self):
-        charge = []
-        mag_x = []  # 仅考虑线性磁矩
+    def _readIonTable(self, pos):
+        """
+        读取pos所在标题行之后的逐原子表格，到tot行或下一个表格标题为止
+        """
         header = []
-        all_lines = self.lines
-        # for line in reverse_readfile(self.filename):
-        #     clean = line.strip()
-        #     all_lines.append(clean)
-        # For single atom systems, VASP doesn't print a total line, so
-        # reverse parsing is very difficult
-        read_charge = False
-        read_mag_x = False
-
-        # all_lines.reverse()
-        for line in all_lines:
+        rows = []
+        lines = iterLines(self.buffer, pos)
+        next(lines)
+        for line in lines:
             clean = line.strip()
-            if read_charge or read_mag_x:
-                if clean.startswith("# of ion"):
-                    header = re.split(r"\s{2,}", clean.strip())
-                    header.pop(0)
-                else:
-                    m = re.match(r"\s*(\d+)\s+(([\d\.\-]+)\s+)+", clean)
-                    if m:
-                        toks = [float(i) for i in re.findall(r"[\d\.\-]+", clean)]
-                        toks.pop(0)
-                        if read_charge:
-                            charge.append(dict(zip(header, toks)))
-                        elif read_mag_x:
-                            mag_x.append(dict(zip(header, toks)))
-                    elif clean.startswith("tot"):
-                        read_charge = False
-                        read_mag_x = False
-            if clean == "total charge":
-                charge = []
-                read_charge = True
-                read_mag_x = False
-            elif clean == "magnetization (x)":
-                mag_x = []
-                read_mag_x = True
-                read_charge = False
-        mag = mag_x
-        magnetization = tuple(mag)
-        charge = tuple(charge)
-
-        return charge, magnetization
+            if clean in ("total charge", "magnetization (x)"):
+                break
+            if clean.startswith("# of ion"):
+                header = re.split(r"\s{2,}", clean)
+                header.pop(0)
+            elif ION_ROW.match(clean):
+                toks = [float(i) for i in re.findall(r"[\d\.\-]+", clean)]
+                toks.pop(0)
+                rows.append(dict(zip(header, toks)))
+            elif clean.startswith("tot"):
+                break
+        return rows
+
+    def getAtomicChargeAndAtomicMagnetization(self):
+        """
+        最后一组原子电荷与磁矩(仅考虑线性磁矩)，从文件末尾向前查找表格标题
+        单原子体系VASP不输出tot行，表格读到下一个标题或文件结束
+        :return: (charge, magnetization)
+        """
+        charge = []
+        mag_x = []
+        pos = rfindLine(self.buffer, b"total charge")
+        if pos != -1:
+            charge = self._readIonTable(pos)
+        pos = rfindLine(self.buffer, b"magnetization (x)")
+        if pos != -1:
+            mag_x = self._readIonTable(pos)
+        return tuple(charge), tuple(mag_x)
 
     def getElasticProperties(self):
         """
@@ -124,19 +264,12 @@ class Outcar:
         :return:
         """
 
-        # ElasticModuleMatrix: 弹性模量矩阵Cij
-        all_lines = []
-        for line in self.lines:
-            clean = line.strip()
-            all_lines.append(clean)
-
-        all_lines.reverse()
+        # ElasticModuleMatrix: 弹性模量矩阵Cij，标题行后依次为Direction行、分隔线和6行矩阵
         matrix_lines = []
-        for i in range(len(all_lines)):
-            if all_lines[i] == 'ELASTIC MODULI  (kBar)':
-                matrix_lines = all_lines[i - 8: i - 2].copy()
-        matrix_lines.reverse()
-        # print(matrix_lines)
+        pos = rfindLine(self.buffer, b'ELASTIC MODULI  (kBar)')
+        if pos != -1:
+            lines = iterLines(self.buffer, pos)
+            matrix_lines = [line.strip() for _, line in zip(range(9), lines)][3:]
         matrix_init = []
         for line in matrix_lines:
             row = line.strip().split()[1:]
@@ -213,10 +346,66 @@ class Outcar:
         """
         Extract E-fermi value from the OUTCAR file.
         """
-        for line in self.lines:
-            if 'E-fermi' in line:
-                parts = line.split()
-                efermi_index = parts.index('E-fermi') + 2
-                efermi_value = float(parts[efermi_index])
-                return efermi_value
-        return None
+        efermi = self._scan()['efermi']
+        return efermi[0] if efermi else None
+
+    def iterIonicSteps(self, chunk_size=CHUNK_SIZE):
+        """
+        按固定大小的块流式读取离子步，文件截断时只返回完整的离子步
+        :param chunk_size: 每次读取的字节数
+        :return: 生成器，每个离子步为{'FreeEnergy': float, 'Lattice': (3, 3), 'Positions': (N, 3)笛卡尔坐标,
+                 'Forces': (N, 3), 'Stress': (3, 3) kB}，未输出的项为None
+        """
+        step = {'Lattice': None, 'Positions': None, 'Forces': None, 'Stress': None}
+        pending = b''
+        for offset in range(0, len(self.buffer), chunk_size):
+            data = pending + self.buffer[offset:offset + chunk_size]
+            # 默认保留最后不完整的一行，拼接到下一块
+            pending = data[data.rfind(b'\n') + 1:]
+            for match in STEP_MARKERS.finditer(data):
+                start = data.rfind(b'\n', 0, match.start()) + 1
+                block = self._readStepBlock(data, start, match.lastgroup)
+                if block is None:
+                    # 数据块跨越了块边界，从其所在行开始保留到下一块
+                    pending = data[start:]
+                    break
+                name, value = block
+                if name == 'energy':
+                    step['FreeEnergy'] = value
+                    yield step
+                    step = {'Lattice': step['Lattice'], 'Positions': None, 'Forces': None, 'Stress': None}
+                elif name == 'positions':
+                    step['Positions'], step['Forces'] = value[:, :3], value[:, 3:]
+                else:
+                    step[name.capitalize()] = value
+
+    @staticmethod
+    def _readStepBlock(data, start, name):
+        """
+        解析从start行开始的数据块
+        :return: (名称, 值)，数据块不完整时返回None
+        """
+        if name == 'lattice':
+            pos = start
+            for _ in range(4):
+                pos = data.find(b'\n', pos) + 1
+                if pos == 0:
+                    return None
+            rows = data[start:pos].decode('utf8').splitlines()[1:]
+            return name, np.array([[float(x) for x in row.split()[:3]] for row in rows])
+        stop = data.find(b'\n', start)
+        if stop == -1:
+            return None
+        line = data[start:stop].decode('utf8')
+        if name == 'stress':
+            xx, yy, zz, xy, yz, zx = parseNumbers(line.split('in kB')[1])[:6]
+            return name, np.array([[xx, xy, zx], [xy, yy, yz], [zx, yz, zz]])
+        if name == 'energy':
+            return name, float(line.split('=')[1].split()[0])
+        # 位置与受力表格位于标题行后的两条分隔线之间
+        table_start = data.find(b'\n', stop + 1) + 1
+        table_stop = data.find(b'---', table_start)
+        if table_start == 0 or table_stop == -1 or data.find(b'\n', table_stop) == -1:
+            return None
+        table_stop = data.rfind(b'\n', 0, table_stop) + 1
+        return name, parseNumbers(data[table_start:table_stop].decode('utf8')).reshape(-1, 6)
@@ -11,7 +11,7 @@
 import warnings
 
 import numpy as np
-from public.tools.periodic_table import PTable
+from public.tools.periodic_table import getPTable
 from public.composition import Composition
 from public.lattice import Lattice
 from public.structure import Structure
@@ -60,10 +60,11 @@ class Poscar:
             elements = ['H','H','He']
             counts = [1,1,1]
         composition = []
+        ptable = getPTable()
         for element, count in zip(elements, counts):
             composition.append(Composition(atomic_symbol=element,
-                                           atomic_number=PTable().detailed[element]["Atomic no"],
-                                           atomic_mass=PTable().detailed[element]["Atomic mass"],
+                                           atomic_number=ptable.getAtomicNumber(element),
+                                           atomic_mass=ptable.getAtomicMass(element),
                                            amount=count))
         return composition
 
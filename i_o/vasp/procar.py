@@ -8,130 +8,175 @@
 @Date       : 2024/5/30 16:29 
 @Description: 
 """
+import os
 import warnings
 
 from public.tools.Electronic import Spin
+from public.tools.helper import parseTable
 import re
 import numpy as np
 
 
 class Procar:
-    def __init__(self, filename):
+    def __init__(self, filename, dtype=np.float64, cache=False):
+        """
+        :param filename: PROCAR路径
+        :param dtype: 投影数组的精度，np.float32可减半内存
+        :param cache: 为True时解析结果缓存为同目录下的PROCAR.npz，文件未变化时直接载入
+        """
         self.filename = filename
+        self.dtype = dtype
+        self.lines = None
+        self.nkpoints = 0
+        self.nbands = 0
+        self.nions = 0
+        self.KPoints = []
+        self.fields = []
+        self.IsSpinPolarized = True
+        # (spin, kpoint, band)
+        self.eigenvalueArray = np.zeros((0, 0, 0))
+        self.occupancyArray = np.zeros((0, 0, 0))
+        # (spin, kpoint, band, ion, orbital)
+        self.projections = np.zeros((0, 0, 0, 0, 0), dtype=dtype)
+        cache_file = self.getCacheFile() if cache else None
+        if cache_file is not None and self.loadCache(cache_file):
+            return
         with open(self.filename, 'r') as f:
             self.lines = f.readlines()
             f.close()
-        nkpoints = 0
-        nbands = 0
-        nions = 0
-        current_kpoint = 0
-        spin = Spin.down
+        self.parse()
+        if cache_file is not None and self.nkpoints:
+            self.saveCache(cache_file)
 
-        KPoints = []
-        eigenvaluesData = []
-        EigenvalOcc = []
-        spin_index = 0
-        fields = []
-        fieldsDone = False
-        done = False
-        data = []
-        spin = None
-        occupancy = None
-        eigenvalues = None
+    def parse(self):
+        """
+        先一次遍历找出各块的行号，再整体解析所有ion表
+        """
+        spin_headers = []
+        kpoint_lines = []
+        band_lines = []
+        ion_headers = []
+        expect_ion = False
+        for i, line in enumerate(self.lines):
+            line = line.lstrip()
+            c = line[:1]
+            if c == 'b':
+                if line.startswith('band'):
+                    band_lines.append(i)
+                    expect_ion = True
+            elif c == 'i':
+                # 每个band只取第一个ion表，其后的相位等数据块忽略
+                if expect_ion and line.startswith('ion'):
+                    ion_headers.append(i)
+                    expect_ion = False
+            elif c == 'k':
+                if line.startswith('k-point'):
+                    kpoint_lines.append(i)
+            elif c == '#':
+                if line.startswith('# of k-points:'):
+                    spin_headers.append(i)
+        self.IsSpinPolarized = len(spin_headers) % 2 == 0
+        if not spin_headers:
+            return
+        parts = self.lines[spin_headers[0]].split()
+        self.nkpoints = nkpoints = int(parts[3])
+        self.nbands = nbands = int(parts[7])
+        self.nions = nions = int(parts[11])
+        nspin = len(spin_headers)
+        if len(band_lines) != nspin * nkpoints * nbands or len(ion_headers) != len(band_lines):
+            raise ValueError(f"File {self.filename} is incomplete, not a valid PROCAR file.")
 
-        for i in range(len(self.lines)):
-            line = self.lines[i].strip()
+        self.KPoints = [[0.0, 0.0, 0.0] for _ in range(nkpoints)]
+        for i in kpoint_lines[-nkpoints:]:
+            parts = self.lines[i].split()
+            self.KPoints[int(parts[1]) - 1] = [float(coord) for coord in
+                                               re.findall(r'-?\d+\.\d+', ' '.join(parts[2:6]))]
 
-            if line.startswith("# of k-points:"):
-                parts = line.split()
-                nkpoints = int(parts[3])
-                nbands = int(parts[7])
-                nions = int(parts[11])
-                if spin_index == 0:
-                    KPoints = [[0.0, 0.0, 0.0] for _ in range(nkpoints)]
-                spin_index += 1
-                spin_index %= 2
-                if spin is not None:
-                    data.append(spin)
-                if occupancy is not None:
-                    EigenvalOcc.append(occupancy)
-                if eigenvalues is not None:
-                    eigenvaluesData.append(eigenvalues)
-                occupancy = [[] for _ in range(nkpoints)]
-                eigenvalues = [[] for _ in range(nkpoints)]
-                spin = [[] for _ in range(nkpoints)]
-            elif line.startswith("k-point"):
-                parts = line.split()
-                current_kpoint = int(parts[1]) - 1
-                kpoint_coords = [float(coord) for coord in re.findall(r'-?\d+\.\d+', ' '.join(parts[2:6]))]
-                KPoints[current_kpoint] = kpoint_coords
-            elif line.startswith("band"):
-                parts = line.split()
-                eigenval_data = float(parts[4])
-                eigenval_occ = float(parts[7])
-                eigenvalues[current_kpoint].append(eigenval_data)
-                occupancy[current_kpoint].append(eigenval_occ)
-                done = False
-            elif line.startswith("tot"):
-                done = True
-            elif line.startswith("ion") and fieldsDone and not done:
-                band = []
-                for j in range(nions):
-                    irons = []
-                    curline = self.lines[i + j + 1].strip().split()
-                    for num in curline[1:-1]:
-                        irons.append(float(num))
-                    band.append(irons)
-                spin[current_kpoint].append(band)
-                done = True
-            elif line.startswith("ion") and not fieldsDone:
-                parts = line.split()
-                for part in parts[1:-1]:
-                    fields.append(part)
-                fieldsDone = True
-                band = []
-                for j in range(nions):
-                    irons = []
-                    curline = self.lines[i + j + 1].strip().split()
-                    for num in curline[1:-1]:
-                        irons.append(float(num))
-                    band.append(irons)
-                spin[current_kpoint].append(band)
+        bands = np.array([[float(parts[4]), float(parts[7])] for parts in
+                          (self.lines[i].split() for i in band_lines)]).reshape(nspin, nkpoints, nbands, 2)
+        self.eigenvalueArray = bands[..., 0]
+        self.occupancyArray = bands[..., 1]
 
+        self.fields = self.lines[ion_headers[0]].split()[1:-1]
+        norb = len(self.fields)
+        rows = [line for i in ion_headers for line in self.lines[i + 1:i + 1 + nions]]
+        try:
+            table = parseTable(rows, norb + 2).reshape(nspin, nkpoints, nbands, nions, norb + 2)
+        except ValueError:
+            raise ValueError(f"File {self.filename} has malformed ion tables, not a valid PROCAR file.")
+        # 去掉每行首列的离子序号和末列的tot
+        table = table[..., 1:-1]
+        self.projections = np.ascontiguousarray(table, dtype=self.dtype)
 
-        data.append(spin)
-        EigenvalOcc.append(occupancy)
-        eigenvaluesData.append(eigenvalues)
+    @property
+    def eigenvalues(self):
+        return self.eigenvalueArray.tolist()
 
-        self.nkpoints = nkpoints
-        self.nbands = nbands
-        self.nions = nions
-        self.KPoints = KPoints
-        self.eigenvalues = eigenvaluesData
-        self.occupancies = EigenvalOcc
-        self.IsSpinPolarized = True if spin_index == 0 else False
-        self.fields = fields
-        data_array = np.array(data)
-        if data[0] is not None:
-            data_trans = np.transpose(data_array, (0, 3, 1, 2, 4))
-        else:
-            data_trans = data_array
-        self.data = data_trans.tolist()
+    @property
+    def occupancies(self):
+        return self.occupancyArray.tolist()
+
+    @property
+    def data(self):
+        """
+        spin -> ion -> kpoint -> band -> orbital
+        """
+        return np.transpose(self.projections, (0, 3, 1, 2, 4)).tolist()
+
+    def getCacheFile(self):
+        return self.filename + '.npz'
+
+    def loadCache(self, cache_file):
+        """
+        缓存存在且记录的源文件大小与修改时间一致时载入
+        :return: 是否载入成功
+        """
+        if not os.path.exists(cache_file):
+            return False
+        stat = os.stat(self.filename)
+        try:
+            with np.load(cache_file) as cached:
+                if int(cached['size']) != stat.st_size or int(cached['mtime']) != stat.st_mtime_ns:
+                    return False
+                self.KPoints = cached['kpoints'].tolist()
+                self.fields = cached['fields'].tolist()
+                self.IsSpinPolarized = bool(cached['spin_polarized'])
+                self.eigenvalueArray = cached['eigenvalues']
+                self.occupancyArray = cached['occupancies']
+                self.projections = cached['projections'].astype(self.dtype, copy=False)
+        except (OSError, ValueError, KeyError):
+            return False
+        _, self.nkpoints, self.nbands, self.nions, _ = self.projections.shape
+        return True
+
+    def saveCache(self, cache_file):
+        stat = os.stat(self.filename)
+        tmp_file = cache_file + '.tmp.npz'
+        try:
+            np.savez(tmp_file, size=stat.st_size, mtime=stat.st_mtime_ns, kpoints=np.array(self.KPoints),
+                     fields=np.array(self.fields), spin_polarized=self.IsSpinPolarized,
+                     eigenvalues=self.eigenvalueArray, occupancies=self.occupancyArray,
+                     projections=self.projections)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            warnings.warn(f"Cannot write PROCAR cache {cache_file}: {e}")
 
     def getEigenValues(self):
-        if len(self.lines) < 5:
+        if self.nkpoints == 0:
             warnings.warn(f"File {self.filename} is too short to be a valid PROCAR file.")
             return {}
         EigenvalData = {}
         EigenvalOcc = {}
+        eigenvalues = self.eigenvalues
+        occupancies = self.occupancies
         if self.IsSpinPolarized:
-            EigenvalData['spin 1'] = self.eigenvalues[0]
-            EigenvalData['spin 2'] = self.eigenvalues[1]
-            EigenvalOcc['spin 1'] = self.occupancies[0]
-            EigenvalOcc['spin 2'] = self.occupancies[1]
+            EigenvalData['spin 1'] = eigenvalues[0]
+            EigenvalData['spin 2'] = eigenvalues[1]
+            EigenvalOcc['spin 1'] = occupancies[0]
+            EigenvalOcc['spin 2'] = occupancies[1]
         else:
-            EigenvalData['spin 1'] = self.eigenvalues[0]
-            EigenvalOcc['spin 1'] = self.occupancies[0]
+            EigenvalData['spin 1'] = eigenvalues[0]
+            EigenvalOcc['spin 1'] = occupancies[0]
         return {
             "NumberOfGeneratedKPoints": self.nkpoints,
             "NumberOfBand": self.nbands,
@@ -141,26 +186,22 @@ class Procar:
             "EigenvalOcc": EigenvalOcc
         }
 
-    def getProjectedEigenvalOnIonOrbitals(self):
-        if len(self.lines) < 5:
+    def getProjectedEigenvalOnIonOrbitals(self, asarray=False):
+        """
+        :param asarray: 每个spin的数据保存为(ion, kpoint, band, orbital)的ndarray，轨道顺序同Decomposed
+        """
+        if self.nkpoints == 0:
             warnings.warn(f"File {self.filename} is too short to be a valid PROCAR file.")
             return {}
         DecomposedLength = len(self.fields)
         IsLmDecomposed = True if DecomposedLength == 9 or DecomposedLength == 16 else False
         Data = {}
-        for s in range(len(self.data)):
-            spindata = []
-            for i in range(self.nions):
-                ironsdata = []
-                for j in range(self.nkpoints):
-                    points = []
-                    for k in range(self.nbands):
-                        bands = {}
-                        for l in range(DecomposedLength):
-                            bands[self.fields[l]] = self.data[s][i][j][k][l]
-                        points.append(bands)
-                    ironsdata.append(points)
-                spindata.append(ironsdata)
+        fields = self.fields
+        for s in range(self.projections.shape[0]):
+            # ion -> kpoint -> band -> orbital
+            spindata = np.transpose(self.projections[s], (2, 0, 1, 3))
+            if not asarray:
+                spindata = [[[dict(zip(fields, band)) for band in kpoint] for kpoint in ion] for ion in spindata.tolist()]
             if s == 0:
                 Data[Spin.up] = spindata
             elif s == 1:
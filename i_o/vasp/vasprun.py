@@ -6,14 +6,15 @@ import time
 import xml.etree.cElementTree as ET
 import numpy as np
 import linecache
+import mmap
 import os
 
 from public.tools.Electronic import Spin
-from public.tools.periodic_table import PTable
+from public.tools.periodic_table import getPTable
 from public.lattice import Lattice
 from public.sites import Site, Atom
 from public.composition import Composition
-from public.tools.helper import parseVarray
+from public.tools.helper import parseVarray, parseSetArray, SetAccumulator, toList
 from public.calculation_type import CalType
 from entries.calculations import CalculateEntries
 from public.structure import Structure
@@ -21,15 +22,34 @@ from public.structure import Structure
 
 class Vasprun:
 
-    def __init__(self, vaspPath):
+    def __init__(self, vaspPath, streaming: bool = False, header_only: bool = False):
+        """
+        :param vaspPath: vasprun.xml路径
+        :param streaming: 流式解析，calculation中的dos/eigenvalues/projected以及dielectricfunction
+                          在iterparse过程中即被解析并从树中移除，适用于大文件
+        :param header_only: 只解析初始结构之前的incar、kpoints、parameters和atominfo，用于prescan
+        """
         self.output_structure = None
         self.input_structure = None
         self.filename = vaspPath
+        self.streaming = streaming
+        self.hasSetup = False
+        # 已解析的大数据块: eigenvalues, dos, projected, dielectricfunction
+        self._sections = {}
+        # 流式解析时已逐个<set>解析完成的顶层set数组，键为对应的set元素
+        self._decoded = {}
+        # 流式解析时当前calculation是否为最后一个，之前的calculation中的数据块不解析
+        self._lastCalculation = True
         try:
-            tree = ET.parse(vaspPath)
+            if header_only:
+                self.root = self._headerParse(vaspPath)
+            elif streaming:
+                self.root = self._streamParse(vaspPath)
+            else:
+                tree = ET.parse(vaspPath)
+                self.root = tree.getroot()
         except ET.ParseError:
             raise ValueError('File content error, not parse!')
-        self.root = tree.getroot()
         self.calculationType = None
         self.kPointPath = None
         self.lattice_init = None
@@ -75,7 +95,248 @@ class Vasprun:
         self.linearMagneticMoment = None
         self.elasticProperties = None
 
+    # 流式解析时逐个<set>解析的数据块
+    _streamedBlocks = ('dos', 'eigenvalues', 'projected', 'dielectricfunction')
+
+    def _streamParse(self, vaspPath):
+        """
+        单次iterparse遍历文件，数据块中的每个最内层<set>结束时即解析进数组并清除其中的行，
+        数据块结束时交给对应的handler组装后从树中移除，
+        保留下来的树只包含参数、结构、力、能量等小数据
+        :return: root
+        """
+        handlers = {
+            'calculation': self._handleCalculation,
+            'dos': self._handleCalculationChild,
+            'eigenvalues': self._handleCalculationChild,
+            'projected': self._handleCalculationChild,
+            'dielectricfunction': self._handleDielectricFunction,
+        }
+        total = self._countCalculations(vaspPath)
+        index = 0
+        pending = {}
+        stack = []
+        root = None
+        top = None
+        accumulator = None
+        for event, elem in ET.iterparse(vaspPath, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = elem
+                elif elem.tag == 'calculation' and len(stack) == 1:
+                    index += 1
+                    self._lastCalculation = index >= total
+                if elem.tag == 'set':
+                    if accumulator is None and stack[-1].tag == 'array':
+                        decode = self._decodeBlock(stack)
+                        if decode is not None:
+                            accumulator = SetAccumulator(decode)
+                            top = elem
+                    if accumulator is not None:
+                        accumulator.startSet()
+                stack.append(elem)
+                continue
+            stack.pop()
+            if accumulator is not None:
+                if elem.tag == 'r':
+                    accumulator.addRow(elem.text)
+                elif elem.tag == 'set':
+                    leaf, keep = accumulator.endSet()
+                    if leaf:
+                        del elem[:]
+                        if not keep:
+                            stack[-1].remove(elem)
+                    if elem is top:
+                        if accumulator.decode:
+                            self._decoded[elem] = accumulator.array()
+                        accumulator = None
+                        top = None
+                continue
+            handler = handlers.get(elem.tag)
+            if handler is not None and stack:
+                handler(elem, stack[-1], pending)
+        return root
+
+    def _decodeBlock(self, stack):
+        """
+        判断<array>下的顶层<set>是否属于流式解析的数据块
+        :param stack: 顶层set的祖先节点
+        :return: None: 不属于数据块; False: 属于不需要的数据块(之前的calculation、projected中的eigenvalues); True: 需要解析
+        """
+        for i in range(len(stack) - 1, 0, -1):
+            if stack[i].tag in self._streamedBlocks:
+                if stack[i].tag == 'dielectricfunction':
+                    return True
+                return self._lastCalculation and stack[i - 1].tag == 'calculation'
+        return None
+
+    @staticmethod
+    def isComplete(vaspPath, tail=4096):
+        """
+        只读取文件末尾判断vasprun.xml是否完整(以</modeling>结束)，计算中断时文件被截断，无法整体解析
+        :param tail: 读取的字节数
+        """
+        with open(vaspPath, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - tail, 0))
+            return b'</modeling>' in f.read()
+
+    @staticmethod
+    def _countCalculations(vaspPath):
+        """
+        :return: 文件中calculation的个数
+        """
+        count = 0
+        with open(vaspPath, 'rb') as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return count
+            with buffer:
+                pos = buffer.find(b'<calculation>')
+                while pos != -1:
+                    count += 1
+                    pos = buffer.find(b'<calculation>', pos + 13)
+        return count
+
+    @staticmethod
+    def _headerParse(vaspPath):
+        """
+        iterparse遇到初始结构(initialpos)或第一个calculation时即停止，不读取文件的其余部分
+        :return: 只包含其之前各节点的root
+        """
+        root = None
+        depth = 0
+        with open(vaspPath, 'rb') as f:
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                if event == 'end':
+                    depth -= 1
+                    continue
+                depth += 1
+                if root is None:
+                    root = elem
+                elif depth == 2 and (elem.tag == 'calculation' or elem.get('name') == 'initialpos'):
+                    root.remove(elem)
+                    break
+        return root
+
+    def _handleCalculationChild(self, elem, parent, pending):
+        # projected 中也包含 eigenvalues，只处理 calculation 的直接子节点
+        if parent.tag != 'calculation':
+            return
+        if self._lastCalculation:
+            pending[elem.tag] = self._sectionParsers[elem.tag](self, elem)
+        parent.remove(elem)
+        elem.clear()
+
+    def _handleCalculation(self, elem, parent, pending):
+        # 与 ./calculation[last()] 保持一致: 只保留最后一个 calculation 中的数据块
+        for name in ('eigenvalues', 'dos', 'projected'):
+            if name in pending:
+                self._sections[name] = pending[name]
+            else:
+                self._sections.pop(name, None)
+        pending.clear()
+
+    def _handleDielectricFunction(self, elem, parent, pending):
+        self._sections.setdefault('dielectricfunction', []).append(self._parseDielectricFunction(elem))
+        parent.remove(elem)
+        elem.clear()
+
+    def _getSection(self, name):
+        """
+        获取已解析的数据块，非流式模式下首次访问时从树中解析并缓存
+        """
+        if name not in self._sections and not self.streaming:
+            if name == 'dielectricfunction':
+                self._sections[name] = [self._parseDielectricFunction(elem)
+                                        for elem in self.root.iter('dielectricfunction')]
+            else:
+                elem = self.root.find(f"./calculation[last()]/{name}")
+                self._sections[name] = self._sectionParsers[name](self, elem) if elem is not None else None
+        return self._sections.get(name)
+
+    def _setArray(self, elem):
+        """
+        顶层set的数组，流式解析时已逐个<set>解析完成，否则整体解析
+        """
+        array = self._decoded.pop(elem, None)
+        return array if array is not None else parseSetArray(elem)
+
+    def _parseEigenvalues(self, elem):
+        child = elem.find("./array/set")
+        if child is None:
+            return None
+        spins = [Spin.up if s.attrib["comment"] == "spin 1" else Spin.down for s in child.findall('set')]
+        # spin -> kpoint -> band -> (energy, occ)
+        return {'spins': spins, 'data': self._setArray(child)}
+
+    def _parseDos(self, elem):
+        section = {'efermi': None, 'total': None, 'partial': None}
+        child = elem.find("./i[@name='efermi']")
+        if child is not None:
+            section['efermi'] = float(child.text)
+        child = elem.find("./total/array/set")
+        if child is not None:
+            sets = child.findall("set")
+            section['total'] = {
+                'spins': [Spin.up if s.attrib["comment"] == "spin 1" else Spin.down for s in sets],
+                # spin -> energy point -> (energy, total, integrated)
+                'data': self._setArray(child)
+            }
+        child = elem.find("./partial/array")
+        if child is not None:
+            fields = [field.text.strip() for field in child.findall("field") if "energy" not in field.text.strip()]
+            irons = child.find("set").findall("set")
+            spins = []
+            if irons:
+                spins = [Spin.up if s.attrib["comment"] == "spin 1" else Spin.down for s in irons[0].findall("set")]
+            section['partial'] = {
+                'fields': fields,
+                'spins': spins,
+                # iron -> spin -> energy point -> (energy, orbitals...)
+                'data': self._setArray(child.find("set"))
+            }
+        return section
+
+    def _parseProjected(self, elem):
+        child = elem.find("./array")
+        if child is None:
+            return None
+        fields = [field.text.strip() for field in child.findall('field')]
+        spins = [Spin.up if s.attrib["comment"] == "spin 1" else Spin.down for s in child.find('set').findall('set')]
+        # spin -> kpoint -> band -> iron -> orbital
+        return {'fields': fields, 'spins': spins, 'data': self._setArray(child.find('set'))}
+
+    def _parseDielectricFunction(self, elem):
+        return {
+            'comment': elem.attrib.get('comment', ''),
+            # energy point -> (energy, xx, yy, zz, xy, yz, zx)
+            'imag': self._setArray(elem.find("imag").find("array").find("set")),
+            'real': self._setArray(elem.find("real").find("array").find("set"))
+        }
+
+    _sectionParsers = {
+        'eigenvalues': _parseEigenvalues,
+        'dos': _parseDos,
+        'projected': _parseProjected,
+    }
+
+    def getEfermi(self):
+        """
+        最后一个 calculation 中的费米能
+        :return: float or None
+        """
+        dos = self._getSection('dos')
+        if dos is None:
+            return None
+        return dos['efermi']
+
     def setup(self):
+        # 判断计算类型时已调用过setup，计算类中再次调用时不重复解析
+        if self.hasSetup:
+            return
+        self.hasSetup = True
         self.lattice_init = self.getLatticeParameters(isinit=True)
         self.lattice_final = self.getLatticeParameters(isinit=False)
         self.composition = self.getComposition()
@@ -96,6 +357,46 @@ class Vasprun:
                                           sites=self.sites_final)
         self.output_structure.setup()
 
+    def getHeader(self):
+        """
+        计算类基本信息，无副作用，可由ParseCache缓存
+        :return: {'Parameters', 'Software', 'StartTime', 'CalculationType'}
+        """
+        self.setup()
+        return {'Parameters': dict(self.parameters), 'Software': self.software, 'StartTime': self.startTime,
+                'CalculationType': self.calculationType}
+
+    def getStructureDocs(self):
+        """
+        初始与最终结构的文档，缓存后命中时不再构建结构和做对称性分析
+        :return: {'InputStructure', 'OutputStructure'}
+        """
+        self.setup()
+        return {'InputStructure': self.input_structure.to_bson(), 'OutputStructure': self.output_structure.to_bson()}
+
+    def getFinalEnergy(self):
+        """
+        热力学性质所需的数据：最后一个离子步的e_fr_energy、原子数、费米能和各元素原子数
+        :return: {'TotalEnergy', 'NumberOfAtoms', 'Efermi', 'Composition': {元素: 原子数}}
+        """
+        child = self.root.find("./calculation[last()]/energy/i[@name='e_fr_energy']")
+        if child is None:
+            child = self.root.find("./energy/i[@name='e_fr_energy']")
+        composition = {comp.atomic_symbol: comp.amount for comp in self.getComposition()}
+        return {'TotalEnergy': float(child.text), 'NumberOfAtoms': self.getNumberOfSites(),
+                'Efermi': self.getEfermi(), 'Composition': composition}
+
+    def prescan(self):
+        """
+        只用文件头部判断计算类型并读取参数，调用顺序与setup一致，结果与完整解析相同；
+        不构建结构，不做对称性分析
+        :return: 计算类型
+        """
+        self.composition = self.getComposition()
+        self.calculationType = self.getCalType()
+        self.parameters = self.getParameters()
+        return self.calculationType
+
     def findPara(self, parameters: list):
         """
         获取指定的参数
@@ -139,7 +440,7 @@ class Vasprun:
                 composition = self.composition
                 for doc in composition:
                     symbol = doc.atomic_symbol
-                    em = PTable().enmax[symbol]
+                    em = getPTable().enmax[symbol]
                     enmax.append(em)
                 parameters_dict['ENCUT'] = max(enmax)
         return parameters_dict
@@ -212,10 +513,11 @@ class Vasprun:
             if child2[0].text.strip(' ') in composition.keys():
                 count += composition[child2[0].text.strip(' ')]
             composition.update({child2[0].text.strip(' '): count})
+        ptable = getPTable()
         for spec in composition.keys():
             atom = Composition(atomic_symbol=spec,
-                               atomic_number=PTable().detailed[spec]["Atomic no"],
-                               atomic_mass=PTable().detailed[spec]["Atomic mass"],
+                               atomic_number=ptable.getAtomicNumber(spec),
+                               atomic_mass=ptable.getAtomicMass(spec),
                                amount=composition[spec])
             composition_full.append(atom)
         return composition_full
@@ -400,69 +702,54 @@ class Vasprun:
             提取与频率相关的介电函数数据
             :return:
         """
-        # dielectricData = {}
-        energy = []
-        imag_part = []
-        real_part = []
-        imag = []
-        real = []
-        for event, elem in ET.iterparse(self.filename):
-            tag = elem.tag
-            if tag == "dielectricfunction":
-                imag = [[float(l) for l in r.text.split()] for r in
-                        elem.find("imag").find("array").find("set").findall("r")]
-                real = [[float(l) for l in r.text.split()] for r in
-                        elem.find("real").find("array").find("set").findall("r")]
-                break  # break 多个 dielectricfunction 只取得第一个die..
-        for e in imag:
-            energy.append(e[0])
-            imag_part.append(e[1:])
-        for e in real:
-            real_part.append(e[1:])
+        blocks = self._getSection('dielectricfunction')
+        if not blocks:
+            return {'Energy': [], 'real_part': [], 'imag_part': []}
+        block = blocks[0]  # 多个 dielectricfunction 只取得第一个
         dielectricData = {
-            'Energy': energy,
-            'real_part': real_part,
-            'imag_part': imag_part
+            'Energy': block['imag'][:, 0].tolist(),
+            'real_part': block['real'][:, 1:].tolist(),
+            'imag_part': block['imag'][:, 1:].tolist()
         }
         return dielectricData
 
+    def getDielectricArrays(self):
+        """
+        所有dielectricfunction块(如density-density与current-current)的数组，未转换为list
+        :return: [{'comment': str, 'energy': (nE,), 'real': (nE, 6), 'imag': (nE, 6)}, ...]
+        """
+        blocks = self._getSection('dielectricfunction') or []
+        return [{
+            'comment': block['comment'],
+            'energy': block['imag'][:, 0],
+            'real': block['real'][:, 1:],
+            'imag': block['imag'][:, 1:]
+        } for block in blocks]
+
     def getEigenValues(self):
         """
         提取本征值数据
         :return:
         """
-        NumberOfGeneratedKPoints = 0
-        NumberOfBand = 0
         IsSpinPolarized = False
-        KPoints = None
         EigenvalData = {}
         EigenvalOcc = {}
-        child = self.root.find("./calculation[last()]/dos/i[@name='efermi']")
-        efermi = float(child.text)
-        child = self.root.find("./calculation[last()]/eigenvalues/array/set")
-        if child is None:
+        efermi = self.getEfermi()
+        section = self._getSection('eigenvalues')
+        if section is None:
             return None
+        # 缓存命中时计算类不再调用setup，按需读取k点
+        if self.kPoints is None:
+            self.kPoints = self.getKPoints()
         KPoints = self.kPoints
         NumberOfGeneratedKPoints = len(KPoints)
-        for s in child.findall('set'):
-            spin = Spin.up if s.attrib["comment"] == "spin 1" else Spin.down
-            data = []
-            occ = []
-            for k in s.findall("set"):
-                t = np.array(parseVarray(k))
-                data.append(list(t[:, 0]))
-                occ.append(list(t[:, 1]))
-            NumberOfBand = len(data[0])
+        NumberOfBand = section['data'].shape[2]
+        for spin, data in zip(section['spins'], section['data']):
             # 按能带存储
-            EigenvalEnergyData = np.array(data).transpose()
-            EigenvalEnergyOcc = np.array(occ).transpose()
-
-            EigenvalData[spin] = EigenvalEnergyData.tolist()
-            EigenvalOcc[spin] = EigenvalEnergyOcc.tolist()
-
+            EigenvalData[spin] = data[:, :, 0].transpose().tolist()
+            EigenvalOcc[spin] = data[:, :, 1].transpose().tolist()
             if spin == Spin.down:
                 IsSpinPolarized = True
-        # NumberOfBand = len(EigenvalData[Spin['up']][0])
         return {
             "NumberOfGeneratedKPoints": NumberOfGeneratedKPoints,
             "NumberOfBand": NumberOfBand,
@@ -473,25 +760,43 @@ class Vasprun:
             "EigenvalOcc": EigenvalOcc
         }
 
-    def getTotalDos(self):
+    def getEigenValueArrays(self):
+        """
+        本征值及占据数数组，未转换为list
+        :return: (eigenvalues, occupancies), shape均为(spin, kpoint, band); 无数据时返回None
+        """
+        section = self._getSection('eigenvalues')
+        if section is None:
+            return None
+        return section['data'][..., 0], section['data'][..., 1]
+
+    def getProjectedArray(self):
+        """
+        分原子能带投影数组，未转换为list
+        :return: (fields, data), data shape为(spin, kpoint, band, ion, orbital); 无数据时返回None
+        """
+        section = self._getSection('projected')
+        if section is None:
+            return None
+        return section['fields'], section['data']
+
+    def getTotalDos(self, asarray=False):
         """
         提取总电子态密度数据
+        :param asarray: 能量和态密度保留为ndarray
         @return: dict or None if no total
         """
-
-        child = self.root.find("./calculation[last()]/dos/total/array/set")
-        if child is None:
+        dos = self._getSection('dos')
+        if dos is None or dos['total'] is None:
             return None
         IsSpinPolarized = False
         NumberOfGridPoints = 0
         Energies = list()
         TdosData = {}
-        for s in child.findall("set"):
-            spin = Spin.up if s.attrib["comment"] == "spin 1" else Spin.down
-            data = np.array(parseVarray(s))
-            Energies = list(data[:, 0])
-            TdosData[spin] = list(data[:, 1])
-            NumberOfGridPoints = len(data[:, 0])
+        for spin, data in zip(dos['total']['spins'], dos['total']['data']):
+            Energies = toList(data[:, 0], asarray)
+            TdosData[spin] = toList(data[:, 1], asarray)
+            NumberOfGridPoints = len(data)
             if spin == Spin.down:
                 IsSpinPolarized = True
         return {
@@ -501,46 +806,32 @@ class Vasprun:
             "TdosData": TdosData
         }
 
-    def getPartialDos(self):
+    def getPartialDos(self, asarray=False):
         """
         分原子轨道态密度
+        :param asarray: 能量和态密度保留为ndarray
         :return:
         """
-        child = self.root.find("./calculation[last()]/dos/partial/array")
-        if child is None:
+        dos = self._getSection('dos')
+        if dos is None or dos['partial'] is None:
             return None
-        IsSpinPolarized = False
+        partial = dos['partial']
+        IsSpinPolarized = Spin.down in partial['spins']
         NumberOfGridPoints = 301
-        NumberOfIons = 0  #
-        DecomposedLength = 0  # 分波态密度的投影数
-        IsLmDecomposed = False  # 是否计算了轨道投影
+        LDecomposed = partial['fields']
+        DecomposedLength = len(LDecomposed)  # 分波态密度的投影数
+        IsLmDecomposed = True if DecomposedLength == 9 or DecomposedLength == 16 else False  # 是否计算了轨道投影
+        NumberOfIons = len(partial['data'])
         Energies = {}
         PartialDosData = []
-        LDecomposed = []
-        for filed in child.findall("field"):
-            if "energy" not in filed.text.strip():
-                LDecomposed.append(filed.text.strip())
-        DecomposedLength = len(LDecomposed)
-        IsLmDecomposed = True if DecomposedLength == 9 or DecomposedLength == 16 else False
-        irons = child.find("set").findall("set")
-        NumberOfIons = len(irons)
-
-        for iron in irons:
-            energiesOfIron = []
-            dosOfIron = {}
-            for s in iron.findall("set"):
-                spin = Spin.up if s.attrib["comment"] == "spin 1" else Spin.down
-                data = np.array(parseVarray(s))
-                energiesOfIron = list(data[:, 0])
+        for iron in partial['data']:
+            dosOfIron = {orbital: {} for orbital in LDecomposed}
+            for spin, data in zip(partial['spins'], iron):
                 if spin not in Energies:
-                    Energies[spin] = energiesOfIron
-                NumberOfGridPoints = len(data[:, 0])
-                for i in range(0, DecomposedLength):
-                    if LDecomposed[i] not in dosOfIron:
-                        dosOfIron[LDecomposed[i]] = {}
-                    dosOfIron[LDecomposed[i]][spin] = list(data[:, i + 1])
-                if spin == Spin.down:
-                    IsSpinPolarized = True
+                    Energies[spin] = toList(data[:, 0], asarray)
+                NumberOfGridPoints = len(data)
+                for i, orbital in enumerate(LDecomposed):
+                    dosOfIron[orbital][spin] = toList(data[:, i + 1], asarray)
             PartialDosData.append(dosOfIron)
 
         return {
@@ -553,62 +844,38 @@ class Vasprun:
             "PartialDosData": PartialDosData
         }
 
-    def getProjectedEigenvalOnIonOrbitals(self):
+    def getProjectedEigenvalOnIonOrbitals(self, asarray=False):
         """
         提取分原子能带投影
+        :param asarray: 每个spin的数据保存为(iron, kpoint, band, orbital)的ndarray，轨道顺序同Decomposed，
+                        否则为按轨道名索引的嵌套list
         :return:
         """
         Data = {}
-        child = self.root.find("./calculation[last()]/projected/array")
-        if child is None:
+        section = self._getSection('projected')
+        if section is None:
             return None
+        if self.kPoints is None:
+            self.kPoints = self.getKPoints()
         KPoints = self.kPoints
         NumberOfGeneratedKPoints = len(KPoints)
-
-        fields = []
-        for field in child.findall('field'):
-            fields.append(field.text.strip())
+        fields = section['fields']
         DecomposedLength = len(fields)
         IsLmDecomposed = True if DecomposedLength == 9 or DecomposedLength == 16 else False
-
-        # 获取原数据格式
-        data = []
-        for s in child.find('set').findall('set'):  # spin
-            spin = Spin.up if s.attrib["comment"] == "spin 1" else Spin.down
-            spins = []
-            for i, kpoint in enumerate(s.findall('set')):
-                kpoints = []
-                for j, band in enumerate(kpoint.findall('set')):
-                    irons = parseVarray(band)
-                    kpoints.append(irons)
-                spins.append(kpoints)
-            data.append(spins)
-        # print(data)
-        # 数据格式变换
-        NumberOfIons = len(data[0][0][0])
-        NumberOfBand = len(data[0][0])
-        IsSpinPolarized = True if len(data) == 2 else False
         # spin -> kpoint -> band -> iron -> orbital
         # spin-> iron -> kpoint -> band -> orbital
-        # 调整维度
-        data_array = np.array(data)
-        data_trans = np.transpose(data_array, (0, 3, 1, 2, 4))
-        data = data_trans.tolist()
+        data = section['data']
+        NumberOfBand = data.shape[2]
+        NumberOfIons = data.shape[3]
+        IsSpinPolarized = True if len(data) == 2 else False
+        data = np.transpose(data, (0, 3, 1, 2, 4))
 
         # 格式保存
         for s in range(len(data)):
-            spindata = []
-            for i in range(NumberOfIons):
-                ironsdata = []
-                for j in range(NumberOfGeneratedKPoints):
-                    points = []
-                    for k in range(NumberOfBand):
-                        bands = {}
-                        for l in range(DecomposedLength):
-                            bands[fields[l]] = data[s][i][j][k][l]
-                        points.append(bands)
-                    ironsdata.append(points)
-                spindata.append(ironsdata)
+            if asarray:
+                spindata = data[s]
+            else:
+                spindata = [[[dict(zip(fields, band)) for band in point] for point in iron] for iron in data[s].tolist()]
             if s == 0:
                 Data[Spin.up] = spindata
             elif s == 1:
@@ -626,6 +893,7 @@ class Vasprun:
         }
 
     def getElectronicSteps(self):
+        self.setup()
         electronicSteps = []
         for child in self.root:
             if child.tag == 'calculation':
@@ -671,6 +939,7 @@ class Vasprun:
         return electronicSteps
 
     def getIonicSteps(self):
+        self.setup()
         ionicsteps = {}
         sites = self.sites_final
         sites_new = []
@@ -1,16 +1,225 @@
 #!/usr/bin/env python
 # -*- coding: UTF-8 -*-
 """
-@Project    : CalculationExtract 
+@Project    : CalculationExtract
 @File       : xdatcar.py
-@IDE        : PyCharm 
+@IDE        : PyCharm
 @Author     : zychen@cnic.cn
-@Date       : 2024/5/30 16:47 
-@Description: 
+@Date       : 2024/5/30 16:47
+@Description: 流式读取XDATCAR分子动力学轨迹
 """
+import mmap
+import warnings
+
+import numpy as np
+
+from public.tools.helper import parseNumbers
+
+
 class Xdatcar:
+    """
+    文件以内存映射方式打开，按帧或按固定帧数的批次返回ndarray，不将整个轨迹读入内存
+    每帧的偏移量在访问时按需扫描建立，访问第n帧只需扫描到第n+1帧；
+    变胞(NPT)文件中每帧之前的头部给出该帧的晶格
+    """
+
     def __init__(self, filename):
         self.filename = filename
-        with open(self.filename, 'r') as f:
-            self.lines = f.readlines()
-            f.close()
+        self.system = None
+        self.species = []
+        self.counts = []
+        self.natoms = 0
+        self.lattice = None
+        self.isVariableCell = False
+        # 已扫描到的各帧标题行偏移及其所用晶格的头部偏移
+        self._frameOffsets = []
+        self._headerOffsets = []
+        self._scanner = None
+        self._complete = False
+        self._end = None
+        self._lattices = {}
+        with open(self.filename, 'rb') as f:
+            try:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # 空文件无法映射
+                self.buffer = b''
+        if self.buffer[:1]:
+            self._readHeader()
+        else:
+            warnings.warn(f"File {self.filename} is too short to be a valid XDATCAR file.")
+
+    def _readHeader(self):
+        lines = self.buffer[:self._lineStart(self.buffer.find(b'configuration'))].decode('utf8').splitlines()
+        if len(lines) < 6:
+            warnings.warn(f"File {self.filename} is too short to be a valid XDATCAR file.")
+            return
+        self.system = lines[0].strip()
+        self.lattice = self._parseLattice(lines)
+        # VASP4格式没有元素行
+        if lines[5].split()[0].isdigit():
+            self.counts = [int(x) for x in lines[5].split()]
+        else:
+            self.species = lines[5].split()
+            self.counts = [int(x) for x in lines[6].split()]
+        self.natoms = sum(self.counts)
+
+    @staticmethod
+    def _parseLattice(lines):
+        """
+        :param lines: 头部各行，第2行为缩放系数，第3-5行为晶格矢量
+        """
+        scale = float(lines[1].split()[0])
+        lattice = np.array([[float(x) for x in line.split()[:3]] for line in lines[2:5]])
+        if scale < 0:
+            # 负的缩放系数表示体积
+            scale = (-scale / abs(np.linalg.det(lattice))) ** (1 / 3)
+        return lattice * scale
+
+    def _lineStart(self, pos):
+        if pos < 0:
+            return len(self.buffer)
+        return self.buffer.rfind(b'\n', 0, pos) + 1
+
+    def _linesBack(self, start, n):
+        """
+        从行首start向前n行的行首
+        """
+        for _ in range(n):
+            if start <= 0:
+                return 0
+            start = self.buffer.rfind(b'\n', 0, start - 1) + 1
+        return start
+
+    def _findHeader(self, start):
+        """
+        帧标题行之前是否为头部(上一行为各元素原子数)
+        :return: 头部起始偏移，没有头部时返回-1
+        """
+        if start == 0:
+            return -1
+        previous = self._linesBack(start, 1)
+        tokens = self.buffer[previous:start].split()
+        if not tokens or not all(token.isdigit() for token in tokens):
+            return -1
+        species = self._linesBack(previous, 1)
+        has_species = not self.buffer[species:previous].split()[0].isdigit()
+        return self._linesBack(start, 7 if has_species else 6)
+
+    def _scanFrames(self, pos=0):
+        """
+        从pos开始逐帧查找标题行，生成(头部偏移, 标题行偏移)，头部偏移为该帧所用晶格的头部
+        """
+        header = 0
+        while True:
+            found = self.buffer.find(b'configuration', pos)
+            if found == -1:
+                return
+            start = self._lineStart(found)
+            new_header = self._findHeader(start)
+            if new_header > 0:
+                header = new_header
+                self.isVariableCell = True
+            yield header, start
+            pos = found + len(b'configuration')
+
+    def _ensureFrames(self, count):
+        """
+        继续扫描直到已知count帧或到达文件末尾，文件末尾不完整的帧不计入
+        :return: 已知的帧数
+        """
+        if self._scanner is None:
+            self._scanner = self._scanFrames()
+        while not self._complete and len(self._frameOffsets) < count:
+            try:
+                header, start = next(self._scanner)
+            except StopIteration:
+                self._complete = True
+                last = len(self._frameOffsets) - 1
+                if last >= 0 and len(self._frameBlock(last).split()) < 3 * self.natoms:
+                    # 截断帧之前的一帧到截断帧(或其头部)为止
+                    self._end = self._frameEnd(last - 1) if last > 0 else 0
+                    self._frameOffsets.pop()
+                    self._headerOffsets.pop()
+                break
+            self._headerOffsets.append(header)
+            self._frameOffsets.append(start)
+        return len(self._frameOffsets)
+
+    def buildIndex(self):
+        """
+        扫描整个文件，建立所有帧的偏移量
+        """
+        self._ensureFrames(float('inf'))
+
+    def __len__(self):
+        self.buildIndex()
+        return len(self._frameOffsets)
+
+    def _frameEnd(self, index):
+        if index + 1 >= len(self._frameOffsets):
+            return len(self.buffer) if self._end is None else self._end
+        start = self._frameOffsets[index]
+        header = self._headerOffsets[index + 1]
+        return header if header > start else self._frameOffsets[index + 1]
+
+    def _frameBlock(self, index):
+        """
+        第index帧的坐标文本(不含标题行)
+        """
+        start = self._frameOffsets[index]
+        start = self.buffer.find(b'\n', start) + 1
+        return self.buffer[start:self._frameEnd(index)]
+
+    def _getLattice(self, header):
+        if header not in self._lattices:
+            lines = self.buffer[header:self.buffer.find(b'configuration', header)].decode('utf8').splitlines()
+            self._lattices[header] = self._parseLattice(lines)
+        return self._lattices[header]
+
+    def _parseFrames(self, first, last):
+        """
+        解析第first到last-1帧，调用前需已扫描到第last帧
+        """
+        text = b''.join(self._frameBlock(i) for i in range(first, last)).decode('utf8')
+        positions = parseNumbers(text).reshape(last - first, self.natoms, 3)
+        lattices = np.array([self._getLattice(self._headerOffsets[i]) for i in range(first, last)]).reshape(-1, 3, 3)
+        return lattices, positions
+
+    def getFrame(self, n):
+        """
+        随机访问第n帧，负数从末尾计数
+        :return: (lattice (3, 3), 分数坐标 (natoms, 3))
+        """
+        if n < 0:
+            n += len(self)
+        if n < 0 or self._ensureFrames(n + 2) <= n:
+            raise IndexError(f'frame {n} out of range')
+        lattices, positions = self._parseFrames(n, n + 1)
+        return lattices[0], positions[0]
+
+    def iterBatches(self, batch_size=100, start=0, stop=None):
+        """
+        按固定帧数的批次返回，边扫描边解析
+        :return: 生成器，每批为(lattices (k, 3, 3), 分数坐标 (k, natoms, 3))
+        """
+        first = start
+        while stop is None or first < stop:
+            last = min(first + batch_size, self._ensureFrames(first + batch_size + 1))
+            if stop is not None:
+                last = min(last, stop)
+            if last <= first:
+                return
+            yield self._parseFrames(first, last)
+            first = last
+
+    def iterFrames(self, start=0, stop=None):
+        """
+        逐帧返回(lattice, 分数坐标)
+        """
+        for lattices, positions in self.iterBatches(start=start, stop=stop):
+            yield from zip(lattices, positions)
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
@@ -6,7 +6,7 @@
 from typing import Union, Tuple, List
 import numpy as np
 
-from public.tools.periodic_table import PTable
+from public.tools.periodic_table import getPTable
 
 
 class Atom:
@@ -15,8 +15,9 @@ class Atom:
     """
     def __init__(self, atomicsymbol: str):
         self.atomicsymbol = atomicsymbol
-        self.atomicnumber = PTable().detailed[atomicsymbol]["Atomic no"]
-        self.atomicmass = PTable().detailed[atomicsymbol]["Atomic mass"]
+        ptable = getPTable()
+        self.atomicnumber = ptable.getAtomicNumber(atomicsymbol)
+        self.atomicmass = ptable.getAtomicMass(atomicsymbol)
 
 
 class Site:
@@ -12,18 +12,15 @@ import json
 from abc import abstractmethod, ABC
 from hashlib import md5
 from typing import List
-import spglib as spg
 from math import sqrt, pi
-from pymatgen.core.structure import Structure as PyStr
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer as sga
 from pymatgen.symmetry.groups import SpaceGroup
 from pymatgen.core.lattice import Lattice as PyLattice
 
 from public.lattice import Lattice
 from public.composition import Composition
 from public.sites import Site
-from public.tools.pointGroupInfo import pointgroup_symbol_num
 from public.tools.highSymmetryKPath import *
+from public.tools.symmetry_cache import getSymmetryCache
 
 
 class Structure():
@@ -56,6 +53,7 @@ class Structure():
         self.cellStress = None
         self.sitesDoc = None
         self.hashId = None
+        self._symmetry = None
 
     def setup(self):
         if self.lattice is None or self.composition is None or self.sites is None:
@@ -83,38 +81,29 @@ class Structure():
         if not spg.is_compatible(lattice, tol=0.01):
             raise ValueError('space group not compatible with lattice')
 
-    def getSpacePointGroup(self):
+    def getSymmetry(self):
         """
-        获取空间群,点群
+        对称性分析结果(空间群、点群、原胞、惯用胞)，经对称性缓存查询，同一结构只分析一次
         :return:
-           space
+           {'spaceGroup', 'pointGroup', 'primitiveLattice', 'conventionalLattice'}
         """
         if self.sites is None or self.lattice is None:
             raise ValueError('warning: please input lattice or sites!')
+        if self._symmetry is None:
+            lattice = self.lattice.matrix
+            pos = [i.coords for i in self.sites]
+            numbers = [i.atom.atomicnumber for i in self.sites]
+            self._symmetry = getSymmetryCache().get(lattice, pos, numbers)
+        return self._symmetry
 
-        lattice = self.lattice.matrix
-        sites = self.sites
-        pos = [i.coords for i in sites]
-        numbers = [i.atom.atomicnumber for i in sites]
-        cell = (lattice, pos, numbers)
-        dataset = spg.get_symmetry_dataset(cell, symprec=0.01, angle_tolerance=5)
-        if dataset is None:
-            raise ValueError('无法计算得出space group')
-        spaceGroup_type = spg.get_spacegroup_type(dataset["hall_number"])
-        spaceGroup = {
-            "spacegroupSymbol": spaceGroup_type['international_short'],
-            "spacegroupInternationalSymbol": spaceGroup_type['international_full'],
-            "SchoenfliesSymbol": spaceGroup_type['schoenflies'],
-            "spacegroupNumber": spaceGroup_type['number'],
-            "hallNumber": dataset['hall_number'],
-            "hallSymbol": spaceGroup_type['hall_symbol']
-        }
-        pointGroupSymbol = dataset['pointgroup']
-        pointGroup = {
-            "pointgroupSymbol": pointGroupSymbol,
-            "pointgroupNumber": pointgroup_symbol_num[pointGroupSymbol]
-        }
-        return spaceGroup, pointGroup
+    def getSpacePointGroup(self):
+        """
+        获取空间群,点群
+        :return:
+           space
+        """
+        symmetry = self.getSymmetry()
+        return symmetry['spaceGroup'], symmetry['pointGroup']
 
     def getNSites(self):
         """
@@ -307,31 +296,14 @@ class Structure():
         获取primitivelattice
         :return:
         """
-        if self.sites is None or self.lattice is None:
-            raise ValueError('warning: please input lattice or sites!')
-        lattice = self.lattice.matrix
-        sites = self.sites
-        pos = [i.coords for i in sites]
-        numbers = [i.atom.atomicnumber for i in sites]
-        cell = (lattice, pos, numbers)
-        lattice, _, _ = spg.find_primitive(cell, symprec=0.001, angle_tolerance=5)
-        return lattice
+        return self.getSymmetry()['primitiveLattice']
 
     def getConventionalLattice(self):
         """
         获取conventionallattice
         :return:
         """
-        if self.sites is None or self.lattice is None:
-            raise ValueError('warning: please input lattice or sites!')
-        lattice = self.lattice.matrix
-        sites = self.sites
-        pos = [i.coords for i in sites]
-        numbers = [i.atom.atomicnumber for i in sites]
-        struct = PyStr(lattice, numbers, pos)
-        conventional_struct = sga(struct).get_conventional_standard_structure()
-        conventional_lattice = conventional_struct.lattice.matrix
-        return conventional_lattice
+        return self.getSymmetry()['conventionalLattice']
 
     def getHighSymmetryKPath(self):
         """
@@ -0,0 +1,255 @@
+"""
+基于本征值数组与态密度数组的能隙计算
+
+本征值按(spin, kpoint, band)排列，可一次计算一批计算的能隙：
+不同计算的自旋数、k点数和能带数不同时用padEigenvalues以nan补齐为(calculation, spin, kpoint, band)。
+与原逐能带循环的判定一致：跨越费米能级的能带判为金属，最小值不高于费米能级的能带为价带，其余为导带。
+
+态密度按(spin, 能量格点)排列，批量计算时用padDos补齐。
+在费米能附近的窗口内找到第一个态密度为零的格点作为价带边，其后第一个态密度不为零的格点作为导带边。
+"""
+from typing import List, Sequence
+
+import numpy as np
+
+# 判定直接能隙时允许的能量误差(eV)
+DIRECT_GAP_TOLERANCE = 1e-6
+# 态密度不大于此值时视为零，数据库中的态密度均为非负数
+DOS_TOLERANCE = 0.1
+
+
+def padEigenvalues(eigenvalues: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    将多个(spin, kpoint, band)数组以nan补齐为一个批量数组
+    :param eigenvalues: 每个计算的本征值数组
+    :return: (calculation, spin, kpoint, band)
+    """
+    shape = np.max([np.shape(e) for e in eigenvalues], axis=0)
+    batch = np.full((len(eigenvalues), *shape), np.nan)
+    for i, e in enumerate(eigenvalues):
+        e = np.asarray(e, dtype=np.float64)
+        batch[i, :e.shape[0], :e.shape[1], :e.shape[2]] = e
+    return batch
+
+
+def bandGaps(eigenvalues: np.ndarray, efermi) -> dict:
+    """
+    批量计算能隙，nan为补齐的数据
+    :param eigenvalues: (calculation, spin, kpoint, band)
+    :param efermi: 每个计算的费米能, shape (calculation,)
+    :return: dict，能量均相对于费米能，无价带或导带时为nan，下标为-1:
+             IsMetal (calculation,)
+             VBM, CBM, Gap, DirectGap (calculation,)
+             VBMSpin, VBMKPointIndex, CBMSpin, CBMKPointIndex (calculation,)
+             IsDirect (calculation,)
+             SpinVBM, SpinCBM, SpinGap (calculation, spin)
+    """
+    energies = np.asarray(eigenvalues, dtype=np.float64)
+    energies = energies - np.asarray(efermi, dtype=np.float64).reshape(-1, 1, 1, 1)
+    n, nspin, nkpt, _ = energies.shape
+    padded = np.isnan(energies)
+    upper = np.where(padded, np.inf, energies)
+    lower = np.where(padded, -np.inf, energies)
+
+    # 每条能带在k点上的最小/最大值 (calculation, spin, band)
+    band_min = upper.min(axis=2)
+    band_max = lower.max(axis=2)
+    valid = np.isfinite(band_min)
+    is_metal = (valid & (band_min * band_max < 0)).any(axis=(1, 2))
+    valence = valid & (band_min <= 0)
+    conduction = valid & (band_min > 0)
+
+    # 每个k点的价带顶与导带底 (calculation, spin, kpoint)
+    valence_top = np.where(valence[:, :, None, :], lower, -np.inf).max(axis=3)
+    conduction_bottom = np.where(conduction[:, :, None, :], upper, np.inf).min(axis=3)
+
+    spin_vbm = valence_top.max(axis=2)
+    spin_cbm = conduction_bottom.min(axis=2)
+    vbm_index = valence_top.reshape(n, -1).argmax(axis=1)
+    cbm_index = conduction_bottom.reshape(n, -1).argmin(axis=1)
+    vbm = spin_vbm.max(axis=1)
+    cbm = spin_cbm.min(axis=1)
+    found = np.isfinite(vbm) & np.isfinite(cbm)
+
+    # 同一k点上(不区分自旋)导带底与价带顶之差的最小值
+    with np.errstate(invalid='ignore'):
+        direct_gap = (conduction_bottom.min(axis=1) - valence_top.max(axis=1)).min(axis=1)
+        gap = cbm - vbm
+        is_direct = found & (direct_gap - gap <= DIRECT_GAP_TOLERANCE)
+
+    def finite(values):
+        return np.where(np.isfinite(values), values, np.nan)
+
+    return {
+        'IsMetal': is_metal,
+        'VBM': finite(vbm),
+        'CBM': finite(cbm),
+        'Gap': np.where(found, gap, np.nan),
+        'DirectGap': np.where(found, direct_gap, np.nan),
+        'IsDirect': is_direct,
+        'VBMSpin': np.where(found, vbm_index // nkpt, -1),
+        'VBMKPointIndex': np.where(found, vbm_index % nkpt, -1),
+        'CBMSpin': np.where(found, cbm_index // nkpt, -1),
+        'CBMKPointIndex': np.where(found, cbm_index % nkpt, -1),
+        'SpinVBM': finite(spin_vbm),
+        'SpinCBM': finite(spin_cbm),
+        'SpinGap': finite(spin_cbm - spin_vbm),
+    }
+
+
+def bandGap(eigenvalues: np.ndarray, efermi: float) -> dict:
+    """
+    单个计算的能隙
+    :param eigenvalues: (spin, kpoint, band)
+    :param efermi: 费米能
+    :return: 与bandGaps相同的键，值为python标量，SpinVBM/SpinCBM/SpinGap为list
+    """
+    result = bandGaps(np.asarray(eigenvalues)[None], [efermi])
+    return {key: value[0].tolist() for key, value in result.items()}
+
+
+def gapDoc(eigenvalues: np.ndarray, efermi: float) -> dict:
+    """
+    文档中GapFromBand的格式，金属为{"GapFromBand": "Metal"}，缺少价带或导带时为{}
+    :param eigenvalues: (spin, kpoint, band)
+    :param efermi: 费米能
+    """
+    return batchGapDocs([eigenvalues], [efermi])[0]
+
+
+def batchGapDocs(eigenvalues: List[np.ndarray], efermi: Sequence[float]) -> List[dict]:
+    """
+    一批计算的GapFromBand，用于对整个集合重新计算能隙
+    :param eigenvalues: 每个计算的(spin, kpoint, band)数组
+    :param efermi: 每个计算的费米能
+    """
+    if not eigenvalues:
+        return []
+    result = bandGaps(padEigenvalues(eigenvalues), efermi)
+    docs = []
+    for i in range(len(eigenvalues)):
+        if result['IsMetal'][i]:
+            docs.append({"GapFromBand": "Metal"})
+        elif np.isnan(result['Gap'][i]):
+            docs.append({})
+        else:
+            docs.append({
+                "GapFromBand": float(result['Gap'][i]),
+                "GapType": "direct gap" if result['IsDirect'][i] else "indirect gap",
+                "VBMFromBand": float(result['VBM'][i]),
+                "CBMFromBand": float(result['CBM'][i])
+            })
+    return docs
+
+
+def padDos(energies: Sequence[np.ndarray], dos: Sequence[np.ndarray]):
+    """
+    将多个态密度以nan补齐为批量数组
+    :param energies: 每个计算的能量格点 (npoint,)
+    :param dos: 每个计算的总态密度 (spin, npoint)
+    :return: (energies (calculation, npoint), dos (calculation, spin, npoint))
+    """
+    npoint = max(len(e) for e in energies)
+    nspin = max(len(d) for d in dos)
+    energy_batch = np.full((len(energies), npoint), np.nan)
+    dos_batch = np.full((len(dos), nspin, npoint), np.nan)
+    for i, (e, d) in enumerate(zip(energies, dos)):
+        d = np.asarray(d, dtype=np.float64)
+        energy_batch[i, :len(e)] = e
+        dos_batch[i, :d.shape[0], :d.shape[1]] = d
+    return energy_batch, dos_batch
+
+
+def dosGaps(energies: np.ndarray, dos: np.ndarray, efermi, energy_tolerance=None,
+            dos_tolerance: float = DOS_TOLERANCE) -> dict:
+    """
+    批量计算态密度能隙，nan为补齐的数据
+    :param energies: (calculation, npoint)
+    :param dos: (calculation, spin, npoint)
+    :param efermi: 每个计算的费米能, shape (calculation,)
+    :param energy_tolerance: 费米能附近窗口的半宽(eV)，为None时取各计算的平均格点间距
+    :param dos_tolerance: 态密度不大于此值时视为零
+    :return: dict，能量均相对于费米能:
+             IsMetal (calculation,)
+             VBM, CBM, Gap (calculation,)，金属为nan
+             SpinVBM, SpinCBM (calculation, spin)
+    """
+    energies = np.asarray(energies, dtype=np.float64)
+    energies = energies - np.asarray(efermi, dtype=np.float64).reshape(-1, 1)
+    dos = np.asarray(dos, dtype=np.float64)
+    valid = ~np.isnan(energies)
+    number = valid.sum(axis=1)
+    last = np.maximum(number - 1, 0)
+    if energy_tolerance is None:
+        first_energy = energies[:, 0]
+        last_energy = np.take_along_axis(energies, last[:, None], axis=1)[:, 0]
+        energy_tolerance = (last_energy - first_energy) / np.maximum(number, 1)
+    energy_tolerance = np.broadcast_to(np.asarray(energy_tolerance, dtype=np.float64), number.shape)
+
+    # 费米能窗口内第一个态密度为零的格点为价带边
+    window = valid & (np.abs(energies) <= energy_tolerance[:, None])
+    spin_valid = ~np.isnan(dos).all(axis=2)
+    empty = window[:, None, :] & (dos <= dos_tolerance)
+    has_edge = empty.any(axis=2)
+    vbm_index = empty.argmax(axis=2)
+    # 价带边之后第一个态密度不为零的格点为导带边，不存在时取最后一个格点
+    points = np.arange(energies.shape[1])
+    occupied = valid[:, None, :] & (dos > dos_tolerance) & (points >= vbm_index[:, :, None])
+    cbm_index = np.where(occupied.any(axis=2), occupied.argmax(axis=2), last[:, None])
+
+    spin_energies = np.broadcast_to(energies[:, None, :], dos.shape)
+    spin_vbm = np.take_along_axis(spin_energies, vbm_index[:, :, None], axis=2)[:, :, 0]
+    spin_cbm = np.take_along_axis(spin_energies, cbm_index[:, :, None], axis=2)[:, :, 0]
+    spin_vbm = np.where(spin_valid & has_edge, spin_vbm, np.nan)
+    spin_cbm = np.where(spin_valid & has_edge, spin_cbm, np.nan)
+    vbm = np.where(spin_valid, spin_vbm, -np.inf).max(axis=1)
+    cbm = np.where(spin_valid, spin_cbm, np.inf).min(axis=1)
+    # 任一自旋在费米能附近有态，或一个自旋的导带边低于另一个自旋的价带边时为金属
+    with np.errstate(invalid='ignore'):
+        gap = cbm - vbm
+        is_metal = (spin_valid & ~has_edge).any(axis=1) | ~(gap >= 0)
+    return {
+        'IsMetal': is_metal,
+        'VBM': np.where(is_metal, np.nan, vbm),
+        'CBM': np.where(is_metal, np.nan, cbm),
+        'Gap': np.where(is_metal, np.nan, gap),
+        'SpinVBM': spin_vbm,
+        'SpinCBM': spin_cbm,
+    }
+
+
+def batchDosGapDocs(energies: List[np.ndarray], dos: List[np.ndarray], efermi: Sequence[float],
+                    energy_tolerance=None, dos_tolerance: float = DOS_TOLERANCE) -> List[dict]:
+    """
+    一批计算的GapFromDOS，用于以不同的容差对整个集合重新计算能隙
+    :param energies: 每个计算的能量格点
+    :param dos: 每个计算的(spin, npoint)总态密度
+    :param efermi: 每个计算的费米能
+    :param energy_tolerance: 费米能附近窗口的半宽(eV)，为None时取各计算的平均格点间距
+    :param dos_tolerance: 态密度不大于此值时视为零
+    """
+    if not energies:
+        return []
+    result = dosGaps(*padDos(energies, dos), efermi, energy_tolerance, dos_tolerance)
+    docs = []
+    for i in range(len(energies)):
+        if result['IsMetal'][i]:
+            docs.append({"GapFromDOS": "Metal"})
+        else:
+            docs.append({
+                "GapFromDOS": float(result['Gap'][i]),
+                "VBMfromDOS": float(result['VBM'][i]),
+                "CBMfromDOS": float(result['CBM'][i])
+            })
+    return docs
+
+
+def dosGapDoc(energies: np.ndarray, dos: np.ndarray, efermi: float, energy_tolerance=None,
+              dos_tolerance: float = DOS_TOLERANCE) -> dict:
+    """
+    文档中GapFromDOS的格式
+    :param energies: 能量格点 (npoint,)
+    :param dos: 总态密度 (spin, npoint)
+    :param efermi: 费米能
+    """
+    return batchDosGapDocs([energies], [dos], [efermi], energy_tolerance, dos_tolerance)[0]
@@ -1,5 +1,9 @@
+import re
+import warnings
 from typing import List, Dict
 
+import numpy as np
+
 
 def exists(obj, fields: List):
     temp = obj
@@ -38,3 +42,167 @@ def parseVarray(elem):
     else:
         m = [[float(i) if '*' not in i else None for i in v.text.split()] for v in elem]
     return m
+
+
+def toList(array: np.ndarray, asarray: bool = False):
+    """
+    asarray为True时原样返回ndarray(由ArrayCodec直接编码为Binary)，否则转为list
+    """
+    return array if asarray else array.tolist()
+
+
+def parseNumbers(text: str) -> np.ndarray:
+    """
+    一次性将空白分隔的数字文本解析为一维数组
+    溢出的'****'记为nan(parseVarray中记为None)，其他无法解析的内容抛出ValueError
+    """
+    if '*' in text:
+        text = re.sub(r'\S*\*\S*', 'nan', text)
+    with warnings.catch_warnings():
+        # 较早的numpy遇到无法解析的内容时只给出DeprecationWarning并返回截断的数组
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=np.float64, sep=' ')
+        except DeprecationWarning as e:
+            raise ValueError(str(e))
+
+
+def parseTable(lines, ncols: int) -> np.ndarray:
+    """
+    将列数固定的多行文本解析为(行数, ncols)的数组
+    优先使用numpy的C解析器，含'****'等无法解析的数字时退回parseNumbers
+    :param lines: 文本行序列
+    :param ncols: 列数
+    :return: ndarray
+    """
+    try:
+        table = np.loadtxt(lines, dtype=np.float64, ndmin=2)
+    except ValueError:
+        table = parseNumbers(' '.join(lines))
+    return table.reshape(-1, ncols)
+
+
+def parseSetArray(elem) -> np.ndarray:
+    """
+    将<set>/<varray>整体解析为ndarray
+    嵌套的<set>依次构成前几个维度，最内层的<r>/<v>为行，行内数字为最后一个维度，
+    例如projected: (spin, kpoint, band, ion, orbital)
+    :param elem: set或varray元素
+    :return: ndarray
+    """
+    shape = []
+    node = elem
+    while True:
+        sets = node.findall('set')
+        if not sets:
+            break
+        shape.append(len(sets))
+        node = sets[0]
+    rows = [child for child in node if child.tag in ('r', 'v')]
+    if not rows:
+        return np.zeros(shape + [0])
+    shape.append(len(rows))
+    shape.append(len(rows[0].text.split()))
+    text = ' '.join(child.text for child in elem.iter() if child.tag in ('r', 'v'))
+    data = parseNumbers(text)
+    if data.size != np.prod(shape):
+        # 不规则的数据块，退回逐行解析
+        return np.array(_parseSetList(elem))
+    return data.reshape(shape)
+
+
+class SetAccumulator:
+    """
+    iterparse过程中逐个解析<set>数据块: 每个最内层<set>结束时即将其中的行解析进预分配的数组
+    (容量不足时倍增)，调用方随后可清除该<set>的行，结果与parseSetArray相同
+    """
+
+    def __init__(self, decode: bool = True):
+        """
+        :param decode: 为False时只记录结构，不解析数据(用于直接丢弃的数据块)
+        """
+        self.decode = decode
+        # 每层已结束的set数，第0层为顶层set
+        self._counts = []
+        # 当前路径上各层set在父节点中的序号，及各层已开始的子set数
+        self._path = []
+        self._children = []
+        self._texts = []
+        self._leaf = None
+        self._rows = None
+        self._ncols = None
+        self._data = None
+        self._size = 0
+
+    def startSet(self):
+        if self._path:
+            self._path.append(self._children[-1])
+            self._children[-1] += 1
+        else:
+            self._path.append(0)
+        self._children.append(0)
+        if len(self._counts) < len(self._path):
+            self._counts.append(0)
+
+    def addRow(self, text: str):
+        self._texts.append(text)
+
+    def endSet(self):
+        """
+        :return: (是否为最内层set, 是否需要保留在树中)
+                 只保留第一个分支上的最内层set，以及顶层set的直接子节点，供读取spin等属性
+        """
+        level = len(self._path) - 1
+        keep = all(index == 0 for index in self._path[1:-1])
+        self._path.pop()
+        self._children.pop()
+        self._counts[level] += 1
+        if not self._texts:
+            return False, True
+        if self._leaf is None:
+            self._leaf = level
+            self._rows = len(self._texts)
+            self._ncols = len(self._texts[0].split())
+        elif level != self._leaf or len(self._texts) != self._rows:
+            raise ValueError('Irregular <set> block')
+        if self.decode:
+            self._append(parseNumbers(' '.join(self._texts)))
+        self._texts = []
+        return True, keep
+
+    def _append(self, data: np.ndarray):
+        end = self._size + data.size
+        if self._data is None or end > self._data.size:
+            capacity = max(end, 2 * (self._data.size if self._data is not None else 0))
+            buffer = np.empty(capacity, dtype=np.float64)
+            if self._data is not None:
+                buffer[:self._size] = self._data[:self._size]
+            self._data = buffer
+        self._data[self._size:end] = data
+        self._size = end
+
+    def array(self) -> np.ndarray:
+        """
+        :return: 与parseSetArray相同形状的ndarray，decode为False时返回None
+        """
+        if not self.decode:
+            return None
+        depth = len(self._counts) if self._leaf is None else self._leaf + 1
+        shape = [self._counts[level] // self._counts[level - 1] for level in range(1, depth)]
+        if self._leaf is None:
+            return np.zeros(shape + [0])
+        shape += [self._rows, self._ncols]
+        if self._size != np.prod(shape):
+            raise ValueError('Irregular <set> block')
+        data = self._data[:self._size]
+        if self._data.size != self._size:
+            data = data.copy()
+        self._data = None
+        return data.reshape(shape)
+
+
+def _parseSetList(elem):
+    sets = elem.findall('set')
+    if sets:
+        return [_parseSetList(s) for s in sets]
+    return parseVarray(elem)
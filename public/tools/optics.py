@@ -0,0 +1,94 @@
+"""
+由介电函数计算光学常数
+
+输入为Vasprun.getDielectricArrays中每个dielectricfunction块的数组:
+能量(nE,)、实部与虚部(nE, 6)，6列依次为xx, yy, zz, xy, yz, zx。
+所有光学常数均以整个数组计算，结果与输入形状相同。
+"""
+import math
+
+import numpy as np
+
+from public.tools.helper import toList
+
+# 光速(m/s)、普朗克常数(J·s)、元电荷(C)、真空介电常数(F/m)
+C = 2.9979 * math.pow(10, 8)
+H = 6.62607 * math.pow(10, -34)
+E = 1.602176 * math.pow(10, -19)
+EPSILON0 = 8.8542 * math.pow(10, -12)
+
+
+def opticalConstants(energy: np.ndarray, real: np.ndarray, imag: np.ndarray) -> dict:
+    """
+    :param energy: 能量(eV), shape (nE,)
+    :param real: 介电函数实部, shape (nE, 6)
+    :param imag: 介电函数虚部, shape (nE, 6)
+    :return: {'RefractiveIndex', 'ExtinctionIndex', 'EnergyLoss', 'AdsorptionCoefficient',
+              'ReflectivityCoefficient', 'ConductivityReal', 'ConductivityImag'}，均为(nE, 6)
+    """
+    energy = np.asarray(energy, dtype=np.float64)[:, None]
+    real = np.asarray(real, dtype=np.float64)
+    imag = np.asarray(imag, dtype=np.float64)
+    modulus = np.sqrt(real * real + imag * imag)
+    # 折射率与消光系数
+    n_w = np.sqrt(modulus + real) / math.sqrt(2)
+    k_w = np.sqrt(modulus - real) / math.sqrt(2)
+    # 能量损失谱，实部或虚部为零时记为0
+    nonzero = (real != 0) & (imag != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        l_w = np.where(nonzero, imag / (real * real + imag * imag), 0.)
+    # 吸收系数与反射率
+    alpha = 4 * math.pi * energy * E * k_w / (H * C)
+    r_w = ((n_w - 1) ** 2 + k_w ** 2) / ((n_w + 1) ** 2 + k_w ** 2)
+    # 光电导率 sigma = -i * epsilon0 * w * (epsilon - 1)
+    w = 2 * math.pi * energy * E / H
+    factor = -EPSILON0 * w
+    return {
+        'RefractiveIndex': n_w,
+        'ExtinctionIndex': k_w,
+        'EnergyLoss': l_w,
+        'AdsorptionCoefficient': alpha,
+        'ReflectivityCoefficient': r_w,
+        'ConductivityReal': -(factor * imag),
+        'ConductivityImag': factor * (real - 1)
+    }
+
+
+def opticalDoc(energy: np.ndarray, real: np.ndarray, imag: np.ndarray, method: str = None,
+               asarray: bool = False) -> dict:
+    """
+    文档中OpticalProperties的格式
+    :param method: dielectricfunction块的comment，如density-density、current-current
+    :param asarray: 各谱数据保留为ndarray
+    """
+    constants = opticalConstants(energy, real, imag)
+    doc = {
+        "NumberofEnergyPoints": len(energy),
+        "Energies": toList(np.asarray(energy), asarray),
+        "DielectricFunctions": {
+            "RealPart": toList(np.asarray(real), asarray),
+            'ImaginaryPart': toList(np.asarray(imag), asarray)
+        },
+        "RefractiveIndex": {
+            "Data": toList(constants['RefractiveIndex'], asarray)
+        },
+        "Energy_lossSpectrumFunction": {
+            "Data": toList(constants['EnergyLoss'], asarray)
+        },
+        "ExtinctionIndex": {
+            "Data": toList(constants['ExtinctionIndex'], asarray)
+        },
+        "AdsorptionCoefficient": {
+            "Data": toList(constants['AdsorptionCoefficient'], asarray)
+        },
+        "ReflectivityCoefficient": {
+            "Data": toList(constants['ReflectivityCoefficient'], asarray)
+        },
+        "OpticalConductivity": {
+            "RealPart": toList(constants['ConductivityReal'], asarray),
+            "ImaginaryPart": toList(constants['ConductivityImag'], asarray)
+        }
+    }
+    if method:
+        doc["Method"] = method
+    return doc
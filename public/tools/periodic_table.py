@@ -1,3 +1,9 @@
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+
+
 class PTable:
     def __init__(self):
         self.atom_data = [
@@ -10334,3 +10340,70 @@ class PTable:
         }
 
 
+
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return MappingProxyType({key: _freeze(value) for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(value) for value in obj)
+    return obj
+
+
+class SharedPTable:
+    """
+    只读的元素周期表，由getPTable()构建一次后在进程内共享
+    除PTable的各字典外，另按原子序数建立符号索引及紧凑数组:
+    symbols[i] / atomicNumbers[i] / atomicMasses[i] 对应同一元素
+    """
+
+    def __init__(self):
+        table = PTable()
+        detailed = table.detailed
+        symbols = sorted(detailed, key=lambda symbol: detailed[symbol]["Atomic no"])
+        object.__setattr__(self, 'atom_data', _freeze(table.atom_data))
+        object.__setattr__(self, 'detailed', _freeze(detailed))
+        object.__setattr__(self, 'enmax', _freeze(table.enmax))
+        object.__setattr__(self, 'atom_energy', _freeze(table.atom_energy))
+        object.__setattr__(self, 'symbols', tuple(symbols))
+        object.__setattr__(self, '_index', MappingProxyType({symbol: i for i, symbol in enumerate(symbols)}))
+        numbers = np.array([detailed[symbol]["Atomic no"] for symbol in symbols], dtype=np.int16)
+        masses = np.array([detailed[symbol].get("Atomic mass", np.nan) for symbol in symbols], dtype=np.float64)
+        numbers.setflags(write=False)
+        masses.setflags(write=False)
+        object.__setattr__(self, 'atomicNumbers', numbers)
+        object.__setattr__(self, 'atomicMasses', masses)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('SharedPTable is read-only')
+
+    def __delattr__(self, key):
+        raise AttributeError('SharedPTable is read-only')
+
+    def index(self, symbol: str) -> int:
+        """
+        元素符号在symbols/atomicNumbers/atomicMasses中的下标
+        """
+        return self._index[symbol]
+
+    def getAtomicNumber(self, symbol: str):
+        return self.detailed[symbol]["Atomic no"]
+
+    def getAtomicMass(self, symbol: str):
+        return self.detailed[symbol]["Atomic mass"]
+
+    def getIndices(self, symbols) -> np.ndarray:
+        """
+        批量查询元素符号下标，可直接用于索引atomicNumbers/atomicMasses
+        :param symbols: 元素符号序列
+        :return: ndarray
+        """
+        return np.fromiter((self._index[symbol] for symbol in symbols), dtype=np.intp)
+
+
+@lru_cache(maxsize=None)
+def getPTable() -> SharedPTable:
+    """
+    进程内共享的只读元素周期表，首次调用时构建
+    """
+    return SharedPTable()
@@ -0,0 +1,162 @@
+"""
+对称性分析缓存
+
+以(晶格, 元素, 分数坐标, symprec)的规范化哈希为键，缓存空间群、点群、原胞与惯用胞晶格。
+几何优化/弹性计算的离子步中大量结构对称性相同，命中缓存时不再重复调用spglib和pymatgen。
+"""
+import json
+import os
+import threading
+from hashlib import md5
+
+import numpy as np
+import spglib as spg
+from pymatgen.core.structure import Structure as PyStr
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer as sga
+
+from public.tools.pointGroupInfo import pointgroup_symbol_num
+
+# 空间群/惯用胞的容差，与SpacegroupAnalyzer默认值一致
+SYMPREC = 0.01
+ANGLE_TOLERANCE = 5
+# 原胞的容差
+PRIMITIVE_SYMPREC = 0.001
+
+
+def analyzeSymmetry(lattice, positions, numbers, symprec=SYMPREC, angle_tolerance=ANGLE_TOLERANCE):
+    """
+    对称性分析，同一个spglib dataset同时给出空间群、点群和惯用胞
+    :param lattice: 3x3晶格矩阵
+    :param positions: 分数坐标
+    :param numbers: 原子序数
+    :return: {'spaceGroup', 'pointGroup', 'primitiveLattice', 'conventionalLattice'}
+    """
+    analyzer = sga(PyStr(lattice, numbers, positions), symprec=symprec, angle_tolerance=angle_tolerance)
+    dataset = analyzer.get_symmetry_dataset()
+    if dataset is None:
+        raise ValueError('无法计算得出space group')
+    spaceGroup_type = spg.get_spacegroup_type(dataset["hall_number"])
+    pointGroupSymbol = dataset["pointgroup"]
+    primitive_lattice, _, _ = spg.find_primitive((lattice, positions, numbers), symprec=PRIMITIVE_SYMPREC,
+                                                 angle_tolerance=angle_tolerance)
+    return {
+        'spaceGroup': {
+            "spacegroupSymbol": spaceGroup_type['international_short'],
+            "spacegroupInternationalSymbol": spaceGroup_type['international_full'],
+            "SchoenfliesSymbol": spaceGroup_type['schoenflies'],
+            "spacegroupNumber": spaceGroup_type['number'],
+            "hallNumber": dataset["hall_number"],
+            "hallSymbol": spaceGroup_type['hall_symbol']
+        },
+        'pointGroup': {
+            "pointgroupSymbol": pointGroupSymbol,
+            "pointgroupNumber": pointgroup_symbol_num[pointGroupSymbol]
+        },
+        'primitiveLattice': np.asarray(primitive_lattice).tolist(),
+        'conventionalLattice': analyzer.get_conventional_standard_structure().lattice.matrix.tolist()
+    }
+
+
+class SymmetryCache:
+    """
+    对称性分析结果缓存，可选地持久化为json文件以便多次运行之间复用
+    """
+
+    def __init__(self, path: str = None, decimals: int = 8):
+        """
+        :param path: 持久化文件路径，为None时只缓存在内存中
+        :param decimals: 生成键时晶格与坐标保留的小数位数
+        """
+        self.path = path
+        self.decimals = decimals
+        self._entries = {}
+        self._new = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, lattice, positions, numbers, symprec=SYMPREC):
+        """
+        规范化哈希: 晶格与坐标按decimals取整，分数坐标折回[0, 1)
+        """
+        lattice = np.round(np.asarray(lattice, dtype=np.float64), self.decimals) + 0.
+        positions = np.round(np.asarray(positions, dtype=np.float64), self.decimals) % 1.0
+        positions = np.round(positions, self.decimals) % 1.0 + 0.
+        numbers = np.asarray(numbers, dtype=np.int64)
+        digest = md5()
+        digest.update(lattice.tobytes())
+        digest.update(numbers.tobytes())
+        digest.update(positions.tobytes())
+        digest.update(repr(float(symprec)).encode('utf8'))
+        return digest.hexdigest()
+
+    def get(self, lattice, positions, numbers, symprec=SYMPREC):
+        """
+        查询对称性分析结果，未命中时计算并写入缓存
+        :return: {'spaceGroup', 'pointGroup', 'primitiveLattice', 'conventionalLattice'}，晶格为ndarray
+        """
+        key = self.key(lattice, positions, numbers, symprec)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = analyzeSymmetry(lattice, positions, numbers, symprec=symprec)
+            with self._lock:
+                self._entries[key] = entry
+                self._new[key] = entry
+        return {
+            'spaceGroup': dict(entry['spaceGroup']),
+            'pointGroup': dict(entry['pointGroup']),
+            'primitiveLattice': np.array(entry['primitiveLattice']),
+            'conventionalLattice': np.array(entry['conventionalLattice'])
+        }
+
+    def drain(self):
+        """
+        取出上次drain之后新增的条目，用于从子进程汇总到主进程
+        """
+        with self._lock:
+            new, self._new = self._new, {}
+        return new
+
+    def update(self, entries: dict):
+        with self._lock:
+            self._entries.update(entries)
+            self._new.update(entries)
+
+    def load(self, path: str = None):
+        path = path or self.path
+        with open(path, 'r', encoding='utf8') as f:
+            entries = json.load(f)
+        with self._lock:
+            self._entries.update(entries)
+
+    def save(self, path: str = None):
+        """
+        写入json文件，先写临时文件再替换，避免中断时损坏已有缓存
+        """
+        path = path or self.path
+        if path is None:
+            return
+        with self._lock:
+            entries = dict(self._entries)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, path)
+
+
+symmetryCache = SymmetryCache()
+
+
+def setSymmetryCache(cache: SymmetryCache):
+    """
+    替换进程内共享的对称性缓存，例如加载持久化文件后的缓存
+    """
+    global symmetryCache
+    symmetryCache = cache
+
+
+def getSymmetryCache() -> SymmetryCache:
+    return symmetryCache
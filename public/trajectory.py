@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+@Project    : CalculationExtract
+@File       : trajectory.py
+@Description: 以数组保存的离子步轨迹
+"""
+from typing import List
+
+import numpy as np
+
+from public.composition import Composition
+from public.lattice import Lattice
+from public.sites import Site
+from public.structure import Structure
+from public.tools.helper import parseSetArray
+
+
+class Trajectory:
+    """
+    离子步轨迹，每一步的晶格、分数坐标、受力、应力和能量按步数堆叠为数组
+    只对关键帧(第一步、最后一步以及晶格发生变化的步)构建Structure并做对称性分析
+    """
+
+    def __init__(self, sites: List[Site], composition: List[Composition], lattices, positions,
+                 forces=None, stresses=None, energies=None, cputimes=None):
+        """
+        :param sites: 位点模板，提供每个位点的原子、占据和磁矩
+        :param composition: 组成
+        :param lattices: (nstep, 3, 3)
+        :param positions: 分数坐标 (nstep, nat, 3)
+        :param forces: (nstep, nat, 3)，缺失的步为nan
+        :param stresses: (nstep, 3, 3)，缺失的步为nan
+        :param energies: 每一步的e_fr_energy (nstep,)
+        :param cputimes: 每一步的耗时
+        """
+        self.sites = sites
+        self.composition = composition
+        self.lattices = np.asarray(lattices, dtype=np.float64).reshape(-1, 3, 3)
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(len(self.lattices), -1, 3)
+        nstep, nat = self.positions.shape[:2]
+        self.forces = np.full((nstep, nat, 3), np.nan) if forces is None else np.asarray(forces, dtype=np.float64)
+        self.stresses = np.full((nstep, 3, 3), np.nan) if stresses is None else np.asarray(stresses, dtype=np.float64)
+        self.energies = np.asarray([] if energies is None else energies, dtype=np.float64)
+        self.cputimes = np.asarray([] if cputimes is None else cputimes, dtype=np.float64)
+        self._keyStructures = {}
+
+    def __len__(self):
+        return len(self.lattices)
+
+    @classmethod
+    def fromVasprun(cls, vasprun):
+        """
+        从vasprun.xml的各个calculation中读取离子步，vasprun需已setup
+        """
+        lattices = []
+        positions = []
+        forces = []
+        stresses = []
+        energies = []
+        cputimes = []
+        for calculation in vasprun.root.findall('calculation'):
+            structure = calculation.find('structure')
+            if structure is None:
+                continue
+            lattices.append(parseSetArray(structure.find("./crystal/varray[@name='basis']")))
+            positions.append(parseSetArray(structure.find("./varray[@name='positions']")))
+            nat = len(positions[-1])
+            elem = calculation.find("./varray[@name='forces']")
+            forces.append(parseSetArray(elem) if elem is not None else np.full((nat, 3), np.nan))
+            elem = calculation.find("./varray[@name='stress']")
+            stresses.append(parseSetArray(elem) if elem is not None else np.full((3, 3), np.nan))
+            elem = calculation.find("./energy/i[@name='e_fr_energy']")
+            if elem is not None:
+                energies.append(float(elem.text))
+            for elem in calculation.findall('time'):
+                cputimes.append(float(elem.text.split()[1]))
+        nat = len(vasprun.sites_final)
+        return cls(vasprun.sites_final, vasprun.composition,
+                   np.reshape(lattices, (-1, 3, 3)), np.reshape(positions, (-1, nat, 3)),
+                   np.reshape(forces, (-1, nat, 3)), np.reshape(stresses, (-1, 3, 3)), energies, cputimes)
+
+    def keyFrames(self, tol: float = 1e-8) -> List[int]:
+        """
+        需要做对称性分析的帧: 第一步、最后一步以及晶格与上一步不同的步
+        """
+        if len(self) == 0:
+            return []
+        changed = np.abs(np.diff(self.lattices, axis=0)).max(axis=(1, 2)) > tol
+        frames = {0, len(self) - 1}
+        frames.update((np.flatnonzero(changed) + 1).tolist())
+        return sorted(frames)
+
+    def getStructure(self, step: int) -> Structure:
+        """
+        第step步的结构，每次创建新的Site，不修改模板和其他帧
+        """
+        sites = []
+        for coords, force, template in zip(self.positions[step], self.forces[step], self.sites):
+            site = Site(coords.tolist(), template.atom, None if np.isnan(force).any() else force.tolist())
+            site.set_occupancy(template.Occupancy)
+            site.set_magmom(template.Magmom)
+            sites.append(site)
+        return Structure(lattice=Lattice(self.lattices[step]), composition=self.composition, sites=sites)
+
+    def getKeyStructures(self, tol: float = 1e-8) -> dict:
+        """
+        关键帧的结构文档，结果缓存
+        :return: {步数: structure.to_bson()}
+        """
+        for step in self.keyFrames(tol):
+            if step not in self._keyStructures:
+                structure = self.getStructure(step)
+                structure.setup()
+                self._keyStructures[step] = structure.to_bson()
+        return self._keyStructures
+
+    def getEnergyDiffs(self) -> np.ndarray:
+        return np.diff(self.energies, prepend=0.0)
+
+    def isConverged(self, ediffg: float) -> bool:
+        """
+        离子步收敛判据，EDIFFG为正时比较能量差，为负时比较最后一步的受力
+        """
+        if len(self.energies) == 0 or len(self) == 0:
+            return False
+        if ediffg >= 0:
+            return bool(self.getEnergyDiffs()[-1] <= ediffg)
+        return bool(np.all(np.abs(self.forces[-1]) <= abs(ediffg)))
+
+    def to_bson(self) -> dict:
+        """
+        紧凑的轨迹文档，逐步数据为数组，只有关键帧保存完整的结构文档
+        """
+        def nanToNone(array):
+            # nan(缺失的受力/应力)存为None
+            return np.where(np.isnan(array), None, array).tolist() if np.isnan(array).any() else array.tolist()
+
+        return {
+            'NumberOfSteps': len(self),
+            'Species': [site.atom.atomicsymbol for site in self.sites],
+            'Lattices': self.lattices.tolist(),
+            'Positions': self.positions.tolist(),
+            'Forces': nanToNone(self.forces),
+            'Stresses': nanToNone(self.stresses),
+            'KeyFrames': [{'Step': step, 'Structure': doc} for step, doc in sorted(self.getKeyStructures().items())]
+        }
@@ -18,6 +18,24 @@ def getArgument():
     parser.add_argument('--source', default='vasp', help='data source: vasp, icsd, oqmd, materialproject, etc.')
     parser.add_argument('--root_dir', default='../test_data/39', help='calculation files root path')
     parser.add_argument('--log',action='store_true', default=False, help='if start log ')
+    parser.add_argument('--workers', type=int, default=1, help='number of parsing processes, >1 enables parallel mode')
+    parser.add_argument('--symmetry_cache', default=None, help='json file to persist symmetry analysis between runs')
+    parser.add_argument('--batch_size', type=int, default=100, help='documents per collection written in one insert_many')
+    parser.add_argument('--flush_interval', type=float, default=10.0,
+                        help='seconds after which buffered documents are written even if a batch is not full')
+    parser.add_argument('--incremental', action='store_true', default=False,
+                        help='skip directories unchanged since the last run (manifest_<database>.json in root_dir)')
+    parser.add_argument('--hash', action='store_true', default=False,
+                        help='with --incremental or --parse_cache, compare file md5 when only the mtime changed')
+    parser.add_argument('--scan_workers', type=int, default=8, help='threads used to discover calculation directories')
+    parser.add_argument('--array_encoding', default=None, choices=['raw', 'zlib', 'zstd'],
+                        help='store numeric arrays as typed BSON Binary instead of nested lists')
+    parser.add_argument('--float32_spectra', action='store_true', default=False,
+                        help='with --array_encoding, store DOS and optical spectra in single precision')
+    parser.add_argument('--upsert', action='store_true', default=False,
+                        help='replace documents with the same source path, structure hash and calculation type')
+    parser.add_argument('--parse_cache', default=None, help='directory caching decoded parser outputs between runs')
+    parser.add_argument('--parse_cache_size', type=float, default=10, help='parse cache size limit in GB')
     args = parser.parse_args()
     return args
 
@@ -25,7 +43,9 @@ def getArgument():
 if __name__ == '__main__':
     args = getArgument()
     if args.source == 'vasp':
-        vasp_extract(args.root_dir, args.log)
+        vasp_extract(args.root_dir, args.log, args.workers, args.symmetry_cache, args.batch_size,
+                     args.incremental, args.hash, args.scan_workers, args.array_encoding, args.float32_spectra,
+                     args.upsert, args.parse_cache, args.parse_cache_size, args.flush_interval)
     # 其他数据源 补充
     # elif
     # elif
\ No newline at end of file
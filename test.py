@@ -1,10 +1,19 @@
 
+import os
+import sys
+import tempfile
 import unittest
 import warnings
-from unittest.mock import mock_open, patch
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, mock_open, patch
 import numpy as np
 
 
+from i_o.cache import CachedParser, ParseCache
+from i_o.discovery import discoverPaths
+from i_o.manifest import Manifest, fileHash
+from user_view import _extract_worker, parallel_extract
 from i_o.vasp.doscar import Doscar
 from i_o.vasp.eigenval import Eigenval
 from i_o.vasp.incar import Incar
@@ -12,8 +21,36 @@ from i_o.vasp.oszicar import Oszicar
 from i_o.vasp.outcar import Outcar
 from i_o.vasp.poscar import Poscar
 from i_o.vasp.procar import Procar
+from i_o.vasp.xdatcar import Xdatcar
+from db.mongo.bson import ArrayCodec, decode_document
+from db.mongo.mongo_client import BufferedWriter
+from db.mongo.storage import decode_blob, document_size, encode_blob, join_document, split_document
 from i_o.vasp.chgcar import Chgcar
-
+from public.tools.Electronic import Spin
+from public.tools.optics import opticalConstants, opticalDoc
+from public.tools.helper import parseNumbers, parseTable
+from public.tools.gap import bandGap, batchDosGapDocs, batchGapDocs, dosGapDoc, gapDoc
+
+
+
+def procarText(nkpoints=2, nbands=3, nions=2, nspin=1):
+    """
+    生成lm分解的PROCAR文本，投影值为 spin + kpoint/10 + band/100 + ion/1000 + orbital/10000
+    """
+    orbitals = ['s', 'py', 'pz', 'px', 'dxy', 'dyz', 'dz2', 'dxz', 'x2-y2']
+    lines = ["PROCAR lm decomposed"]
+    for s in range(nspin):
+        lines.append(f"# of k-points:  {nkpoints}         # of bands:  {nbands}         # of ions:  {nions}")
+        for k in range(nkpoints):
+            lines.append(f" k-point {k + 1:5d} :    0.00000000 0.00000000 {k / 10:.8f}     weight = 0.50000000")
+            for b in range(nbands):
+                lines.append(f"band {b + 1:5d} # energy {b - 5.0:14.8f} # occ.  {2.0 if b < 2 else 0.0:.8f}")
+                lines.append("ion " + " ".join(orbitals) + " tot")
+                for i in range(nions):
+                    values = [s + k / 10 + b / 100 + i / 1000 + o / 10000 for o in range(len(orbitals))]
+                    lines.append(f"{i + 1:4d} " + " ".join(f"{v:.4f}" for v in values) + f" {sum(values):.4f}")
+                lines.append("tot " + " ".join("0.0000" for _ in orbitals) + " 0.0000")
+    return "\n".join(lines) + "\n"
 
 
 class TestProcar(unittest.TestCase):
@@ -64,6 +101,29 @@ class TestProcar(unittest.TestCase):
         self.assertEqual(info["IsLmDecomposed"], True)
 
 
+class TestProcarFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "PROCAR")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_projections(self):
+        for nspin in (1, 2):
+            with open(self.path, "w") as f:
+                f.write(procarText(nkpoints=3, nbands=4, nions=2, nspin=nspin))
+            procar = Procar(self.path)
+            self.assertEqual(procar.IsSpinPolarized, nspin == 2)
+            self.assertEqual(procar.projections.shape, (nspin, 3, 4, 2, 9))
+            self.assertEqual(procar.fields[:2], ['s', 'py'])
+            self.assertEqual(procar.KPoints[2], [0.0, 0.0, 0.2])
+            self.assertEqual(procar.eigenvalues[0][1][3], -2.0)
+            # spin, kpoint, band, ion, orbital
+            self.assertAlmostEqual(procar.projections[nspin - 1, 2, 3, 1, 4], nspin - 1 + 0.2 + 0.03 + 0.001 + 0.0004)
+
+
 class TestChgcar(unittest.TestCase):
 
     def setUp(self):
@@ -104,6 +164,26 @@ class TestChgcar(unittest.TestCase):
         # sample too large, wait to be finished
 
 
+class TestChgcarGrid(unittest.TestCase):
+
+    @patch("builtins.open", new_callable=mock_open)
+    def test_grid_fortran_order(self, mock_file):
+        header = ["Si\n", "1.0\n", "5.4 0 0\n", "0 5.4 0\n", "0 0 5.4\n", "Si\n", "1\n", "Direct\n",
+                  "0 0 0\n", "\n", "2 2 2\n"]
+        data = [" 1 2 3 4 5\n", " 6 7 8\n", "augmentation occupancies 1 2\n", " 0.5 0.6\n", " 0.0\n",
+                "2 2 2\n", " -1 -2 -3 -4 -5\n", " -6 -7 -8\n"]
+        mock_file.return_value.readlines.return_value = header + data
+        chgcar = Chgcar("fakefile")
+        info = chgcar.getChgcarInfo()
+        # x变化最快
+        self.assertEqual(info["GRID"][1][0][0], 2.0)
+        self.assertEqual(info["GRID"][0][1][0], 3.0)
+        self.assertEqual(info["GRID"][0][0][1], 5.0)
+        self.assertEqual(len(chgcar.MAGNETIZATION), 1)
+        self.assertEqual(chgcar.MAGNETIZATION[0][1, 1, 1], -8.0)
+        self.assertEqual(chgcar.AUGMENTATION[0][1].tolist(), [0.5, 0.6])
+
+
 class TestDoscar(unittest.TestCase):
 
     def setUp(self):
@@ -133,6 +213,17 @@ class TestDoscar(unittest.TestCase):
             self.assertEqual(info, {})
 
 
+    @patch("builtins.open", new_callable=mock_open)
+    def test_total_only(self, mock_file):
+        # 未设置LORBIT时只有total块
+        mock_file.return_value.readlines.return_value = self.mock_data.splitlines(True)[:307]
+        doscar = Doscar("fakefile")
+        info = doscar.getTotalDos()
+        self.assertEqual(info["NumberOfGridPoints"], 301)
+        self.assertEqual(len(info["Energies"]), 301)
+        self.assertEqual(doscar.partialArray.shape, (0, 301, 0))
+        self.assertEqual(doscar.getPartialDos()["PartialDosData"], [])
+
     @patch("builtins.open", new_callable=mock_open)
     def test_get_totalDos(self, mock_file):
         mock_file.return_value.readlines.return_value = self.mock_data.splitlines()
@@ -182,6 +273,17 @@ class TestEigenval(unittest.TestCase):
         self.assertEqual(info["EigenvalOcc"]["spin 1"][0][0], 1.0)
         # whole list check
 
+    @patch("builtins.open", new_callable=mock_open)
+    def test_get_arrays(self, mock_file):
+        mock_file.return_value.readlines.return_value = self.mock_data.splitlines()
+        eigenval = Eigenval("fakefile")
+        arrays = eigenval.getArrays()
+        self.assertEqual(arrays["eigenvalues"].shape, (2, 180, 32))
+        self.assertEqual(arrays["occupancies"].shape, (2, 180, 32))
+        self.assertEqual(arrays["kpoints"].shape, (180, 3))
+        self.assertEqual(arrays["weights"][0], 0.5555556E-02)
+        self.assertEqual(arrays["eigenvalues"][1, 0, 0], -6.901167)
+
 
 class TestIncar(unittest.TestCase):
 
@@ -279,6 +381,64 @@ class TestOutcar(unittest.TestCase):
         self.assertEqual(info[0][0], {'d': 0.0, 'p': 3.472, 's': 1.569, 'tot': 5.042})
 
 
+def outcarText(nsteps=3, nions=2):
+    """
+    生成包含nsteps个离子步(晶格、应力、位置与受力、自由能)的OUTCAR文本
+    """
+    lines = [" running on   28 total cores"]
+    for step in range(nsteps):
+        for scf in range(2):
+            lines.append(f" E-fermi :   {5.0 + step + scf / 10:.4f}     XC(G=0):  -9.4563     alpha+bet : -6.5307")
+        lines.append("  FORCE on cell =-STRESS in cart. coord.  units (eV):")
+        lines.append("  in kB " + " ".join(f"{step + i / 10:11.5f}" for i in range(6)))
+        lines.append(" direct lattice vectors                 reciprocal lattice vectors")
+        for r in range(3):
+            row = [5.0 + step / 100 if c == r else 0.0 for c in range(3)]
+            lines.append("   " + " ".join(f"{v:12.9f}" for v in row) + "     0.2 0.0 0.0")
+        lines.append(" POSITION                                       TOTAL-FORCE (eV/Angst)")
+        lines.append(" " + "-" * 83)
+        for i in range(nions):
+            lines.append("     " + " ".join(f"{step + i / 10 + c / 100:12.5f}" for c in range(6)))
+        lines.append(" " + "-" * 83)
+        lines.append("  free  energy   TOTEN  =       %.8f eV" % (-10.5 - step / 100))
+    return "\n".join(lines) + "\n"
+
+
+class TestOutcarFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "OUTCAR")
+        with open(self.path, "w") as f:
+            f.write(outcarText())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_efermi(self):
+        # 第一次出现的E-fermi
+        self.assertEqual(Outcar(self.path).getEfermi(), 5.0)
+
+    def test_iter_ionic_steps(self):
+        outcar = Outcar(self.path)
+        steps = list(outcar.iterIonicSteps())
+        self.assertEqual([step['FreeEnergy'] for step in steps], [-10.5, -10.51, -10.52])
+        self.assertEqual(steps[-1]['Lattice'].shape, (3, 3))
+        self.assertEqual(steps[-1]['Lattice'][0, 0], 5.02)
+        self.assertEqual(steps[-1]['Positions'].shape, (2, 3))
+        np.testing.assert_allclose(steps[-1]['Forces'][1], [2.13, 2.14, 2.15])
+        np.testing.assert_allclose(np.diag(steps[1]['Stress']), [1.0, 1.1, 1.2])
+        # 块边界落在数据块中间时结果不变
+        for chunk_size in (64, 200, 1000):
+            small = list(outcar.iterIonicSteps(chunk_size=chunk_size))
+            self.assertEqual(len(small), len(steps))
+            for step, other in zip(steps, small):
+                self.assertEqual(step['FreeEnergy'], other['FreeEnergy'])
+                np.testing.assert_array_equal(step['Lattice'], other['Lattice'])
+                np.testing.assert_array_equal(step['Forces'], other['Forces'])
+                np.testing.assert_array_equal(step['Stress'], other['Stress'])
+
+
 class TestOutcarEL(unittest.TestCase):
 
     def setUp(self):
@@ -325,5 +485,436 @@ class TestPoscar(unittest.TestCase):
         self.assertEqual(poscar.numberOfSites, 48)
 
 
+
+class TestParseNumbers(unittest.TestCase):
+    def test_overflow(self):
+        data = parseNumbers("1.0 ****** -2.5\n-0.1***** 3")
+        self.assertEqual(data.shape, (5,))
+        self.assertTrue(np.isnan(data[1]) and np.isnan(data[3]))
+        self.assertEqual(data[[0, 2, 4]].tolist(), [1.0, -2.5, 3.0])
+        table = parseTable(["1 2 3", "4 ***** 6"], 3)
+        self.assertEqual(table.shape, (2, 3))
+        self.assertTrue(np.isnan(table[1, 1]))
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            parseNumbers("1.0 2.0 abc 4.0")
+
+    def test_truncated_fromstring(self):
+        # numpy 1.24只给出DeprecationWarning并返回截断的数组
+        def fromstring(text, dtype, sep):
+            warnings.warn("string or file could not be read to its end", DeprecationWarning)
+            return np.array([1.0])
+
+        with patch('public.tools.helper.np.fromstring', side_effect=fromstring):
+            with self.assertRaises(ValueError):
+                parseNumbers("1.0 2.0 abc 4.0")
+
+
+class TestGap(unittest.TestCase):
+
+    def test_indirect_gap(self):
+        # 价带顶在第0个k点，导带底在第2个k点
+        eigenvalues = np.array([[[-1.0, 2.0], [-1.5, 1.5], [-2.0, 1.0]]])
+        gap = bandGap(eigenvalues, 0.0)
+        self.assertEqual(gap['VBMKPointIndex'], 0)
+        self.assertEqual(gap['CBMKPointIndex'], 2)
+        self.assertAlmostEqual(gap['Gap'], 2.0)
+        self.assertAlmostEqual(gap['DirectGap'], 3.0)
+        self.assertEqual(gapDoc(eigenvalues, 0.0)['GapType'], "indirect gap")
+        self.assertEqual(gapDoc(eigenvalues, 1.2), {"GapFromBand": "Metal"})
+
+    def test_batch(self):
+        eigenval = Eigenval("testdata/EIGENVAL")
+        eigenvalues = eigenval.getArrays()['eigenvalues']
+        other = np.array([[[-1.0, 2.0], [-1.5, 1.5]], [[-1.2, 2.2], [-1.1, 1.7]]])
+        efermi = [float(np.median(eigenvalues)), 0.0]
+        docs = batchGapDocs([eigenvalues, other], efermi)
+        self.assertEqual(docs, [gapDoc(eigenvalues, efermi[0]), gapDoc(other, efermi[1])])
+
+    def test_dos_gap(self):
+        energies = np.linspace(-2.0, 2.0, 41)
+        dos = np.where(np.abs(energies) < 0.55, 0.05, 1.0)[None]
+        doc = dosGapDoc(energies, dos, 0.0)
+        # 价带边为费米能窗口内第一个态密度为零的格点
+        self.assertAlmostEqual(doc["VBMfromDOS"], 0.0)
+        self.assertAlmostEqual(doc["CBMfromDOS"], 0.6)
+        # 提高视为零的阈值前，费米能附近的态密度不为零
+        self.assertEqual(dosGapDoc(energies, dos, 0.0, dos_tolerance=0.01), {"GapFromDOS": "Metal"})
+        # 自旋向下的导带边低于自旋向上的价带边
+        up = np.where((energies > 0.05) & (energies < 0.55), 0.0, 1.0)
+        down = np.where((energies > -0.15) & (energies < -0.05), 0.0, 1.0)
+        self.assertEqual(dosGapDoc(energies, np.vstack([up, down]), 0.0, energy_tolerance=0.15),
+                         {"GapFromDOS": "Metal"})
+        docs = batchDosGapDocs([energies, energies[:30]], [dos, dos[:, :30]], [0.0, 0.0])
+        self.assertEqual(docs, [doc, dosGapDoc(energies[:30], dos[:, :30], 0.0)])
+
+
+
+class TestOptics(unittest.TestCase):
+
+    def test_optical_constants(self):
+        energy = np.linspace(0.0, 10.0, 5)
+        real = np.ones((5, 6))
+        imag = np.zeros((5, 6))
+        imag[:, 0] = 2.0
+        constants = opticalConstants(energy, real, imag)
+        self.assertEqual(constants['RefractiveIndex'].shape, (5, 6))
+        # 介电函数为1时折射率为1，消光系数与反射率为0
+        np.testing.assert_allclose(constants['RefractiveIndex'][:, 1:], 1.0)
+        np.testing.assert_allclose(constants['ReflectivityCoefficient'][:, 1:], 0.0)
+        # n + ik 的平方等于介电函数
+        n, k = constants['RefractiveIndex'][:, 0], constants['ExtinctionIndex'][:, 0]
+        np.testing.assert_allclose(n * n - k * k, 1.0)
+        np.testing.assert_allclose(2 * n * k, 2.0)
+        doc = opticalDoc(energy, real, imag, 'density-density')
+        self.assertEqual(doc['Method'], 'density-density')
+        self.assertEqual(doc['NumberofEnergyPoints'], 5)
+
+
+class TestXdatcar(unittest.TestCase):
+
+    def setUp(self):
+        # 变胞轨迹: 每帧之前都有头部，最后一帧被截断
+        header = "Si\n 1.0\n {0} 0 0\n 0 {0} 0\n 0 0 {0}\n Si\n 2\n"
+        frame = "Direct configuration= {0}\n 0.{0} 0 0\n 0.5 0.5 0.{0}\n"
+        text = "".join(header.format(4 + i) + frame.format(i + 1) for i in range(5))
+        with tempfile.NamedTemporaryFile("w", suffix="XDATCAR", delete=False) as file:
+            file.write(text + header.format(9) + "Direct configuration= 6\n 0.1 0")
+        self.filename = file.name
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_get_frame(self):
+        xdatcar = Xdatcar(self.filename)
+        self.assertEqual(xdatcar.natoms, 2)
+        lattice, positions = xdatcar.getFrame(2)
+        np.testing.assert_allclose(lattice, np.eye(3) * 6)
+        np.testing.assert_allclose(positions, [[0.3, 0, 0], [0.5, 0.5, 0.3]])
+        self.assertTrue(xdatcar.isVariableCell)
+        self.assertEqual(len(xdatcar), 5)
+        np.testing.assert_allclose(xdatcar.getFrame(-1)[0], np.eye(3) * 8)
+        with self.assertRaises(IndexError):
+            xdatcar.getFrame(5)
+        xdatcar.close()
+
+    def test_iter_batches(self):
+        xdatcar = Xdatcar(self.filename)
+        batches = list(xdatcar.iterBatches(batch_size=2))
+        self.assertEqual([len(lattices) for lattices, positions in batches], [2, 2, 1])
+        positions = np.concatenate([positions for lattices, positions in batches])
+        np.testing.assert_allclose(positions[:, 0, 0], [0.1, 0.2, 0.3, 0.4, 0.5])
+        self.assertEqual(len(list(xdatcar.iterFrames(start=1, stop=3))), 2)
+        xdatcar.close()
+
+
+class TestStorage(unittest.TestCase):
+
+    def test_split_document(self):
+        import bson
+        doc = {"CalculationType": "BandStructure", "Count": 2 ** 40, "Flag": True, "Note": None,
+               "Properties": {"Gap": 1.2, "Eigenvalues": np.arange(60000.).reshape(3, -1).tolist(),
+                              "Dos": {"Energies": list(range(1000)), "Fermi": -1.0}}}
+        self.assertEqual(document_size(doc), len(bson.encode(doc)))
+        blobs = {}
+
+        def put(value, path):
+            blobs[path] = encode_blob(value)
+            return bson.ObjectId()
+
+        split = split_document(doc, put, limit=100 * 1024)
+        # 只拆分最大的数组，标量和较小的数组保留在文档中
+        self.assertEqual(list(blobs), ["Properties.Eigenvalues"])
+        self.assertLessEqual(len(bson.encode(split)), 100 * 1024)
+        self.assertEqual(split["Properties"]["Gap"], 1.2)
+        self.assertIsInstance(doc["Properties"]["Eigenvalues"], list)
+        joined = join_document(split, lambda file_id: decode_blob(blobs["Properties.Eigenvalues"]))
+        self.assertEqual(joined, doc)
+        self.assertIs(split_document(doc, put), doc)
+
+    def test_list_size(self):
+        import bson
+        values = [np.arange(24.).reshape(2, 3, 4).tolist(), [[1.0, 2.0], [3.0]], [[1, 2.0], [True, None, "x"]],
+                  list(range(1200)), [2 ** 40, -3], [[], [[]]], [(1.0, 2.0)] * 123, [[[1.0, "a"]] * 3] * 4, []]
+        for value in values:
+            self.assertEqual(document_size({"Data": value}), len(bson.encode({"Data": value})))
+
+    def test_array_codec(self):
+        import bson
+        doc = {"Properties": {"EigenValues": np.arange(600.).reshape(2, 30, 10).tolist(),
+                              "TotalDos": {"Energies": np.linspace(-5, 5, 301).tolist()},
+                              "Sites": [{"Position": [0.5, 0.5, 0.5]}], "Gap": 1.2}}
+        codec = ArrayCodec("zlib", float32_fields={"TotalDos"})
+        encoded = codec.encode(doc)
+        self.assertLess(len(bson.encode(encoded)), len(bson.encode(doc)))
+        decoded = decode_document(bson.decode(bson.encode(encoded)))
+        np.testing.assert_array_equal(decoded["Properties"]["EigenValues"], doc["Properties"]["EigenValues"])
+        energies = decoded["Properties"]["TotalDos"]["Energies"]
+        self.assertEqual(energies.dtype, np.float32)
+        np.testing.assert_allclose(energies, doc["Properties"]["TotalDos"]["Energies"], atol=1e-6)
+        # 较短的数组和标量保持不变
+        self.assertEqual(decoded["Properties"]["Sites"], doc["Properties"]["Sites"])
+        self.assertEqual(decoded["Properties"]["Gap"], 1.2)
+
+    def test_buffered_writer_batches(self):
+        conns = {"StaticCalculation": MagicMock(), "BandStructure": MagicMock()}
+        mongo = MagicMock(client={"VaspData": conns})
+        for conn in conns.values():
+            conn.insert_many.side_effect = lambda docs, ordered: MagicMock(inserted_ids=list(range(len(docs))))
+        writer = BufferedWriter(mongo, "VaspData", batch_size=2, flush_interval=1000)
+        writer.add({"n": 1}, "StaticCalculation")
+        writer.add({"n": 2}, "BandStructure")
+        conns["StaticCalculation"].insert_many.assert_not_called()
+        # 每个集合单独计数，达到batch_size时只写入该集合
+        writer.add({"n": 3}, "StaticCalculation")
+        conns["StaticCalculation"].insert_many.assert_called_once_with([{"n": 1}, {"n": 3}], ordered=False)
+        conns["BandStructure"].insert_many.assert_not_called()
+        writer.flush()
+        conns["BandStructure"].insert_many.assert_called_once_with([{"n": 2}], ordered=False)
+        self.assertEqual(writer.inserted, 3)
+
+    def test_buffered_writer_errors(self):
+        from pymongo.errors import BulkWriteError
+        mongo = MagicMock()
+        conn = mongo.client["VaspData"]["StaticCalculation"]
+        conn.insert_many.side_effect = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "document too large"}],
+                                                       "nInserted": 2})
+        errors = []
+        with BufferedWriter(mongo, "VaspData", batch_size=10, on_error=lambda key, error: errors.append((key, error))) \
+                as writer:
+            for key in ("/data/1", "/data/2", "/data/3"):
+                writer.add({"SourcePath": key}, "StaticCalculation", key=key)
+        # 无序写入时只有writeErrors中的文档失败
+        self.assertEqual(errors, [("/data/2", "document too large")])
+        self.assertEqual((writer.inserted, writer.failed), (2, 1))
+        conn.insert_many.side_effect = RuntimeError("connection lost")
+        failures = writer.add({"SourcePath": "/data/4"}, "StaticCalculation", key="/data/4") + writer.flush()
+        self.assertEqual(failures, [("/data/4", "RuntimeError: connection lost")])
+        self.assertEqual(errors[-1], failures[0])
+
+    def test_buffered_writer_flush_interval(self):
+        mongo = MagicMock()
+        conn = mongo.client["VaspData"]["StaticCalculation"]
+        conn.insert_many.return_value.inserted_ids = [0]
+        with patch("db.mongo.mongo_client.time.monotonic", return_value=100.0) as clock:
+            writer = BufferedWriter(mongo, "VaspData", batch_size=100, flush_interval=5)
+            writer.add({"n": 1}, "StaticCalculation")
+            clock.return_value = 104.0
+            self.assertEqual(writer.flush_due(), [])
+            conn.insert_many.assert_not_called()
+            # 没有新文档时也由flush_due按时写入
+            clock.return_value = 105.0
+            writer.flush_due()
+            conn.insert_many.assert_called_once_with([{"n": 1}], ordered=False)
+            writer.add({"n": 2}, "StaticCalculation")
+            clock.return_value = 110.0
+            writer.add({"n": 3}, "StaticCalculation")
+            self.assertEqual(conn.insert_many.call_args[0][0], [{"n": 2}, {"n": 3}])
+
+    def test_upsert_writer(self):
+        mongo = MagicMock()
+        conn = mongo.client["VaspData"]["StaticCalculation"]
+        conn.bulk_write.return_value.upserted_count = 1
+        conn.bulk_write.return_value.matched_count = 1
+        doc = {"SourcePath": "/data/1", "InputStructure": {"HashValue": "abc"}, "CalculationType": "static"}
+        with BufferedWriter(mongo, "VaspData", upsert=True) as writer:
+            writer.add(doc, "StaticCalculation", key="/data/1")
+            writer.add({"SourcePath": "/data/2"}, "StaticCalculation", key="/data/2")
+        requests = conn.bulk_write.call_args[0][0]
+        self.assertEqual(requests[0]._filter, {"SourcePath": "/data/1", "InputStructure.HashValue": "abc",
+                                               "CalculationType": "static"})
+        self.assertEqual(requests[1]._filter["InputStructure.HashValue"], None)
+        self.assertEqual((writer.inserted, writer.replaced), (1, 1))
+        conn.insert_many.assert_not_called()
+
+    def test_gridfs_cleanup(self):
+        from pymongo.errors import BulkWriteError
+        mongo = MagicMock()
+        conn = mongo.client["VaspData"]["StaticCalculation"]
+        old = {"SourcePath": "/data/1", "InputStructure": {"HashValue": "abc"}, "CalculationType": "static",
+               "GridFSFiles": ["old1", "old2"]}
+        conn.find.return_value = [old]
+        conn.bulk_write.side_effect = BulkWriteError({"writeErrors": [{"index": 1, "errmsg": "duplicate"}],
+                                                      "nUpserted": 0, "nMatched": 1})
+        docs = [dict(old, GridFSFiles=["new1"]), {"SourcePath": "/data/2", "GridFSFiles": ["new2"]}]
+        with BufferedWriter(mongo, "VaspData", upsert=True) as writer:
+            for doc in docs:
+                writer.add(doc, "StaticCalculation", key=doc["SourcePath"])
+        # 替换成功的文档删除原文档的文件，写入失败的文档删除本次写入的文件
+        mongo.delete_files.assert_called_once_with("VaspData", ["new2", "old1", "old2"])
+        self.assertEqual(conn.find.call_args[0][0]["$or"][1]["SourcePath"], "/data/2")
+        conn.insert_many.side_effect = RuntimeError("connection lost")
+        writer = BufferedWriter(mongo, "VaspData")
+        writer.add(docs[0], "StaticCalculation")
+        writer.flush()
+        mongo.delete_files.assert_called_with("VaspData", ["new1"])
+
+    def test_encode_spectra_arrays(self):
+        import bson
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "PROCAR")
+            with open(path, "w") as f:
+                f.write(procarText(nkpoints=4, nbands=8, nions=3))
+            procar = Procar(path)
+        info = procar.getProjectedEigenvalOnIonOrbitals(True)
+        # spin -> (ion, kpoint, band, orbital)，不经过list直接编码
+        self.assertIs(info["Data"][Spin.up].base, procar.projections)
+        encoded = ArrayCodec("zlib").encode({"ProjectedEigenVal_on_IonOrbitals": info["Data"][Spin.up]})
+        decoded = decode_document(bson.decode(bson.encode(encoded)))["ProjectedEigenVal_on_IonOrbitals"]
+        np.testing.assert_array_equal(decoded, np.transpose(procar.projections[0], (2, 0, 1, 3)))
+        self.assertEqual(procar.getProjectedEigenvalOnIonOrbitals()["Data"][Spin.up][2][1][3]["pz"],
+                         decoded[2, 1, 3, 2])
+        energy = np.linspace(0.1, 5, 300)
+        real = np.ones((300, 6))
+        doc = opticalDoc(energy, real, real * 0.5, asarray=True)
+        self.assertIs(doc["Energies"], energy)
+        self.assertIn("NDArray", ArrayCodec("zlib").encode(doc)["RefractiveIndex"]["Data"])
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def test_discover_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            expected = set()
+            for i in range(5):
+                for j in range(4):
+                    path = os.path.join(directory, f"a{i}", f"b{j}")
+                    os.makedirs(path)
+                    if j % 2 == 0:
+                        open(os.path.join(path, "INCAR"), "w").close()
+                        expected.add(path)
+            self.assertEqual(set(discoverPaths(directory, {"INCAR"}, workers=4)), expected)
+            # 提前关闭生成器
+            paths = discoverPaths(directory, {"INCAR"}, workers=4)
+            self.assertIn(next(paths), expected)
+            paths.close()
+
+
+class TestParallelExtract(unittest.TestCase):
+
+    class FakePool:
+        """
+        同步执行的进程池，目录名为crash时任务以BrokenProcessPool结束
+        """
+
+        def __init__(self, *args):
+            self.submitted = []
+
+        def submit(self, fn, file, collections, codec, hash_files=None):
+            self.submitted.append(file)
+            future = Future()
+            if file == "crash":
+                future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+            else:
+                future.set_result(fn(file, collections, codec, hash_files))
+            return future
+
+        def shutdown(self, wait=True):
+            pass
+
+    @staticmethod
+    def extract(file, collections, codec=None):
+        return "StaticCalculation", {"SourcePath": file}
+
+    def test_broken_pool(self):
+        pools = []
+
+        def create_pool(*args):
+            pools.append(self.FakePool())
+            return pools[-1]
+
+        error_files = {"no_take": [], "error": []}
+        with patch("user_view._create_pool", side_effect=create_pool), patch("user_view.extract_directory",
+                                                                             side_effect=self.extract), \
+                patch("user_view.save_document") as save, open(os.devnull, "w") as out:
+            parallel_extract(["a", "crash", "b"], ["StaticCalculation"], MagicMock(flush_interval=10.0), 1, error_files, out)
+        # 崩溃的目录重试一次后记为错误，每次崩溃后换用新的进程池，其余目录正常入库
+        self.assertEqual(error_files["error"], ["crash"])
+        self.assertEqual(sorted(call.args[1]["SourcePath"] for call in save.call_args_list), ["a", "b"])
+        self.assertEqual(len(pools), 3)
+        self.assertEqual(sum(pool.submitted.count("crash") for pool in pools), 2)
+
+    def test_manifest_hashes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a")
+            os.makedirs(path)
+            with open(os.path.join(path, "INCAR"), "w") as f:
+                f.write("ISPIN = 2\n")
+            manifest = Manifest(os.path.join(directory, "manifest.json"), {"INCAR"}, use_hash=True)
+            self.assertTrue(manifest.changed(path, ["StaticCalculation"]))
+            # md5在解析该目录的子进程中计算，随结果返回
+            result = _extract_worker(path, ["StaticCalculation"], None, manifest.hashFiles(path))
+            self.assertEqual(result[-1], {"INCAR": fileHash(os.path.join(path, "INCAR"))})
+            with patch("user_view._create_pool", side_effect=self.FakePool), \
+                    patch("user_view.extract_directory", side_effect=self.extract), \
+                    patch("user_view.save_document"), patch.object(manifest, "done", wraps=manifest.done) as done:
+                parallel_extract([path], ["StaticCalculation"], MagicMock(flush_interval=10.0), 1, {"no_take": [], "error": []},
+                                 sys.stdout, manifest=manifest)
+            done.assert_called_once_with(path, result[-1])
+            self.assertEqual(manifest.entries[path]["files"]["INCAR"][2], result[-1]["INCAR"])
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "DOSCAR")
+        with open(self.source, "w") as file:
+            file.write("data")
+        self.calls = 0
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def factory(self, path):
+        self.calls += 1
+        parser = MagicMock()
+        parser.getTotalDos.return_value = {"Energies": np.linspace(0, 1, 100).tolist(), "Spin": (1, "up"),
+                                           "Array": np.eye(3), "Efermi": 0.5}
+        return parser
+
+    def test_cached_parser(self):
+        cache = ParseCache(os.path.join(self.directory, "cache"))
+        first = CachedParser(self.factory, self.source, cache, ["getTotalDos"]).getTotalDos()
+        parser = CachedParser(self.factory, self.source, cache, ["getTotalDos"])
+        second = parser.getTotalDos()
+        # 命中缓存时不创建解析器
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(second["Energies"], first["Energies"])
+        self.assertEqual(second["Spin"], (1, "up"))
+        np.testing.assert_array_equal(second["Array"], np.eye(3))
+        # 源文件变化后缓存失效
+        with open(self.source, "w") as file:
+            file.write("changed")
+        parser.getTotalDos()
+        self.assertEqual(self.calls, 2)
+
+    def test_keyword_arguments(self):
+        cache = ParseCache(os.path.join(self.directory, "cache"))
+        parser = CachedParser(self.factory, self.source, cache, ["getTotalDos"])
+        # 关键字参数不缓存，直接交给解析器
+        parser.getTotalDos(asarray=True)
+        parser.parser.getTotalDos.assert_called_once_with(asarray=True)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        parser.getTotalDos(True)
+        parser.getTotalDos(True)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_evict(self):
+        cache = ParseCache(os.path.join(self.directory, "cache"), max_bytes=10 ** 9)
+        for n in range(4):
+            cache.put(self.source, "getTotalDos", (n,), np.zeros(1000))
+            os.utime(cache.cacheFile(self.source, "getTotalDos", (n,)), ns=(n * 10 ** 9, n * 10 ** 9))
+        size = os.path.getsize(cache.cacheFile(self.source, "getTotalDos", (0,)))
+        cache.max_bytes = 2 * size
+        cache.evict(target=2 * size)
+        # 最早使用的两个被淘汰
+        self.assertEqual([cache.get(self.source, "getTotalDos", (n,))[0] for n in range(4)],
+                         [False, False, True, True])
+
+
 if __name__ == "__main__":
     unittest.main()
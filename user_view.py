@@ -12,6 +12,7 @@ import sys
 import time
 import json
 
+from db.mongo.bson import ArrayCodec, SPECTRA_FIELDS
 from db.mongo.mongo_client import Mongo
 from entries.calculations import CalculateEntries
 from i_o.vasp.chgcar import Chgcar
@@ -27,19 +28,89 @@ from i_o.vasp.locpot import Locpot
 from i_o.vasp.procar import Procar
 from i_o.vasp.vasprun import Vasprun
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
 from tqdm import tqdm
 
+from i_o.cache import ParseCache, getParseCache, setParseCache
+from i_o.discovery import cachedDiscoverPaths
+from i_o.manifest import Manifest, fileHashes
+from i_o.registry import ParserRegistry
 from i_o.vasp.xdatcar import Xdatcar
 from public.calculation_type import CalType
+from public.tools.symmetry_cache import SymmetryCache, getSymmetryCache, setSymmetryCache
 
-input_files = {'INCAR', 'KPOINTS', 'OSZICAR', 'OUTCAR', 'POSCAR', 'vasprun.xml''XDATCAR', 'DOSCAR',
+input_files = {'INCAR', 'KPOINTS', 'OSZICAR', 'OUTCAR', 'POSCAR', 'vasprun.xml', 'XDATCAR', 'DOSCAR',
                'PROCAR', 'ELFCAR', 'CHGCAR', 'EIGENVAL'}
+# 超过该大小的vasprun.xml使用流式解析
+streaming_size = 512 * 1024 * 1024
+# 进程池崩溃时，同一目录最多提交的次数
+MAX_POOL_ATTEMPTS = 2
 
 
-def vasp_extract(root_path: str, log):
+def create_vasprun(path):
+    vasprun = Vasprun(path, streaming=get_file_size(path) > streaming_size)
+    vasprun.setup()
+    return vasprun
+
+
+# 文件名(大写) -> (file_parsers中的键名, 解析器)
+parser_factories = {
+    'INCAR': ('incar', Incar),
+    'VASPRUN.XML': ('vasprun', create_vasprun),
+    'POSCAR': ('poscar', Poscar),
+    'OUTCAR': ('outcar', Outcar),
+    'LOCPOT': ('locpot', Locpot),
+    'KPOINTS': ('kpoints', Kpoints),
+    'OSZICAR': ('oszicar', Oszicar),
+    'XDATCAR': ('xdatcar', Xdatcar),
+    'DOSCAR': ('doscar', Doscar),
+    'PROCAR': ('procar', Procar),
+    'ELFCAR': ('elfcar', Elfcar),
+    'CHGCAR': ('chgcar', Chgcar),
+    'EIGENVAL': ('eigenval', Eigenval),
+}
+# 需要解析(并统计大小)的文件
+parser_files = set(parser_factories)
+# 注册前的完整性检查，被截断的vasprun.xml不解析，结构和离子步改由POSCAR、OUTCAR提供
+parser_checks = {
+    'vasprun': Vasprun.isComplete,
+}
+# 使用解析结果缓存时，各解析器中返回值只由文件内容决定的方法
+cached_methods = {
+    'vasprun': ('getHeader', 'getStructureDocs', 'getFinalEnergy', 'getEfermi', 'getEigenValues',
+                'getEigenValueArrays', 'getProjectedEigenvalOnIonOrbitals', 'getTotalDos', 'getPartialDos',
+                'getDielectricArrays', 'getElectronicSteps'),
+    'outcar': ('getResourceUsage', 'getAtomicChargeAndAtomicMagnetization', 'getElasticProperties', 'getEfermi'),
+    'procar': ('getEigenValues', 'getProjectedEigenvalOnIonOrbitals'),
+    'doscar': ('getTotalDos', 'getPartialDos'),
+    'eigenval': ('getEigenValues',),
+    'chgcar': ('getChgcarInfo',),
+    'oszicar': ('getLinearMagneticMoment', 'getElectronicSteps', 'getIonicSteps'),
+}
+
+
+def vasp_extract(root_path: str, log, workers: int = 1, symmetry_cache: str = None, batch_size: int = 100,
+                 incremental: bool = False, use_hash: bool = False, scan_workers: int = 8,
+                 array_encoding: str = None, float32_spectra: bool = False, upsert: bool = False,
+                 parse_cache: str = None, parse_cache_size: float = 10, flush_interval: float = 10.0):
     """
 
     :param root_path:
+    :param log:
+    :param workers: 大于1时使用进程池并行解析
+    :param symmetry_cache: 对称性缓存文件路径，为None时只在本次运行中缓存
+    :param batch_size: 每个集合批量写入的文档数
+    :param incremental: 增量模式，跳过自上次入库后文件未变化的目录
+    :param use_hash: 增量模式下文件修改时间变化时再比较内容md5
+    :param scan_workers: 目录发现的线程数
+    :param array_encoding: 数值数组的保存方式，None时保存为list，'raw'、'zlib'或'zstd'时保存为BSON Binary
+    :param float32_spectra: 数组以Binary保存时，DOS和光学谱以单精度保存
+    :param upsert: 按(SourcePath, 结构HashValue, CalculationType)替换已有文档，重复提取不产生重复文档
+    :param parse_cache: 解析结果缓存目录，为None时不缓存；use_hash同样用于判断缓存是否失效
+    :param parse_cache_size: 解析结果缓存的大小上限(GB)
+    :param flush_interval: 批量未满时，距上次写入超过该秒数也写入缓存的文档
     :return:
     """
     print(os.getcwd())
@@ -78,16 +149,34 @@ def vasp_extract(root_path: str, log):
         with open(path_list_file, 'r', encoding='utf8') as f:
             file_list = json.load(f)
     else:
-        file_list = findPaths(root_path)
-        with open(path_list_file, 'w', encoding='utf8') as f:
-            json.dump(file_list, f)
+        # 边发现边解析，目录列表逐行写入path_list.txt
+        file_list = cachedDiscoverPaths(root_path, input_files, os.path.join(root_path, 'path_list.txt'),
+                                        workers=scan_workers)
     print('Files Dir：', root_path)
-    print('Files Number：', len(file_list))
+    if isinstance(file_list, list):
+        print('Files Number：', len(file_list))
+    manifest = None
+    if incremental:
+        manifest = Manifest(os.path.join(root_path, f'manifest_{database}.json'), parser_files, use_hash=use_hash)
+        file_list = (file for file in file_list if manifest.changed(file, collections))
     print('User：', user)
     print('Group：', group)
     print('Database：', database)
     print('Collections：', collections)
     print('host & port：', host, ' ', port)
+    print('Workers：', workers)
+    print('Upsert：', upsert)
+    codec = None
+    if array_encoding is not None:
+        codec = ArrayCodec(None if array_encoding == 'raw' else array_encoding,
+                           float32_fields=SPECTRA_FIELDS if float32_spectra else ())
+        print('Array encoding：', array_encoding, '(float32 spectra)' if float32_spectra else '')
+    setSymmetryCache(SymmetryCache(symmetry_cache))
+    parse_cache_args = None
+    if parse_cache is not None:
+        parse_cache_args = (parse_cache, int(parse_cache_size * 1024 ** 3), use_hash)
+        setParseCache(ParseCache(*parse_cache_args))
+        print('Parse cache：', parse_cache)
     error_files = {'no_take': [], 'error': []}
     if log:
         outfile_path = os.path.join(os.getcwd(), 'log', database + '_' + user + '_' + group + '_' + s + '.txt')
@@ -96,188 +185,243 @@ def vasp_extract(root_path: str, log):
         outFile = sys.stdout
     # 找到所有的vasp计算文件夹
     mongo = Mongo(host=host, port=port)
-    for file in tqdm(file_list, total=len(file_list)):
-        # 遍历文件夹，获取所有的vasp计算文件
-        # 根据文件名创建 解析类，对文件进行解析
-        # 保存在字典格式中 {'incar': Incar(), 'poscar': Poscar(), 'outcar': Outcar(), 'locpot': Locpot()}
-        # try:
-        #     file_parsers = {}
-        # # 遍历目录中所有文件
-        #     for file_name in os.listdir(file):
-        #         full_path = os.path.join(file, file_name)
-        #         if file_name.upper() == 'INCAR':
-        #             file_parsers['incar'] = Incar(full_path)
-        #         elif file_name.lower() == 'vasprun.xml':
-        #             file_parsers['vasprun'] = Vasprun(full_path)
-        #      # 从名字或Incar 和 Vasprun对象中获取计算类型，优先名字
-        #     parm = {}
-        #     if 'vasprun' in file_parsers and 'incar' in file_parsers:
-        #         parm = file_parsers['vasprun'].parameters
-        #         parm = file_parsers['incar'].fill_parameters(parm)
-        #     elif 'vasprun' in file_parsers:
-        #         parm = file_parsers['vasprun'].parameters
-        #     elif 'incar' in file_parsers:
-        #         parm = file_parsers['incar'].fill_parameters(parm)
-        #     else:
-        #         raise ValueError(
-        #         f"INCAR or vasprun.xml file is required to determine the calculation type in directory {file}")
-        #     cal_type = CalType.from_parameters(file, collections, parm)
-        #     for file_name in os.listdir(file):
-        #         full_path = os.path.join(file, file_name)
-        #         if file_name.upper() == 'POSCAR':
-        #             file_parsers['poscar'] = Poscar(full_path)
-        #         elif file_name.upper() == 'OUTCAR':
-        #             file_parsers['outcar'] = Outcar(full_path)
-        #         elif file_name.upper() == 'LOCPOT':
-        #             file_parsers['locpot'] = Locpot(full_path)
-        #         elif file_name.upper() == 'KPOINTS':
-        #             file_parsers['kpoints'] = Kpoints(full_path)
-        #         elif file_name.upper() == 'OSZICAR':
-        #             file_parsers['oszicar'] = Oszicar(full_path)
-        #         elif file_name.upper() == 'XDATCAR':
-        #             file_parsers['xdatcar'] = Xdatcar(full_path)
-        #         elif file_name.upper() == 'DOSCAR':
-        #             file_parsers['doscar'] = Doscar(full_path)
-        #         elif file_name.upper() == 'PROCAR':
-        #             file_parsers['procar'] = Procar(full_path)
-        #         elif file_name.upper() == 'ELFCAR':
-        #             file_parsers['elfcar'] = Elfcar(full_path)
-        #         elif file_name.upper() == 'CHGCAR':
-        #             file_parsers['chgcar'] = Chgcar(full_path)
-        #         elif file_name.upper() == 'EIGENVAL':
-        #             file_parsers['eigenval'] = Eigenval(full_path)
-        #     # 根据计算类型创建计算对象
-        #     cal_entry = CalculateEntries[cal_type](file_parsers)
-        #     bson = cal_entry.to_bson()
-        #     # 保存到数据库
-        #     size = get_deep_size(bson)
-        #     if size<16*1024*1024:
-        #         id = mongo.save_one(bson, database, cal_type)
-        #     else:
-        #         if 'Properties' in bson:
-        #             properties = bson['Properties']
-        #             file_id = mongo.save_large(properties,database)
-        #             bson['Properties']=file_id
-        #         id = mongo.save_one(bson, database, cal_type)
-        # except ValueError as e:
-        #     error_message = str(e)
-        #    if ("INCAR or vasprun.xml file is required to determine the calculation type" in error_message or
-        #         "不可同时无vasprun或poscar和incar" in error_message or
-        #         "无法判断提取类型，无法提取" in error_message or "File content error, not parse!" in error_message):
-        #         continue
-        #     else:
-        #         print(file, ' ', e, file=outFile)
-        #         print(file, ' ', e)
-        #         error_files['error'].append(file)
-        #         continue
-        # except KeyError as e:
-        #     print(file, ' ', e, file=outFile)
-        #     print(file, ' ', e)
-        #     error_files['error'].append(file)
-        #     continue
-        # except Exception as e:
-        #     error_files['error'].append(file)
-        #     print(file, ' ', e)
-        #     print(file, ' ', e, file=outFile)
-        #     continue
-        file_parsers = {}
-        # 遍历目录中所有文件
-        total_size = 0
-        for file_name in os.listdir(file):
-            full_path = os.path.join(file, file_name)
-            if file_name.upper() == 'INCAR':
-                total_size+=get_file_size(full_path)
-            elif file_name.lower() == 'vasprun.xml':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'POSCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'OUTCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'LOCPOT':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'KPOINTS':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'OSZICAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'XDATCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'DOSCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'PROCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'ELFCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'CHGCAR':
-                total_size += get_file_size(full_path)
-            elif file_name.upper() == 'EIGENVAL':
-                total_size += get_file_size(full_path)
-        print(total_size)
-        if total_size > 20000 * 1024 * 1024:
-
-            raise ValueError("File too big")
-        for file_name in os.listdir(file):
-            full_path = os.path.join(file, file_name)
-            if file_name.upper() == 'INCAR':
-                file_parsers['incar'] = Incar(full_path)
-            elif file_name.lower() == 'vasprun.xml':
-                file_parsers['vasprun'] = Vasprun(full_path)
-                file_parsers['vasprun'].setup()
-                # 从名字或Incar 和 Vasprun对象中获取计算类型，优先名字
-        parm = {}
-        if 'vasprun' in file_parsers and 'incar' in file_parsers:
-            parm = file_parsers['vasprun'].parameters
-            parm = file_parsers['incar'].fill_parameters(parm)
-        elif 'vasprun' in file_parsers:
-            parm = file_parsers['vasprun'].parameters
-        elif 'incar' in file_parsers:
-            parm = file_parsers['incar'].fill_parameters(parm)
-        else:
-            raise ValueError(
-                f"INCAR or vasprun.xml file is required to determine the calculation type")
-        cal_type = CalType.from_parameters(file, collections, parm)
-        for file_name in os.listdir(file):
-            full_path = os.path.join(file, file_name)
-            if file_name.upper() == 'POSCAR':
-                file_parsers['poscar'] = Poscar(full_path)
-            elif file_name.upper() == 'OUTCAR':
-                file_parsers['outcar'] = Outcar(full_path)
-            elif file_name.upper() == 'LOCPOT':
-                file_parsers['locpot'] = Locpot(full_path)
-            elif file_name.upper() == 'KPOINTS':
-                file_parsers['kpoints'] = Kpoints(full_path)
-            elif file_name.upper() == 'OSZICAR':
-                file_parsers['oszicar'] = Oszicar(full_path)
-            elif file_name.upper() == 'XDATCAR':
-                file_parsers['xdatcar'] = Xdatcar(full_path)
-            elif file_name.upper() == 'DOSCAR':
-                file_parsers['doscar'] = Doscar(full_path)
-            elif file_name.upper() == 'PROCAR':
-                file_parsers['procar'] = Procar(full_path)
-            elif file_name.upper() == 'ELFCAR':
-                file_parsers['elfcar'] = Elfcar(full_path)
-            elif file_name.upper() == 'CHGCAR':
-                file_parsers['chgcar'] = Chgcar(full_path)
-            elif file_name.upper() == 'EIGENVAL':
-                file_parsers['eigenval'] = Eigenval(full_path)
-        # 根据计算类型创建计算对象
-        cal_entry = CalculateEntries[cal_type](file_parsers)
-        bson = cal_entry.to_bson()
-        # 保存到数据库
-        size = get_deep_size(bson)
-        if size<16*1024*1024:
-            id = mongo.save_one(bson, database, cal_type)
-        else:
-            if 'Properties' in bson:
-                properties = bson['Properties']
-                file_id = mongo.save_large(properties,database)
-                bson['Properties']=file_id
-            id = mongo.save_one(bson, database, cal_type)
+    mongo.ensure_indexes(database, collections)
+
+    def on_error(path, error):
+        record_error(path, error, error_files, outFile)
+        if manifest is not None:
+            manifest.discard(path)
 
+    try:
+        with mongo.buffered(database, batch_size=batch_size, flush_interval=flush_interval, on_error=on_error,
+                            upsert=upsert) as writer:
+            if workers > 1:
+                parallel_extract(file_list, collections, writer, workers, error_files, outFile, symmetry_cache,
+                                 manifest, codec, parse_cache_args)
+            else:
+                for file in tqdm(file_list):
+                    # 遍历文件夹，获取所有的vasp计算文件
+                    # 根据文件名创建 解析类，对文件进行解析
+                    # 保存在字典格式中 {'incar': Incar(), 'poscar': Poscar(), 'outcar': Outcar(), 'locpot': Locpot()}
+                    cal_type, bson = extract_directory(file, collections, codec)
+                    # 计算类型不在选择的集合中时跳过
+                    if bson is not None:
+                        save_document(writer, bson, cal_type, file)
+                    else:
+                        error_files['no_take'].append(file)
+                    if manifest is not None:
+                        manifest.done(file)
+    finally:
+        # 中断时也保存已入库目录的指纹
+        if manifest is not None:
+            manifest.save()
+    if manifest is not None:
+        print('Unchanged：', manifest.skipped)
+    print('Error Files：', len(error_files['error']), ' No Take：', len(error_files['no_take']))
+    if getParseCache() is not None and workers <= 1:
+        print('Parse cache hits：', getParseCache().hits, ' misses：', getParseCache().misses)
+    getSymmetryCache().save()
 
     mongo.close()
     outFile.close()
 
 
+def extract_directory(file, collections, codec=None):
+    """
+    解析单个计算目录，返回计算类型及待入库文档
+    :param file: 计算目录
+    :param collections: 选择提取的计算类型
+    :param codec: ArrayCodec，不为None时文档中的数值数组保存为Binary
+    :return: (cal_type, bson)，计算类型不在collections中时bson为None
+    """
+    # 只列出一次目录，解析器在计算类第一次访问时才读取文件
+    file_parsers = ParserRegistry(file, parser_factories, first=('incar', 'vasprun'), cache=getParseCache(),
+                                  cached_methods=cached_methods, checks=parser_checks)
+    if file_parsers.sizes() > 20000 * 1024 * 1024:
+        raise ValueError("File too big")
+    # 完整解析vasprun.xml之前先判断计算类型，未选择的类型直接跳过
+    cal_type = prescan_type(file, file_parsers, collections)
+    if cal_type not in collections:
+        return cal_type, None
+    # 根据计算类型创建计算对象
+    cal_entry = CalculateEntries[cal_type](file_parsers)
+    cal_entry.asarray = codec is not None
+    bson = cal_entry.to_bson()
+    bson['SourcePath'] = os.path.abspath(file)
+    if codec is not None:
+        bson = codec.encode(bson)
+    return cal_type, bson
+
+
+def prescan_type(file, file_parsers, collections):
+    """
+    从名字或Incar 和 Vasprun对象中获取计算类型，优先名字
+    vasprun.xml只解析初始结构之前的incar/parameters，不做完整解析和对称性分析；没有vasprun.xml时使用INCAR和KPOINTS
+    :param file: 计算目录
+    :param file_parsers: ParserRegistry
+    :param collections: 选择提取的计算类型
+    :return: cal_type
+    """
+    parm = {}
+    if 'vasprun' in file_parsers:
+        header = Vasprun(file_parsers.path('vasprun'), header_only=True)
+        header.prescan()
+        parm = header.parameters
+    if 'incar' in file_parsers:
+        parm = file_parsers['incar'].fill_parameters(parm)
+    elif 'vasprun' not in file_parsers:
+        raise ValueError(
+            f"INCAR or vasprun.xml file is required to determine the calculation type")
+    return CalType.from_parameters(file, collections, parm)
+
+
+def save_document(writer, bson, cal_type, file=None):
+    """
+    文档交给BufferedWriter批量写入，编码后超过16M时最大的数组字段先存入GridFS
+    :param writer: Mongo.buffered()创建的BufferedWriter
+    :param bson: 文档
+    :param cal_type: 计算类型，即集合名
+    :param file: 计算目录，写入失败时用于记录
+    """
+    bson = writer.mongo.save_split(bson, writer.db)
+    return writer.add(bson, cal_type, key=file)
+
+
+def _init_worker(symmetry_cache, parse_cache_args=None):
+    """
+    子进程初始化，载入已持久化的对称性缓存；子进程不写文件，新增条目随结果交给主进程
+    解析结果缓存由各进程直接读写缓存目录
+    """
+    cache = SymmetryCache()
+    if symmetry_cache is not None and os.path.exists(symmetry_cache):
+        cache.load(symmetry_cache)
+    setSymmetryCache(cache)
+    if parse_cache_args is not None:
+        setParseCache(ParseCache(*parse_cache_args))
+
+
+def _extract_worker(file, collections, codec=None, hash_files=None):
+    """
+    进程池中执行的解析任务，异常以字符串形式返回，不中断整个任务
+    :param hash_files: 增量模式下需要计算md5的文件名，结果随解析结果返回给主进程
+    """
+    try:
+        cal_type, bson = extract_directory(file, collections, codec)
+        result = file, cal_type, bson, None
+    except Exception as e:
+        result = file, None, None, f'{type(e).__name__}: {e}'
+    hashes = fileHashes(file, hash_files) if hash_files else None
+    return result + (getSymmetryCache().drain(), hashes)
+
+
+def record_error(file, error, error_files, outFile):
+    """
+    按错误类型记录到error_files，无法提取的目录记入no_take
+    :return: 是否为无法提取(no_take)
+    """
+    if ("INCAR or vasprun.xml file is required to determine the calculation type" in error or
+            "不可同时无vasprun或poscar和incar" in error or
+            "无法判断提取类型，无法提取" in error or "File content error, not parse!" in error):
+        error_files['no_take'].append(file)
+        return True
+    print(file, ' ', error, file=outFile)
+    error_files['error'].append(file)
+    return False
+
+
+def parallel_extract(file_list, collections, writer, workers, error_files, outFile, symmetry_cache=None,
+                     manifest=None, codec=None, parse_cache_args=None):
+    """
+    多进程解析计算目录，主进程作为唯一的写入者批量入库
+    :param file_list: 计算目录列表或生成器
+    :param collections: 选择提取的计算类型
+    :param writer: BufferedWriter，只在主进程中使用
+    :param workers: 进程数
+    :param error_files: {'no_take': [], 'error': []}
+    :param outFile: 日志输出
+    :param symmetry_cache: 对称性缓存文件路径
+    :param manifest: 增量模式的文件指纹清单，入库或确认无法提取后记录
+    :param codec: ArrayCodec，在子进程中编码数组
+    :param parse_cache_args: 子进程创建ParseCache的参数(目录, 大小上限, use_hash)
+    :return:
+    """
+    # 限制同时提交的任务数，避免几十万个目录的结果堆积在内存中
+    max_pending = workers * 4
+    # future -> 计算目录
+    pending = {}
+    # 进程池崩溃时未完成的目录，重新提交到新的进程池
+    retry = []
+    attempts = {}
+    files = iter(file_list)
+
+    def finish(future, file):
+        try:
+            file, cal_type, bson, error, symmetry, hashes = future.result()
+        except BrokenProcessPool as e:
+            # 子进程被杀死(如内存不足)，无法确定是哪个目录导致，每个目录重试一次
+            attempts[file] = attempts.get(file, 0) + 1
+            if attempts[file] < MAX_POOL_ATTEMPTS:
+                retry.append(file)
+                return True
+            progress.update(1)
+            record_error(file, f'{type(e).__name__}: {e}', error_files, outFile)
+            return True
+        progress.update(1)
+        getSymmetryCache().update(symmetry)
+        if error is not None:
+            if record_error(file, error, error_files, outFile) and manifest is not None:
+                manifest.done(file, hashes)
+            return False
+        if bson is None:
+            # 计算类型不在选择的集合中
+            error_files['no_take'].append(file)
+            if manifest is not None:
+                manifest.done(file, hashes)
+            return False
+        try:
+            save_document(writer, bson, cal_type, file)
+        except Exception as e:
+            record_error(file, f'{type(e).__name__}: {e}', error_files, outFile)
+            return False
+        if manifest is not None:
+            manifest.done(file, hashes)
+        return False
+
+    executor = _create_pool(workers, symmetry_cache, parse_cache_args)
+    try:
+        with tqdm(total=len(file_list) if isinstance(file_list, list) else None) as progress:
+            while True:
+                while len(pending) < max_pending:
+                    file = retry.pop() if retry else next(files, None)
+                    if file is None:
+                        break
+                    hash_files = manifest.hashFiles(file) if manifest is not None else None
+                    pending[executor.submit(_extract_worker, file, collections, codec, hash_files)] = file
+                if not pending:
+                    break
+                # 等待解析结果时也按flush_interval写入已缓存的文档
+                done, _ = wait(pending, timeout=writer.flush_interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    broken |= finish(future, pending.pop(future))
+                writer.flush_due()
+                if broken:
+                    # 崩溃的进程池中其余任务很快都会结束(成功或BrokenProcessPool)，全部处理后换用新的进程池
+                    done, _ = wait(pending)
+                    for future in done:
+                        finish(future, pending.pop(future))
+                    executor.shutdown(wait=False)
+                    executor = _create_pool(workers, symmetry_cache, parse_cache_args)
+    finally:
+        executor.shutdown(wait=True)
+
+
+def _create_pool(workers, symmetry_cache=None, parse_cache_args=None):
+    # 目录发现线程仍在运行时fork子进程不安全，使用spawn启动
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(symmetry_cache, parse_cache_args))
+
+
 def findPaths(rootPath):
     total_path = []
     file_list = os.listdir(rootPath)
@@ -1,9 +1,16 @@
 import unittest
 import os
+import tempfile
 
 import numpy as np
 
+from entries.calculations.static_calculation import StaticCalculation
+from i_o.cache import CachedParser, ParseCache
+from i_o.registry import ParserRegistry
 from i_o.vasp.vasprun import Vasprun
+from public.trajectory import Trajectory
+from public.tools.helper import parseSetArray, SetAccumulator
+from user_view import cached_methods
 
 
 class TestVasprun(unittest.TestCase):
@@ -61,6 +68,108 @@ class TestVasprun(unittest.TestCase):
         start_time = vasprun.getStartTime()
         self.assertEqual(start_time, "2018-01-25 15:48:48")
 
+    def test_streaming(self):
+        vasprun = Vasprun(self.test_file)
+        streamed = Vasprun(self.test_file, streaming=True)
+        self.assertIsNone(streamed.root.find("./calculation[last()]/dos"))
+        self.assertEqual(streamed.getEfermi(), 5.75684372)
+        self.assertEqual(streamed.getEfermi(), vasprun.getEfermi())
+        self.assertEqual(streamed.getTotalDos(), vasprun.getTotalDos())
+        vasprun.kPoints = vasprun.getKPoints()
+        streamed.kPoints = streamed.getKPoints()
+        self.assertEqual(streamed.getEigenValues(), vasprun.getEigenValues())
+        self.assertEqual(len(streamed.root.findall("calculation")), len(vasprun.root.findall("calculation")))
+        for expected, actual in zip(vasprun.getEigenValueArrays(), streamed.getEigenValueArrays()):
+            self.assertTrue(np.array_equal(expected, actual))
+
+    def test_truncated(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "vasprun.xml")
+            with open(self.test_file, "rb") as f:
+                data = f.read()
+            with open(path, "wb") as f:
+                f.write(data[:len(data) // 2])
+            self.assertTrue(Vasprun.isComplete(self.test_file))
+            self.assertFalse(Vasprun.isComplete(path))
+            with self.assertRaises(ValueError):
+                Vasprun(path)
+            # 被截断的vasprun.xml不注册，计算类改用POSCAR/OUTCAR
+            factories = {'VASPRUN.XML': ('vasprun', Vasprun)}
+            with self.assertWarns(UserWarning):
+                registry = ParserRegistry(directory, factories, checks={'vasprun': Vasprun.isComplete})
+            self.assertNotIn('vasprun', registry)
+            self.assertIn('vasprun', ParserRegistry(directory, factories))
+
+    def test_set_accumulator(self):
+        vasprun = Vasprun(self.test_file)
+        elem = vasprun.root.find("./calculation[last()]/eigenvalues/array/set")
+        accumulator = SetAccumulator()
+
+        def feed(node):
+            accumulator.startSet()
+            for child in node:
+                if child.tag == 'set':
+                    feed(child)
+                else:
+                    accumulator.addRow(child.text)
+            accumulator.endSet()
+
+        feed(elem)
+        self.assertTrue(np.array_equal(accumulator.array(), parseSetArray(elem)))
+
+    def test_getEigenValueArrays(self):
+        vasprun = Vasprun(self.test_file)
+        eigenvalues, occupancies = vasprun.getEigenValueArrays()
+        self.assertEqual(eigenvalues.shape, occupancies.shape)
+        self.assertEqual(eigenvalues.shape[0], 2)
+        spin = vasprun.root.find("./calculation[last()]/eigenvalues/array/set/set")
+        first = [float(x) for x in spin.find("set").find("r").text.split()]
+        self.assertEqual([eigenvalues[0, 0, 0], occupancies[0, 0, 0]], first)
+
+    def test_prescan(self):
+        header = Vasprun(self.test_file, header_only=True)
+        self.assertIsNone(header.root.find("calculation"))
+        vasprun = Vasprun(self.test_file)
+        vasprun.setup()
+        self.assertEqual(header.prescan(), vasprun.calculationType)
+        self.assertEqual(header.parameters, vasprun.parameters)
+
+    def test_trajectory(self):
+        vasprun = Vasprun(self.test_file)
+        vasprun.setup()
+        trajectory = Trajectory.fromVasprun(vasprun)
+        nstep = len(vasprun.root.findall("calculation"))
+        nat = len(vasprun.sites_final)
+        self.assertEqual(trajectory.positions.shape, (nstep, nat, 3))
+        self.assertEqual(trajectory.forces.shape, (nstep, nat, 3))
+        self.assertEqual(trajectory.stresses.shape, (nstep, 3, 3))
+        self.assertEqual(len(trajectory.energies), nstep)
+        frames = trajectory.keyFrames()
+        self.assertEqual([frames[0], frames[-1]], [0, nstep - 1])
+        # 最后一步与输出结构一致
+        np.testing.assert_allclose(trajectory.lattices[-1], vasprun.output_structure.lattice.matrix)
+        self.assertEqual(trajectory.to_bson()['NumberOfSteps'], nstep)
+
+    def test_cached_calculation(self):
+        calls = []
+
+        def factory(path):
+            calls.append(path)
+            return Vasprun(path)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ParseCache(directory)
+            methods = cached_methods['vasprun']
+            first = StaticCalculation({'vasprun': CachedParser(factory, self.test_file, cache, methods)})
+            expected = (first.basicDoc, first.getThermoDynamicProperties())
+            second = StaticCalculation({'vasprun': CachedParser(factory, self.test_file, cache, methods)})
+            # 基本信息和热力学性质全部命中缓存时不解析vasprun.xml
+            self.assertEqual((second.basicDoc, second.getThermoDynamicProperties()), expected)
+            self.assertEqual(len(calls), 1)
+        self.assertEqual(expected[1]['TotalEnergy'], -434.14489264)
+        self.assertEqual(expected[0]['InputStructure']['NumberOfSites'], 48)
+
+
 
 if __name__ == "__main__":
     unittest.main()